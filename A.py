@@ -15,20 +15,71 @@
 4. تحذيرات واضحة
 """
 
+import time
+
+# بداية تشغيل السكربت الحالي (لقياس كلفة إعادة التشغيل وزمن أول عرض)
+_RERUN_STARTED_AT = time.perf_counter()
+
 import streamlit as st
-import pandas as pd
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, ForeignKey, Text, text, inspect
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship, Session as SQLSession
-from sqlalchemy.pool import NullPool
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from sqlalchemy import create_engine, Column, Integer, String, Float, Date, DateTime, ForeignKey, Text, text, inspect
+from sqlalchemy import Table, Index, select, insert, exists, or_, and_, case, cast, func, bindparam, event, literal_column
+from sqlalchemy.orm import sessionmaker, declarative_base, relationship, selectinload, joinedload, Session as SQLSession
+from sqlalchemy.pool import NullPool, QueuePool
+from sqlalchemy.exc import DisconnectionError
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql import ClauseElement
 from datetime import date, datetime
+from functools import wraps
 import hashlib
+import inspect as py_inspect
 import io
+import pickle
 import base64
 import os
+import re
 import shutil
-import base64
-import numpy
-import psycopg2
+import sys
+import importlib
+import subprocess
+import tempfile
+import threading
+import types
+from collections import deque, OrderedDict
+
+
+# ===== تحميل كسول للمكتبات الثقيلة =====
+# pandas و numpy لا تُحمَّل إلا عند أول صفحة تحتاجها (صفحة الدخول لا تحتاجها)
+# dateutil و openpyxl تُستورد أصلاً داخل الدوال التي تستخدمها
+
+@st.cache_resource
+def get_cold_start_marks():
+    """علامات بدء التشغيل البارد على مستوى العملية"""
+    return {"first_run_started_at": _RERUN_STARTED_AT, "first_renders": {}, "modules": {}}
+
+
+class LazyModule:
+    """وكيل يؤجل استيراد المكتبة حتى أول وصول لإحدى خصائصها"""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        module = sys.modules.get(self._name)
+        if module is None:
+            t0 = time.perf_counter()
+            module = importlib.import_module(self._name)
+            get_cold_start_marks()["modules"].setdefault(self._name, {
+                "load_ms": round((time.perf_counter() - t0) * 1000, 1),
+                "loaded_at": datetime.now(),
+            })
+        value = getattr(module, attr)
+        setattr(self, attr, value)  # الوصول التالي لا يمر عبر __getattr__
+        return value
+
+
+pd = LazyModule("pandas")
+np = LazyModule("numpy")
 
 
 # ==========================================
@@ -120,57 +171,104 @@ st.markdown("""
 Base = declarative_base()
 
 
-# جلب الرابط من secrets
-conn_url = st.secrets["connections"]["postgresql"]["url"]
 
-try:
-    conn = psycopg2.connect(conn_url)
-    st.success("✅ تم الاتصال بنجاح بـ Supabase!")
-    conn.close()
-except Exception as e:
-    st.error(f"❌ فشل الاتصال: {e}")
+# ===== ملف إعدادات SQLite للتزامن العالي =====
+# تُطبَّق عند فتح كل اتصال جديد بالمجمّع
+SQLITE_PRAGMAS = {
+    "busy_timeout": 10000,          # انتظار القفل 10 ثوانٍ بدل الفشل الفوري (أولاً: التحويل إلى WAL يحتاج القفل)
+    "auto_vacuum": "INCREMENTAL",   # يسري على القواعد الجديدة (القديمة تُحوَّل يدوياً من لوحة SQLite)
+    "journal_mode": "WAL",          # القراءة لا تنتظر الكتابة
+    "synchronous": "NORMAL",        # آمن مع WAL وأسرع من FULL
+    "mmap_size": 268435456,         # 256MB قراءة عبر الذاكرة
+    "cache_size": -16000,           # ~16MB لكل اتصال
+    "temp_store": "MEMORY",
+}
+
+def apply_sqlite_profile(engine, pragmas=SQLITE_PRAGMAS):
+    """تسجيل مستمع connect يطبّق إعدادات PRAGMA على كل اتصال SQLite"""
+    def _set_pragmas(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    event.listen(engine, "connect", _set_pragmas)
+    return engine
+
+def checkpoint_sqlite_wal(engine):
+    """دمج ملف WAL في ملف القاعدة (قبل النسخ الاحتياطي أو الاسترجاع)"""
+    if engine.dialect.name != "sqlite":
+        return None
+    with engine.connect() as conn:
+        return tuple(conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)").one())
+
+
+# ===== أنماط تجميع الاتصالات =====
+# تُحدَّد من secrets: [connections.postgresql] pool_mode = "pooled" | "external" | "transaction"
+# (الافتراضي auto: المنفذ 6543 يعني Supabase transaction pooler)
+POOL_MODES = ("pooled", "external", "transaction")
+TRANSACTION_POOLER_PORT = 6543
+LIVENESS_IDLE_SECONDS = 60     # فحص الاتصال فقط إذا بقي خاملاً أكثر من ذلك
+
+def resolve_pool_mode(config, url):
+    """تحديد نمط التجميع من الإعدادات أو من منفذ الخادم"""
+    mode = config.get("pool_mode", "auto")
+    if mode == "auto":
+        mode = "transaction" if url.port == TRANSACTION_POOLER_PORT else "pooled"
+    if mode not in POOL_MODES:
+        raise ValueError(f"pool_mode غير معروف: {mode} (المتاح: {', '.join(POOL_MODES)})")
+    return mode
+
+def build_postgres_engine(config):
+    """
+    🚀 إنشاء محرك PostgreSQL حسب نمط التجميع:
+    - pooled: مجمّع داخلي (اتصال مباشر أو session pooler)
+    - external: NullPool، التجميع يتم في PgBouncer/Supavisor
+    - transaction: مجمّع صغير آمن لـ transaction pooler (لا حالة على مستوى الجلسة)
+    """
+    db_url = config["url"]
+
+    # تصحيح التوافق
+    if db_url.startswith('postgres://'):
+        db_url = db_url.replace('postgres://', 'postgresql://', 1)
+
+    mode = resolve_pool_mode(config, make_url(db_url))
+    connect_args = {
+        "connect_timeout": 10,
+        "keepalives": 1,          # ✅ الحفاظ على الاتصال حي
+        "keepalives_idle": 30,    # ✅ فحص كل 30 ثانية
+        "keepalives_interval": 10,
+        "keepalives_count": 5,
+    }
+
+    if mode == "external":
+        engine = create_engine(db_url, poolclass=NullPool, connect_args=connect_args)
+    else:
+        engine = create_engine(
+            db_url,
+            pool_size=int(config.get("pool_size", 5)),
+            max_overflow=int(config.get("max_overflow", 10)),
+            pool_timeout=30,
+            pool_recycle=280,
+            # في transaction pooler: إعادة استخدام أحدث اتصال تترك الباقي يخمل ويُغلق
+            pool_use_lifo=(mode == "transaction"),
+            connect_args=connect_args,
+        )
+    return engine, mode
+
 
 # ===== دالة الاتصال الذكية =====
-# ==========================================
-# تحسين إعدادات PostgreSQL - استبدل get_database_engine()
-# ==========================================
-
 @st.cache_resource
 def get_database_engine():
-    """🚀 اتصال محسّن بـ PostgreSQL"""
+    """🚀 اتصال PostgreSQL حسب نمط التجميع، مع SQLite كبديل احتياطي"""
     try:
         if hasattr(st, 'secrets') and "connections" in st.secrets:
-            db_url = st.secrets["connections"]["postgresql"]["url"]
-            
-            # تصحيح التوافق
-            if db_url.startswith('postgres://'):
-                db_url = db_url.replace('postgres://', 'postgresql://', 1)
-            
-            # ✅ إعدادات محسّنة للأداء
-            engine = create_engine(
-                db_url,
-                pool_pre_ping=True,          # فحص الاتصال قبل الاستخدام
-                pool_recycle=280,             # تجديد الاتصالات كل 280 ثانية
-                pool_size=5,                  # ✅ عدد الاتصالات النشطة (كان مفقود)
-                max_overflow=10,              # ✅ اتصالات إضافية عند الحاجة
-                pool_timeout=30,              # ✅ وقت الانتظار للحصول على اتصال
-                echo=False,                   # ✅ إيقاف SQL logging (يسرّع الأداء)
-                connect_args={
-                    "connect_timeout": 10,
-                    "keepalives": 1,          # ✅ الحفاظ على الاتصال حي
-                    "keepalives_idle": 30,    # ✅ فحص كل 30 ثانية
-                    "keepalives_interval": 10,
-                    "keepalives_count": 5,
-                }
-            )
+            engine, pool_mode = build_postgres_engine(st.secrets["connections"]["postgresql"])
             
             # اختبار الاتصال
             with engine.connect() as conn:
                 conn.execute(text("SELECT 1"))
-            return engine, "postgresql"
-            
-            st.success("✅ Connected to PostgreSQL - Optimized!")
-            return engine, "postgresql"
+            return engine, "postgresql", pool_mode
             
     except Exception as e:
         st.warning(f"⚠️ PostgreSQL failed: {e}")
@@ -181,15 +279,216 @@ def get_database_engine():
     engine = create_engine(
         f'sqlite:///{DB_PATH}',
         connect_args={'check_same_thread': False},
-        pool_pre_ping=True
     )
+    apply_sqlite_profile(engine)
     
     st.error("⚠️ Using SQLite - Data is TEMPORARY!")
-    return engine, "sqlite"
+    return engine, "sqlite", "pooled"
 
 
 # إنشاء الاتصال
-engine, db_type = get_database_engine()
+engine, db_type, pool_mode = get_database_engine()
+
+
+# ===== مراقبة المجمّع وفحص الحيوية =====
+class PoolMonitor:
+    """
+    إحصائيات المجمّع (التزامن الفعلي) + فحص حيوية حسب مدة الخمول بدل pool_pre_ping:
+    لا يُرسل SELECT 1 إلا لاتصال بقي خاملاً أكثر من idle_seconds
+    """
+
+    def __init__(self, engine, mode, idle_seconds=LIVENESS_IDLE_SECONDS):
+        self.mode = mode
+        self.idle_seconds = idle_seconds
+        self.lock = threading.Lock()
+        self.checked_out = 0
+        self.peak = 0
+        self.checkouts = 0
+        self.pings = 0
+        self.ping_failures = 0
+        self.concurrency = {}   # عدد الاتصالات المستخدمة لحظة كل checkout → التكرار
+        self.started_at = time.time()
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+        self.liveness = engine.dialect.name == "postgresql" and not isinstance(engine.pool, NullPool)
+        if self.liveness:
+            event.listen(engine, "checkout", self._check_liveness, insert=True)
+
+    def _check_liveness(self, dbapi_conn, connection_record, connection_proxy):
+        idle_since = connection_record.info.get("idle_since")
+        if idle_since is None or time.monotonic() - idle_since < self.idle_seconds:
+            return
+        self.pings += 1
+        try:
+            cursor = dbapi_conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            dbapi_conn.rollback()
+        except Exception:
+            self.ping_failures += 1
+            # المجمّع يُبطل الاتصال ويعيد المحاولة باتصال جديد
+            raise DisconnectionError()
+
+    def _on_checkout(self, dbapi_conn, connection_record, connection_proxy):
+        with self.lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.peak = max(self.peak, self.checked_out)
+            self.concurrency[self.checked_out] = self.concurrency.get(self.checked_out, 0) + 1
+
+    def _on_checkin(self, dbapi_conn, connection_record):
+        connection_record.info["idle_since"] = time.monotonic()
+        with self.lock:
+            self.checked_out = max(0, self.checked_out - 1)
+
+    def concurrency_percentile(self, q):
+        total = sum(self.concurrency.values())
+        if not total:
+            return 0
+        seen = 0
+        for level in sorted(self.concurrency):
+            seen += self.concurrency[level]
+            if seen >= total * q:
+                return level
+        return self.peak
+
+    def sizing_guidance(self, pool):
+        """توصية حجم المجمّع من التزامن المقاس"""
+        p95 = self.concurrency_percentile(0.95)
+        advice = {"p95": p95, "peak": self.peak}
+        if self.mode == "external":
+            minutes = max((time.time() - self.started_at) / 60, 1 / 60)
+            advice["text"] = (f"NullPool: كل checkout اتصال جديد ({self.checkouts / minutes:.1f}/دقيقة). "
+                              f"اضبط حجم مجمّع PgBouncer على ≥ {max(p95, 1)} لكل نسخة من التطبيق.")
+            return advice
+        pool_size = max(2, p95)
+        max_overflow = max(2, self.peak - pool_size + 2)
+        advice["pool_size"] = pool_size
+        advice["max_overflow"] = max_overflow
+        current = f"{pool.size()}+{pool._max_overflow}" if isinstance(pool, QueuePool) else "-"
+        advice["text"] = (f"الحالي {current} | المقترح pool_size={pool_size}, max_overflow={max_overflow} "
+                          f"(p95 التزامن={p95}, الذروة={self.peak}).")
+        if self.mode == "transaction":
+            advice["text"] += " في transaction pooler يحدد حجم مجمّع Supavisor الاتصالات الفعلية بالخادم."
+        return advice
+
+
+@st.cache_resource
+def get_pool_monitor(_engine, mode):
+    """تسجيل مستمعي المجمّع مرة واحدة لكل عملية"""
+    return PoolMonitor(_engine, mode)
+
+
+pool_monitor = get_pool_monitor(engine, pool_mode)
+
+
+# ===== قياس كلفة إعادة التشغيل =====
+RERUN_SAMPLES = 200
+
+class RerunMetrics:
+    """عدّاد استعلامات لكل خيط + آخر عينات إعادة التشغيل (مشترك على مستوى العملية)"""
+
+    def __init__(self, engine):
+        self.local = threading.local()
+        self.samples = deque(maxlen=RERUN_SAMPLES)
+        self.interactions = deque(maxlen=RERUN_SAMPLES)
+        event.listen(engine, "before_cursor_execute", self._count_statement)
+
+    def _count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.local.statements = self.statements() + 1
+
+    def statements(self):
+        return getattr(self.local, "statements", 0)
+
+    def begin(self):
+        """بداية إعادة تشغيل جديدة في هذا الخيط"""
+        self.local.baseline = self.statements()
+
+    def absorb(self, count):
+        """إضافة استعلامات نُفذت في خيوط مساعدة (run_concurrently) لعدّاد هذا الخيط"""
+        self.local.statements = self.statements() + count
+
+    def record(self, page, started_at):
+        """
+        تسجيل الزمن وعدد الاستعلامات المنفذة قبل تشغيل دالة الصفحة
+        (started_at يُمرَّر صراحة لأن الكائن مخزّن عبر إعادات التشغيل)
+        """
+        self.samples.append({
+            "الوقت": datetime.now().strftime('%H:%M:%S'),
+            "الصفحة": page,
+            "الزمن (ms)": round((time.perf_counter() - started_at) * 1000, 2),
+            "الاستعلامات": self.statements() - getattr(self.local, "baseline", 0),
+        })
+
+    def record_interaction(self, section, kind, started_at):
+        """كلفة التفاعل كاملاً: تشغيل الصفحة كلها أو إعادة تشغيل جزئية لقسم منها (fragment)"""
+        self.interactions.append({
+            "الوقت": datetime.now().strftime('%H:%M:%S'),
+            "القسم": section,
+            "النوع": kind,
+            "الزمن (ms)": round((time.perf_counter() - started_at) * 1000, 2),
+            "الاستعلامات": self.statements() - getattr(self.local, "baseline", 0),
+        })
+
+
+@st.cache_resource
+def get_rerun_metrics(_engine):
+    """يُسجَّل مستمع المحرك مرة واحدة فقط لكل عملية"""
+    return RerunMetrics(_engine)
+
+
+rerun_metrics = get_rerun_metrics(engine)
+rerun_metrics.begin()
+
+# ===== إحصائيات ذاكرة ترجمة SQL (compiled cache) =====
+COMPILE_STATS_STATEMENTS = 200  # عدد نصوص SQL المتتبعة (الأقدم استخداماً يُحذف)
+
+class CompileCacheStats:
+    """إصابات compiled cache في SQLAlchemy لكل محرك ولكل نص SQL (من context.cache_hit)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.engines = {}
+        self.totals = {}
+        self.by_sql = OrderedDict()
+
+    def watch(self, engine, label):
+        self.engines[label] = engine
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            self._record(label, statement, context)
+
+        event.listen(engine, "before_cursor_execute", record)
+
+    def _record(self, label, statement, context):
+        state = getattr(context, "cache_hit", None)
+        state = {"CACHE_HIT": "hit", "CACHE_MISS": "miss"}.get(getattr(state, "name", str(state)), "raw")
+        with self.lock:
+            counts = self.totals.setdefault(label, {"hit": 0, "miss": 0, "raw": 0})
+            counts[state] += 1
+            entry = self.by_sql.get(statement)
+            if entry is None:
+                entry = self.by_sql[statement] = {"hit": 0, "miss": 0, "raw": 0}
+                if len(self.by_sql) > COMPILE_STATS_STATEMENTS:
+                    self.by_sql.popitem(last=False)
+            else:
+                self.by_sql.move_to_end(statement)
+            entry[state] += 1
+
+    def cache_size(self, label):
+        """(المدخلات، السعة) لذاكرة الترجمة في المحرك"""
+        cache = getattr(self.engines[label], "_compiled_cache", None)
+        return (len(cache), cache.capacity) if cache is not None else (0, 0)
+
+
+@st.cache_resource
+def get_compile_cache_stats(_engine):
+    stats = CompileCacheStats()
+    stats.watch(_engine, "primary")
+    return stats
+
+
+compile_cache = get_compile_cache_stats(engine)
 
 # ===== Session Factory الآمنة =====
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
@@ -241,6 +540,11 @@ class Unit(Base):
     usage_type = Column(String)
     status = Column(String, default="فاضي")
     asset = relationship("Asset")
+    contracts = relationship("Contract", secondary="contract_units", back_populates="units")
+
+    __table_args__ = (
+        Index('ix_units_asset_status', 'asset_id', 'status'),
+    )
 
 class Tenant(Base):
     __tablename__ = 'tenants'
@@ -254,6 +558,61 @@ class Tenant(Base):
     notes = Column(Text)
     created_date = Column(Date, default=date.today)
 
+    __table_args__ = (
+        Index('ix_tenants_name', 'name'),
+    )
+
+# رقم إصدار مخطط قاعدة البيانات (صف واحد id=1) - يُقرأ عند بدء التشغيل بدلاً من فحص الأعمدة
+schema_version = Table(
+    'schema_version', Base.metadata,
+    Column('id', Integer, primary_key=True),
+    Column('version', Integer, nullable=False),
+    Column('applied_at', DateTime),
+)
+
+# إصدار لكل جدول تعتمد عليه الذاكرة المؤقتة (مشترك بين كل عمليات Streamlit)
+cache_versions = Table(
+    'cache_versions', Base.metadata,
+    Column('table_name', String, primary_key=True),
+    Column('version', Integer, nullable=False, default=0),
+    Column('updated_at', DateTime),
+)
+
+# ملخص مؤشرات اللوحة (صف واحد id=1) تحدّثه مشغّلات قاعدة البيانات داخل معاملة كل كتابة
+# المتأخرات محسوبة حتى overdue_as_of (غير شامل): القراءة تضيف ما صار متأخراً بعده، والمطابقة الليلية ترحّله
+kpi_summary = Table(
+    'kpi_summary', Base.metadata,
+    Column('id', Integer, primary_key=True),
+    Column('paid_income', Float, nullable=False, default=0.0),
+    Column('overdue_count', Integer, nullable=False, default=0),
+    Column('overdue_amount', Float, nullable=False, default=0.0),
+    Column('overdue_as_of', Date, nullable=False),
+    Column('rented_units', Integer, nullable=False, default=0),
+    Column('empty_units', Integer, nullable=False, default=0),
+    Column('reconciled_at', DateTime),
+    Column('last_drift', Text),
+)
+
+# تجميع يومي للتحصيل لكل أصل (تحدّثه المشغّلات): المستحق والمتبقي حسب يوم الاستحقاق،
+# والمحصّل حسب يوم السداد. المتأخر = المتبقي للأيام السابقة لليوم (يُشتق عند القراءة)
+collections_daily = Table(
+    'collections_daily', Base.metadata,
+    Column('asset_id', Integer, primary_key=True),   # 0 = عقد بلا وحدات مرتبطة
+    Column('day', Date, primary_key=True),
+    Column('amount_due', Float, nullable=False, default=0.0),
+    Column('amount_collected', Float, nullable=False, default=0.0),
+    Column('amount_outstanding', Float, nullable=False, default=0.0),
+)
+
+# جدول ربط العقود بالوحدات (بديل الحقل النصي linked_units_ids)
+# المفتاح الأساسي (contract_id, unit_id) يغطي البحث بالعقد، والفهرس الإضافي يغطي البحث بالوحدة
+contract_units = Table(
+    'contract_units', Base.metadata,
+    Column('contract_id', Integer, ForeignKey('contracts.id', ondelete='CASCADE'), primary_key=True),
+    Column('unit_id', Integer, ForeignKey('units.id', ondelete='CASCADE'), primary_key=True),
+    Index('ix_contract_units_unit_id', 'unit_id'),
+)
+
 class Contract(Base):
     __tablename__ = 'contracts'
     id = Column(Integer, primary_key=True)
@@ -265,12 +624,18 @@ class Contract(Base):
     start_date = Column(Date)
     end_date = Column(Date)
     vat_rate = Column(Float, default=0.0)
-    linked_units_ids = Column(String)
+    linked_units_ids = Column(String)  # ⚠️ قديم: يُقرأ فقط لترحيل البيانات إلى contract_units
     status = Column(String, default="نشط")
     cancellation_reason = Column(Text, nullable=True)
     cancelled_by = Column(String, nullable=True)
     cancellation_date = Column(Date, nullable=True)
     tenant = relationship("Tenant")
+    units = relationship("Unit", secondary=contract_units, back_populates="contracts", order_by="Unit.id")
+
+    __table_args__ = (
+        Index('ix_contracts_status_end_date', 'status', 'end_date'),
+        Index('ix_contracts_tenant_id', 'tenant_id'),
+    )
 
 class Payment(Base):
     __tablename__ = 'payments'
@@ -289,11 +654,866 @@ class Payment(Base):
     payment_method = Column(String)
     contract = relationship("Contract")
 
-# إنشاء الجداول
-Base.metadata.create_all(engine)
+    __table_args__ = (
+        Index('ix_payments_contract_due_date', 'contract_id', 'due_date'),
+        Index('ix_payments_status_due_date', 'status', 'due_date'),
+        # فهرس جزئي للدفعات غير المدفوعة فقط (التنبيهات والمتأخرات)
+        Index(
+            'ix_payments_unpaid_due_date', 'due_date',
+            postgresql_where=(status != 'مدفوع'),
+            sqlite_where=(status != 'مدفوع')
+        ),
+        # فهرس جزئي يغطي تقرير أعمار الذمم (المبالغ المتبقية فقط، مرتب حسب العقد)
+        Index(
+            'ix_payments_aging', 'contract_id', 'due_date', 'remaining_amount',
+            postgresql_where=(remaining_amount > 0),
+            sqlite_where=(remaining_amount > 0)
+        ),
+    )
+
+
+# ==========================================
+# 4. تحديث الجداول الموجودة (Migration)
+# ==========================================
+
+def backfill_contract_units(conn):
+    """ترحيل روابط الوحدات من الحقل النصي القديم linked_units_ids إلى جدول contract_units"""
+    # العقود التي لديها نص وحدات ولم تُرحّل بعد فقط
+    pending = conn.execute(
+        select(Contract.id, Contract.linked_units_ids).where(
+            Contract.linked_units_ids.isnot(None),
+            Contract.linked_units_ids != '',
+            ~exists().where(contract_units.c.contract_id == Contract.id)
+        )
+    ).all()
+    if not pending:
+        return 0
+
+    valid_unit_ids = set(conn.execute(select(Unit.id)).scalars())
+    rows = []
+    for contract_id, ids_str in pending:
+        unit_ids = {int(x) for x in ids_str.split(',') if x.strip().isdigit()}
+        rows.extend(
+            {"contract_id": contract_id, "unit_id": uid}
+            for uid in sorted(unit_ids) if uid in valid_unit_ids
+        )
+
+    if rows:
+        conn.execute(contract_units.insert(), rows)
+    return len(rows)
+
+def ensure_indexes(conn):
+    """إنشاء الفهارس المعرّفة على النماذج في قواعد البيانات الموجودة مسبقاً"""
+    # create_all لا يضيف الفهارس الجديدة إلى جداول موجودة، لذلك ننشئها هنا إن لم توجد
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+# ===== سجل الهجرات المرقّمة =====
+# كل هجرة تُنفَّذ مرة واحدة فقط، ورقم آخر هجرة مطبقة محفوظ في جدول schema_version
+MIGRATIONS = []
+# الجداول التي تُبلَّغ تغييراتها لكل العمليات (NOTIFY app_cache / جدول cache_versions)
+CACHE_INVALIDATION_TABLES = ("payments", "contracts", "units", "tenants", "assets", "contract_units")
+CACHE_EPOCH = "__epoch__"
+MIGRATION_LOCK_KEY = 724501  # مفتاح advisory lock على PostgreSQL
+
+def migration(version, description):
+    """تسجيل هجرة برقم إصدار تصاعدي"""
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return register
+
+def _add_column(conn, table, column, ddl_type):
+    """إضافة عمود إن لم يكن موجوداً (الفحص يحدث فقط أثناء تطبيق الهجرة)"""
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {ddl_type}"))
+    elif column not in {col['name'] for col in inspect(conn).get_columns(table)}:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+@migration(1, "إضافة حالة العقد contracts.status")
+def _m001_contract_status(conn):
+    _add_column(conn, "contracts", "status", "VARCHAR DEFAULT 'نشط'")
+
+@migration(2, "إضافة سبب الإلغاء contracts.cancellation_reason")
+def _m002_cancellation_reason(conn):
+    _add_column(conn, "contracts", "cancellation_reason", "TEXT")
+
+@migration(3, "إضافة المبلغ المدفوع payments.paid_amount")
+def _m003_paid_amount(conn):
+    _add_column(conn, "payments", "paid_amount", "FLOAT DEFAULT 0.0")
+
+@migration(4, "إضافة بيانات الإلغاء cancelled_by / cancellation_date")
+def _m004_cancellation_audit(conn):
+    _add_column(conn, "contracts", "cancelled_by", "VARCHAR")
+    _add_column(conn, "contracts", "cancellation_date", "DATE")
+
+@migration(5, "ترحيل روابط الوحدات إلى جدول contract_units")
+def _m005_contract_units(conn):
+    backfill_contract_units(conn)
+
+@migration(6, "فهارس مسارات الاستعلام الساخنة")
+def _m006_hot_indexes(conn):
+    ensure_indexes(conn)
+
+@migration(7, "جدول إصدارات الذاكرة المؤقتة cache_versions")
+def _m007_cache_versions(conn):
+    existing = set(conn.execute(select(cache_versions.c.table_name)).scalars())
+    rows = [{"table_name": t, "version": 0, "updated_at": datetime.now()}
+            for t in CACHE_INVALIDATION_TABLES if t not in existing]
+    if rows:
+        conn.execute(cache_versions.insert(), rows)
+
+def rotate_cache_epoch(conn):
+    """بصمة جديدة للقاعدة: لا تُطابق أي مفتاح مخزّن من قبل (قاعدة جديدة أو مسترجعة من نسخة)"""
+    epoch = {"version": int.from_bytes(os.urandom(4), "big") >> 1, "updated_at": datetime.now()}
+    if not conn.execute(cache_versions.update().where(cache_versions.c.table_name == CACHE_EPOCH).values(**epoch)).rowcount:
+        conn.execute(cache_versions.insert().values(table_name=CACHE_EPOCH, **epoch))
+
+@migration(8, "بصمة القاعدة للذاكرة المؤقتة المشتركة (__epoch__)")
+def _m008_cache_epoch(conn):
+    # قاعدة جديدة أو مختلفة = بصمة مختلفة، فلا تُعاد قيم محسوبة من قاعدة أخرى بنفس أرقام الإصدارات
+    exists_ = conn.execute(
+        select(cache_versions.c.table_name).where(cache_versions.c.table_name == CACHE_EPOCH)
+    ).first()
+    if not exists_:
+        rotate_cache_epoch(conn)
+
+# ===== ملخص المؤشرات المُحدَّث تدريجياً (kpi_summary) =====
+# كل دفعة/عقد/وحدة تُضاف أو تُعدَّل أو تُحذف تطبّق فرقها على الصف الوحيد داخل نفس المعاملة.
+# مشغّلات قاعدة البيانات (لا أحداث ORM) لأن جداول الدفعات تُدرج بـ executemany/COPY خارج flush.
+KPI_DRIFT_TOLERANCE = 0.01   # فرق المبالغ المقبول (تراكم أخطاء الفاصلة العائمة)
+KPI_RECONCILE_HOUR = 3       # ساعة المطابقة الليلية
+KPI_RECONCILE_TASK = "مطابقة ملخص المؤشرات"
+ROLLUP_RECONCILE_TASK = "مطابقة تجميع التحصيل"
+
+
+def _kpi_payment_delta(row, op):
+    """UPDATE يضيف (+) أو يطرح (-) مساهمة دفعة واحدة (NEW/OLD) إذا كان عقدها نشطاً"""
+    overdue = f"{row}.status <> 'مدفوع' AND {row}.due_date < overdue_as_of"
+    return f"""UPDATE kpi_summary SET
+        paid_income = paid_income {op} CASE WHEN {row}.status = 'مدفوع' THEN COALESCE({row}.total, 0) ELSE 0 END,
+        overdue_count = overdue_count {op} CASE WHEN {overdue} THEN 1 ELSE 0 END,
+        overdue_amount = overdue_amount {op} CASE WHEN {overdue} THEN COALESCE({row}.total, 0) ELSE 0 END
+    WHERE id = 1 AND EXISTS (
+        SELECT 1 FROM contracts WHERE contracts.id = {row}.contract_id AND contracts.status = 'نشط'
+    )"""
+
+
+def _kpi_contract_delta(row, op):
+    """
+    UPDATE يضيف أو يطرح مساهمة كل دفعات عقد نشط (عند تغيّر حالته أو إضافته أو حذفه)؛
+    الشروط داخل CASE حتى لا يُفضّل المخطط فهرس الحالة على فهرس العقد
+    """
+    payments = f"FROM payments p WHERE p.contract_id = {row}.id"
+    overdue = "p.status <> 'مدفوع' AND p.due_date < kpi_summary.overdue_as_of"
+    return f"""UPDATE kpi_summary SET
+        paid_income = paid_income {op} (
+            SELECT COALESCE(SUM(CASE WHEN p.status = 'مدفوع' THEN p.total END), 0) {payments}),
+        overdue_count = overdue_count {op} (SELECT COUNT(CASE WHEN {overdue} THEN 1 END) {payments}),
+        overdue_amount = overdue_amount {op} (
+            SELECT COALESCE(SUM(CASE WHEN {overdue} THEN p.total END), 0) {payments})
+    WHERE id = 1 AND {row}.status = 'نشط'"""
+
+
+def _kpi_unit_delta(row, op):
+    return f"""UPDATE kpi_summary SET
+        rented_units = rented_units {op} CASE WHEN {row}.status = 'مؤجر' THEN 1 ELSE 0 END,
+        empty_units = empty_units {op} CASE WHEN {row}.status = 'فاضي' THEN 1 ELSE 0 END
+    WHERE id = 1"""
+
+
+# (الاسم، الجدول، الحدث، شرط WHEN، جمل التحديث)
+KPI_TRIGGERS = (
+    ("kpi_payments_ins", "payments", "INSERT", None, [_kpi_payment_delta("NEW", "+")]),
+    ("kpi_payments_upd", "payments", "UPDATE OF status, total, due_date, contract_id", None,
+     [_kpi_payment_delta("OLD", "-"), _kpi_payment_delta("NEW", "+")]),
+    ("kpi_payments_del", "payments", "DELETE", None, [_kpi_payment_delta("OLD", "-")]),
+    ("kpi_contracts_ins", "contracts", "INSERT", "NEW.status = 'نشط'", [_kpi_contract_delta("NEW", "+")]),
+    ("kpi_contracts_upd", "contracts", "UPDATE OF status",
+     "COALESCE(OLD.status, '') <> COALESCE(NEW.status, '') AND (OLD.status = 'نشط' OR NEW.status = 'نشط')",
+     [_kpi_contract_delta("OLD", "-"), _kpi_contract_delta("NEW", "+")]),
+    ("kpi_contracts_del", "contracts", "DELETE", "OLD.status = 'نشط'", [_kpi_contract_delta("OLD", "-")]),
+    ("kpi_units_ins", "units", "INSERT", None, [_kpi_unit_delta("NEW", "+")]),
+    ("kpi_units_upd", "units", "UPDATE OF status", None, [_kpi_unit_delta("OLD", "-"), _kpi_unit_delta("NEW", "+")]),
+    ("kpi_units_del", "units", "DELETE", None, [_kpi_unit_delta("OLD", "-")]),
+)
+
+
+def _kpi_trigger_ddl(dialect, name, table, event_, when, statements):
+    """نص DDL للمشغّل: دالة plpgsql + CREATE TRIGGER على PostgreSQL، أو مشغّل SQLite مباشر"""
+    body = ";\n".join(statements) + ";"
+    if dialect == "postgresql":
+        return [
+            f"CREATE OR REPLACE FUNCTION {name}() RETURNS trigger LANGUAGE plpgsql AS $$\n"
+            f"BEGIN\n{body}\nRETURN NULL;\nEND $$",
+            f"DROP TRIGGER IF EXISTS {name} ON {table}",
+            f"CREATE TRIGGER {name} AFTER {event_} ON {table} FOR EACH ROW"
+            + (f" WHEN ({when})" if when else "") + f" EXECUTE FUNCTION {name}()",
+        ]
+    return [
+        f"DROP TRIGGER IF EXISTS {name}",
+        f"CREATE TRIGGER {name} AFTER {event_} ON {table} FOR EACH ROW"
+        + (f" WHEN {when}" if when else "") + f"\nBEGIN\n{body}\nEND",
+    ]
+
+
+def install_kpi_triggers(conn):
+    for spec in KPI_TRIGGERS:
+        for ddl in _kpi_trigger_ddl(conn.dialect.name, *spec):
+            conn.exec_driver_sql(ddl)
+
+
+def compute_kpis(conn, as_of):
+    """حساب المؤشرات من الصفر (المطابقة وإعادة البناء فقط، لا تُستدعى من اللوحة)"""
+    active = Contract.status == "نشط"
+    paid_income = conn.execute(
+        select(func.coalesce(func.sum(Payment.total), 0))
+        .join(Contract, Payment.contract_id == Contract.id)
+        .where(Payment.status == "مدفوع", active)
+    ).scalar()
+    overdue_count, overdue_amount = conn.execute(
+        select(func.count(Payment.id), func.coalesce(func.sum(Payment.total), 0))
+        .join(Contract, Payment.contract_id == Contract.id)
+        .where(Payment.status != "مدفوع", Payment.due_date < as_of, active)
+    ).one()
+    units = dict(conn.execute(select(Unit.status, func.count(Unit.id)).group_by(Unit.status)).all())
+    return {
+        "paid_income": float(paid_income or 0),
+        "overdue_count": overdue_count or 0,
+        "overdue_amount": float(overdue_amount or 0),
+        "overdue_as_of": as_of,
+        "rented_units": units.get("مؤجر", 0),
+        "empty_units": units.get("فاضي", 0),
+    }
+
+
+def write_kpi_summary(conn, values):
+    if not conn.execute(kpi_summary.update().where(kpi_summary.c.id == 1).values(**values)).rowcount:
+        conn.execute(kpi_summary.insert().values(id=1, **values))
+
+
+def _kpi_became_overdue(aggregate):
+    """الدفعات التي صارت متأخرة بين overdue_as_of و :today (عبر الفهرس الجزئي للدفعات غير المدفوعة)"""
+    return select(aggregate)\
+        .join(Contract, Payment.contract_id == Contract.id)\
+        .where(
+            Payment.status != "مدفوع", Contract.status == "نشط",
+            Payment.due_date >= kpi_summary.c.overdue_as_of, Payment.due_date < bindparam("today"),
+        ).scalar_subquery()
+
+
+def kpi_roll_forward_statement():
+    """ترحيل المتأخرات من overdue_as_of إلى :today في جملة UPDATE واحدة (المطابقة الليلية)"""
+    return kpi_summary.update()\
+        .where(kpi_summary.c.id == 1, kpi_summary.c.overdue_as_of < bindparam("today"))\
+        .values(
+            overdue_count=kpi_summary.c.overdue_count + _kpi_became_overdue(func.count(Payment.id)),
+            overdue_amount=kpi_summary.c.overdue_amount
+            + _kpi_became_overdue(func.coalesce(func.sum(Payment.total), 0)),
+            overdue_as_of=bindparam("today"),
+        )
+
+
+def kpi_current_statement():
+    """
+    قراءة الصف حتى :today بلا كتابة: المخزّن + ما صار متأخراً منذ آخر ترحيل
+    (أيام قليلة على الأكثر، فالترحيل الفعلي يتم في المطابقة الليلية)
+    """
+    return select(
+        kpi_summary.c.paid_income, kpi_summary.c.rented_units, kpi_summary.c.empty_units,
+        (kpi_summary.c.overdue_count + _kpi_became_overdue(func.count(Payment.id))).label("overdue_count"),
+        (kpi_summary.c.overdue_amount + _kpi_became_overdue(func.coalesce(func.sum(Payment.total), 0)))
+        .label("overdue_amount"),
+    ).where(kpi_summary.c.id == 1)
+
+
+def kpi_drift(stored, fresh):
+    """وصف الفرق (المخزّن - الفعلي) لكل مؤشر تجاوز حد التسامح ('' إذا تطابقا)"""
+    parts = []
+    for column in ("paid_income", "overdue_count", "overdue_amount", "rented_units", "empty_units"):
+        diff = (stored[column] or 0) - fresh[column]
+        if abs(diff) > KPI_DRIFT_TOLERANCE:
+            parts.append(f"{column} {diff:+,.2f}")
+    return "، ".join(parts)
+
+
+def reconcile_kpi_summary(engine):
+    """
+    مطابقة ليلية: حساب المؤشرات من الصفر ومقارنتها بالصف المُحدَّث تدريجياً،
+    ثم تصحيح الصف وحفظ وصف الانحراف في last_drift
+    """
+    today = date.today()
+    with engine.begin() as conn:
+        # قفل الصف أولاً: مشغّلات الكتابات المتزامنة تنتظر انتهاء المطابقة فلا يضيع أي فرق
+        locked = conn.execute(
+            kpi_summary.update().where(kpi_summary.c.id == 1).values(reconciled_at=kpi_summary.c.reconciled_at)
+        ).rowcount
+        if not locked:
+            write_kpi_summary(conn, {**compute_kpis(conn, today), "reconciled_at": datetime.now()})
+            return "⚠️ الصف غير موجود، أُعيد بناؤه"
+        conn.execute(kpi_roll_forward_statement(), {"today": today})
+        stored = conn.execute(select(kpi_summary).where(kpi_summary.c.id == 1)).one()._mapping
+        fresh = compute_kpis(conn, stored["overdue_as_of"])
+        drift = kpi_drift(stored, fresh)
+        write_kpi_summary(conn, {**fresh, "reconciled_at": datetime.now(), "last_drift": drift or None})
+    return f"⚠️ انحراف صُحّح: {drift}" if drift else "✅ لا انحراف"
+
+
+def seconds_until_hour(hour):
+    """الثواني حتى الساعة المحددة القادمة (بالتوقيت المحلي)"""
+    now = datetime.now()
+    return (hour * 3600 - (now.hour * 3600 + now.minute * 60 + now.second)) % 86400 or 86400
+
+
+@migration(9, "ملخص المؤشرات kpi_summary ومشغّلات تحديثه")
+def _m009_kpi_summary(conn):
+    install_kpi_triggers(conn)
+    write_kpi_summary(conn, compute_kpis(conn, date.today()))
+
+# ===== التجميع اليومي للتحصيل (collections_daily) =====
+# الدفعة تُنسب لأصل أصغر وحدة في عقدها؛ إضافة/إزالة وحدة من العقد أو نقل الوحدة
+# إلى أصل آخر ينقل دفعات العقود المتأثرة بين الأصول.
+
+def _rollup_contract_asset(contract, extra_unit=None, exclude_unit=None):
+    """تعبير SQL: أصل أصغر وحدة في العقد (0 إن لم توجد)، مع إضافة/استثناء وحدة لحساب الحالة السابقة"""
+    units = f"SELECT unit_id FROM contract_units WHERE contract_id = {contract}"
+    if exclude_unit:
+        units += f" AND unit_id <> {exclude_unit}"
+    if extra_unit:
+        units += f" UNION ALL SELECT {extra_unit} AS unit_id"
+    return f"COALESCE((SELECT asset_id FROM units WHERE id = (SELECT MIN(unit_id) FROM ({units}) cu_set)), 0)"
+
+
+def _rollup_rows(p, from_clause="", asset=None):
+    """صفوف ([الأصل،] اليوم، المستحق، المحصّل، المتبقي) لدفعة NEW/OLD أو لدفعات from_clause"""
+    asset_col = f"{asset} AS asset_id, " if asset else ""
+    return (f"SELECT {asset_col}{p}.due_date AS day, COALESCE({p}.total, 0) AS due, 0.0 AS collected, "
+            f"COALESCE({p}.remaining_amount, 0) AS outstanding {from_clause} "
+            f"UNION ALL SELECT {asset + ', ' if asset else ''}COALESCE({p}.paid_date, {p}.due_date), 0.0, "
+            f"COALESCE({p}.paid_amount, 0), 0.0 {from_clause}")
+
+
+def _rollup_upsert(asset, rows, op="", condition=""):
+    """إضافة (op='') أو طرح (op='-') صفوف مجمّعة حسب اليوم إلى أصل واحد بـ upsert"""
+    return f"""INSERT INTO collections_daily (asset_id, day, amount_due, amount_collected, amount_outstanding)
+    SELECT {asset}, day, {op}SUM(due), {op}SUM(collected), {op}SUM(outstanding) FROM ({rows}) r
+    WHERE day IS NOT NULL {condition} GROUP BY day
+    ON CONFLICT (asset_id, day) DO UPDATE SET
+        amount_due = collections_daily.amount_due + excluded.amount_due,
+        amount_collected = collections_daily.amount_collected + excluded.amount_collected,
+        amount_outstanding = collections_daily.amount_outstanding + excluded.amount_outstanding"""
+
+
+def _rollup_move(payments_where, old_asset, new_asset):
+    """نقل مساهمة الدفعات المحددة (عقد أو عدة عقود) من الأصل السابق إلى الجديد (لا شيء إن لم يتغير)"""
+    rows = _rollup_rows("p", f"FROM payments p WHERE {payments_where}")
+    changed = f"AND {old_asset} <> {new_asset}"
+    return [_rollup_upsert(old_asset, rows, "-", changed), _rollup_upsert(new_asset, rows, "", changed)]
+
+
+ROLLUP_TRIGGERS = (
+    ("rollup_payments_ins", "payments", "INSERT", None,
+     [_rollup_upsert(_rollup_contract_asset("NEW.contract_id"), _rollup_rows("NEW"))]),
+    ("rollup_payments_upd", "payments",
+     "UPDATE OF contract_id, due_date, total, paid_amount, remaining_amount, paid_date", None,
+     [_rollup_upsert(_rollup_contract_asset("OLD.contract_id"), _rollup_rows("OLD"), "-"),
+      _rollup_upsert(_rollup_contract_asset("NEW.contract_id"), _rollup_rows("NEW"))]),
+    ("rollup_payments_del", "payments", "DELETE", None,
+     [_rollup_upsert(_rollup_contract_asset("OLD.contract_id"), _rollup_rows("OLD"), "-")]),
+    ("rollup_contract_units_ins", "contract_units", "INSERT", None, _rollup_move(
+        "p.contract_id = NEW.contract_id",
+        _rollup_contract_asset("NEW.contract_id", exclude_unit="NEW.unit_id"),
+        _rollup_contract_asset("NEW.contract_id"))),
+    ("rollup_contract_units_del", "contract_units", "DELETE", None, _rollup_move(
+        "p.contract_id = OLD.contract_id",
+        _rollup_contract_asset("OLD.contract_id", extra_unit="OLD.unit_id"),
+        _rollup_contract_asset("OLD.contract_id"))),
+    # نقل وحدة لأصل آخر: العقود التي هذه الوحدة أصغر وحداتها تنتقل معها
+    ("rollup_units_asset_upd", "units", "UPDATE OF asset_id", None, _rollup_move(
+        "p.contract_id IN (SELECT cu.contract_id FROM contract_units cu WHERE cu.unit_id = NEW.id AND NOT EXISTS "
+        "(SELECT 1 FROM contract_units c2 WHERE c2.contract_id = cu.contract_id AND c2.unit_id < NEW.id))",
+        "COALESCE(OLD.asset_id, 0)", "COALESCE(NEW.asset_id, 0)")),
+)
+
+# التجميع الكامل من جدول الدفعات (إعادة البناء والمطابقة)
+ROLLUP_FULL_SELECT = f"""
+WITH first_unit AS (
+    SELECT contract_id, MIN(unit_id) AS unit_id FROM contract_units GROUP BY contract_id
+), contract_asset AS (
+    SELECT f.contract_id, u.asset_id FROM first_unit f JOIN units u ON u.id = f.unit_id
+)
+SELECT asset_id, day, SUM(due) AS amount_due, SUM(collected) AS amount_collected,
+       SUM(outstanding) AS amount_outstanding
+FROM ({_rollup_rows(
+    "p", "FROM payments p LEFT JOIN contract_asset ca ON ca.contract_id = p.contract_id",
+    asset="COALESCE(ca.asset_id, 0)")}) r
+WHERE day IS NOT NULL GROUP BY asset_id, day
+"""
+
+
+def install_rollup_triggers(conn):
+    for spec in ROLLUP_TRIGGERS:
+        for ddl in _kpi_trigger_ddl(conn.dialect.name, *spec):
+            conn.exec_driver_sql(ddl)
+
+
+def rebuild_collections_rollup(conn):
+    """إعادة بناء كاملة للتجميع من جدول الدفعات (داخل معاملة المستدعي)"""
+    conn.execute(collections_daily.delete())
+    return conn.exec_driver_sql(
+        "INSERT INTO collections_daily (asset_id, day, amount_due, amount_collected, amount_outstanding) "
+        + ROLLUP_FULL_SELECT
+    ).rowcount
+
+
+def rollup_drift(conn):
+    """الصفوف التي يختلف فيها الجدول المُحدَّث تدريجياً عن التجميع الكامل (الصفوف الصفرية لا تُعد)"""
+    def by_key(rows):
+        return {(asset_id, str(day)[:10]): values for asset_id, day, *values in rows}
+
+    stored = by_key(conn.execute(select(collections_daily)).all())
+    fresh = by_key(conn.exec_driver_sql(ROLLUP_FULL_SELECT).all())
+    drift = []
+    for key in stored.keys() | fresh.keys():
+        a, b = stored.get(key, (0, 0, 0)), fresh.get(key, (0, 0, 0))
+        if any(abs((x or 0) - (y or 0)) > KPI_DRIFT_TOLERANCE for x, y in zip(a, b)):
+            drift.append({"الأصل": key[0], "اليوم": key[1], "المخزّن": tuple(a), "الفعلي": tuple(b)})
+    return drift
+
+
+def reconcile_collections_rollup(engine):
+    """مطابقة ليلية: إعادة البناء الكاملة فقط إذا وُجد انحراف"""
+    with engine.begin() as conn:
+        drift = rollup_drift(conn)
+        if not drift:
+            return "✅ لا انحراف"
+        rebuild_collections_rollup(conn)
+    return f"⚠️ انحراف في {len(drift)} صف، أُعيد البناء"
+
+
+@migration(10, "التجميع اليومي للتحصيل collections_daily ومشغّلاته")
+def _m010_collections_rollup(conn):
+    # صف إصدار contract_units: التجميع يتغير بإضافة/إزالة وحدة من عقد
+    _m007_cache_versions(conn)
+    install_rollup_triggers(conn)
+    rebuild_collections_rollup(conn)
+
+
+@migration(11, "فهرس أعمار الذمم ix_payments_aging")
+def _m011_aging_index(conn):
+    ensure_indexes(conn)
+
+
+LATEST_SCHEMA_VERSION = max(version for version, _, _ in MIGRATIONS)
+
+
+def read_schema_version(conn):
+    """قراءة رقم إصدار المخطط (صف واحد بدون أي reflection)"""
+    return conn.execute(select(schema_version.c.version).where(schema_version.c.id == 1)).scalar() or 0
+
+def _acquire_migration_lock(conn):
+    """قفل يمنع أكثر من عملية Streamlit من تطبيق الهجرات في نفس الوقت"""
+    if conn.dialect.name == "postgresql":
+        # قفل على مستوى المعاملة: يُحرَّر تلقائياً مع COMMIT/ROLLBACK
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+    else:
+        conn.exec_driver_sql("BEGIN EXCLUSIVE")
+
+def run_migrations(dry_run=False):
+    """
+    تطبيق الهجرات المعلّقة في معاملة واحدة
+
+    Args:
+        dry_run: عرض الهجرات المعلّقة فقط بدون تطبيقها
+
+    Returns:
+        dict: الإصدار الحالي، آخر إصدار، الهجرات المعلّقة/المطبقة، ورسالة الحالة
+    """
+    try:
+        with engine.connect() as conn:
+            current = read_schema_version(conn)
+    except Exception:
+        current = 0  # جدول schema_version غير موجود بعد
+
+    pending = [(v, d) for v, d, _ in MIGRATIONS if v > current]
+    result = {"current": current, "latest": LATEST_SCHEMA_VERSION, "pending": pending, "applied": []}
+
+    if dry_run or not pending:
+        result["status"] = "✅ المخطط محدّث" if not pending else f"⏳ {len(pending)} هجرة معلّقة"
+        return result
+
+    try:
+        with engine.begin() as conn:
+            _acquire_migration_lock(conn)
+            # إنشاء الجداول الناقصة (قاعدة جديدة أو جداول أضافتها هجرات جديدة)
+            Base.metadata.create_all(conn)
+
+            # إعادة القراءة تحت القفل: ربما طبّقت عملية أخرى الهجرات أثناء انتظارنا
+            current = read_schema_version(conn)
+            for version, description, fn in MIGRATIONS:
+                if version > current:
+                    fn(conn)
+                    result["applied"].append((version, description))
+
+            if result["applied"]:
+                values = {"version": LATEST_SCHEMA_VERSION, "applied_at": datetime.now()}
+                updated = conn.execute(
+                    schema_version.update().where(schema_version.c.id == 1).values(**values)
+                ).rowcount
+                if not updated:
+                    conn.execute(schema_version.insert().values(id=1, **values))
+
+        result["current"] = LATEST_SCHEMA_VERSION
+        result["pending"] = []
+        result["status"] = f"✅ تم تطبيق {len(result['applied'])} هجرة"
+    except Exception as e:
+        result["status"] = f"⚠️ Migration skipped: {e}"
+    return result
+
+@st.cache_resource # 🔥 تعمل مرة واحدة فقط عند تشغيل السيرفر
+def run_startup():
+    """
+    🚀 مرحلة بدء التشغيل (مرة واحدة لكل عملية):
+    فحص الاتصال ثم فحص المخطط وتطبيق الهجرات، مع توقيت كل خطوة
+    """
+    report = {"started_at": datetime.now(), "db_type": db_type, "steps": []}
+
+    t0 = time.perf_counter()
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    report["steps"].append({"الخطوة": "فحص الاتصال", "الزمن (ms)": round((time.perf_counter() - t0) * 1000, 2)})
+
+    t0 = time.perf_counter()
+    report["migrations"] = run_migrations()
+    report["steps"].append({"الخطوة": "فحص المخطط والهجرات", "الزمن (ms)": round((time.perf_counter() - t0) * 1000, 2)})
+
+    report["total_ms"] = round(sum(step["الزمن (ms)"] for step in report["steps"]), 2)
+    return report
+
+# تنفيذ مرحلة البدء مرة واحدة (إعادة التشغيل بعدها لا تلمس قاعدة البيانات)
+startup_report = run_startup()
+migration_status = startup_report["migrations"]
+
+
+# ==========================================
+# صيانة دورية في الخلفية
+# ==========================================
+
+class MaintenanceScheduler:
+    """
+    مجدول مهام دورية في خيط خلفي واحد لكل عملية
+    كل مهمة: اسم + فترة بالثواني + دالة تستقبل المحرك وتعيد نصاً يصف النتيجة
+    """
+
+    def __init__(self, engine, tick_seconds=60):
+        self.engine = engine
+        self.tick_seconds = tick_seconds
+        self.tasks = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def register(self, name, interval_seconds, fn, first_delay=60):
+        with self.lock:
+            self.tasks[name] = {
+                "fn": fn, "interval": interval_seconds,
+                "next_run": time.time() + first_delay,
+                "last_run": None, "duration_ms": None, "result": None, "runs": 0,
+            }
+
+    def run_task(self, name):
+        """تشغيل مهمة الآن (من الخيط الخلفي أو بطلب من المدير)"""
+        task = self.tasks[name]
+        t0 = time.perf_counter()
+        try:
+            task["result"] = task["fn"](self.engine) or "✅"
+        except Exception as e:
+            task["result"] = f"❌ {e}"
+        task["duration_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        task["last_run"] = datetime.now()
+        task["runs"] += 1
+        task["next_run"] = time.time() + task["interval"]
+        return task["result"]
+
+    def _loop(self):
+        while True:
+            time.sleep(self.tick_seconds)
+            with self.lock:
+                due = [name for name, task in self.tasks.items() if task["next_run"] <= time.time()]
+            for name in due:
+                self.run_task(name)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._loop, name="db-maintenance", daemon=True)
+            self.thread.start()
+        return self
+
+    def status(self):
+        return [{
+            "المهمة": name,
+            "الفترة (ساعة)": round(task["interval"] / 3600, 2),
+            "آخر تشغيل": task["last_run"].strftime('%Y-%m-%d %H:%M:%S') if task["last_run"] else "-",
+            "المدة (ms)": task["duration_ms"],
+            "عدد المرات": task["runs"],
+            "النتيجة": task["result"] or "-",
+            "التشغيل القادم": datetime.fromtimestamp(task["next_run"]).strftime('%Y-%m-%d %H:%M:%S'),
+        } for name, task in self.tasks.items()]
+
+
+def sqlite_optimize(engine):
+    """PRAGMA optimize: يحدّث الإحصائيات عند الحاجة فقط"""
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA optimize")
+    return "✅ optimize"
+
+def sqlite_analyze(engine):
+    """ANALYZE كامل لتحديث إحصائيات مخطط الاستعلامات"""
+    with engine.begin() as conn:
+        conn.exec_driver_sql("ANALYZE")
+    return "✅ analyze"
+
+def sqlite_incremental_vacuum(engine, pages=2000):
+    """تحرير الصفحات الفارغة تدريجياً ثم تقليص ملف WAL"""
+    with engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            # قاعدة أُنشئت قبل ملف الإعدادات: التحويل (VACUUM كامل) إجراء يدوي من لوحة SQLite
+            return "⚠️ auto_vacuum ليس INCREMENTAL — التحويل من لوحة إعدادات SQLite"
+        free_before = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        conn.exec_driver_sql(f"PRAGMA incremental_vacuum({pages})")
+        free_after = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+    checkpoint_sqlite_wal(engine)
+    return f"✅ حُرّرت {free_before - free_after} صفحة"
+
+
+def sqlite_enable_incremental_vacuum(engine):
+    """
+    تحويل قاعدة قديمة إلى auto_vacuum=INCREMENTAL: يتطلب VACUUM كاملاً يعيد بناء الملف
+    ويمنع كل الكتابات حتى ينتهي، لذا يُشغَّل يدوياً من المدير فقط (لا ضمن المهام الدورية)
+    """
+    with engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:
+            return "✅ auto_vacuum=INCREMENTAL مفعّل مسبقاً"
+        conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+    return "✅ تم التحويل إلى auto_vacuum=INCREMENTAL"
+
+
+@st.cache_resource
+def get_maintenance_scheduler():
+    """إنشاء المجدول وتسجيل مهام الصيانة وتشغيله مرة واحدة لكل عملية"""
+    scheduler = MaintenanceScheduler(engine)
+    if db_type == "sqlite":
+        scheduler.register("PRAGMA optimize", 6 * 3600, sqlite_optimize)
+        scheduler.register("ANALYZE", 24 * 3600, sqlite_analyze, first_delay=600)
+        scheduler.register("incremental_vacuum", 24 * 3600, sqlite_incremental_vacuum, first_delay=900)
+    scheduler.register(KPI_RECONCILE_TASK, 24 * 3600, reconcile_kpi_summary,
+                       first_delay=seconds_until_hour(KPI_RECONCILE_HOUR))
+    scheduler.register(ROLLUP_RECONCILE_TASK, 24 * 3600, reconcile_collections_rollup,
+                       first_delay=seconds_until_hour(KPI_RECONCILE_HOUR) + 600)
+    return scheduler.start()
+
+
+maintenance = get_maintenance_scheduler()
 
 from contextlib import contextmanager
 
+def current_username():
+    """اسم المستخدم الحالي (None خارج خيط السكربت أو قبل الدخول)"""
+    try:
+        return st.session_state.get('username')
+    except Exception:
+        return None
+
+
+# ===== تتبع الكتابة في الجلسات =====
+class WriteTracker:
+    """
+    يجمع أسماء الجداول التي كتبت عليها كل جلسة (flush + DML عبر session.execute)
+    ويبلّغ المشتركين بعد commit ناجح: subscriber(session, tables)
+    """
+
+    def __init__(self):
+        self.subscribers = []
+        self.before_commit_subscribers = []
+        event.listen(SQLSession, "after_flush", self._after_flush)
+        event.listen(SQLSession, "do_orm_execute", self._on_execute)
+        event.listen(SQLSession, "before_commit", self._before_commit)
+        event.listen(SQLSession, "after_commit", self._after_commit)
+        event.listen(SQLSession, "after_rollback", self._after_rollback)
+
+    def subscribe(self, fn):
+        self.subscribers.append(fn)
+
+    def subscribe_before_commit(self, fn):
+        """المشترك يُستدعى داخل المعاملة قبل commit (للكتابة ضمن نفس المعاملة)"""
+        self.before_commit_subscribers.append(fn)
+
+    @staticmethod
+    def mark(session, *tables):
+        session.info.setdefault("written_tables", set()).update(tables)
+
+    def _after_flush(self, session, flush_context):
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            state = inspect(obj)
+            tables = {state.mapper.local_table.name}
+            # جداول الربط (many-to-many) تُكتب ضمن flush الكائن الأب
+            for rel in state.mapper.relationships:
+                if rel.secondary is not None and state.attrs[rel.key].history.has_changes():
+                    tables.add(rel.secondary.name)
+            self.mark(session, *tables)
+
+    def _on_execute(self, orm_execute_state):
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            self.mark(orm_execute_state.session, orm_execute_state.statement.table.name)
+
+    def _before_commit(self, session):
+        # commit يستدعي before_commit قبل flush الأخير، فنفرّغ أولاً لجمع كل الجداول
+        session.flush()
+        tables = session.info.get("written_tables")
+        if tables:
+            for fn in self.before_commit_subscribers:
+                fn(session, tables)
+
+    def _after_commit(self, session):
+        tables = session.info.pop("written_tables", None)
+        if tables:
+            for fn in self.subscribers:
+                fn(session, tables)
+
+    def _after_rollback(self, session):
+        session.info.pop("written_tables", None)
+
+
+@st.cache_resource
+def get_write_tracker():
+    """مستمعو Session يُسجَّلون مرة واحدة لكل عملية"""
+    return WriteTracker()
+
+
+write_tracker = get_write_tracker()
+
+
+# ===== توجيه القراءة إلى النسخة المتماثلة =====
+# secrets اختياري: [connections.postgresql_replica] url = "postgresql://..." (أو sqlite:/// للاختبار)
+READ_YOUR_WRITES_READS = 3     # عدد القراءات التالية للمستخدم التي تذهب للأساسية بعد كتابته
+
+@st.cache_resource
+def get_replica_engine():
+    """محرك النسخة المتماثلة بمجمّع مستقل (None إذا لم تُعرَّف)"""
+    try:
+        config = st.secrets["connections"]["postgresql_replica"]
+    except Exception:
+        return None, None
+
+    try:
+        if config["url"].startswith("sqlite"):
+            replica = create_engine(config["url"], connect_args={'check_same_thread': False})
+            apply_sqlite_profile(replica)
+            mode = "pooled"
+        else:
+            replica, mode = build_postgres_engine(config)
+        with replica.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        compile_cache.watch(replica, "replica")
+        return replica, PoolMonitor(replica, mode)
+    except Exception as e:
+        st.warning(f"⚠️ Replica unavailable, reads use the primary: {e}")
+        return None, None
+
+
+class ReadRouter:
+    """اختيار محرك القراءة لكل مستخدم مع حماية read-your-own-writes"""
+
+    def __init__(self, primary, replica, pin_reads=READ_YOUR_WRITES_READS):
+        self.primary = primary
+        self.replica = replica
+        self.pin_reads = pin_reads
+        self.pins = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.routed = {"replica": 0, "primary": 0, "pinned": 0}
+
+    def on_commit(self, session, tables):
+        """بعد كتابة ناجحة: القراءات التالية لهذا المستخدم من الأساسية"""
+        user = session.info.get("user") or current_username()
+        if self.replica is not None and user:
+            with self.lock:
+                self.pins[user] = self.pin_reads
+
+    @contextmanager
+    def on_primary(self):
+        """
+        القراءات داخل الكتلة (في هذا الخيط) من الأساسية: الدوال المخزّنة مفتاحها إصدارات الأساسية،
+        وحسابها على نسخة متأخرة يخزّن صفوفاً قديمة تحت الإصدار الجديد حتى الكتابة التالية
+        """
+        previous = getattr(self.local, "primary", False)
+        self.local.primary = True
+        try:
+            yield
+        finally:
+            self.local.primary = previous
+
+    def engine_for(self, user):
+        with self.lock:
+            if self.replica is None or getattr(self.local, "primary", False):
+                self.routed["primary"] += 1
+                return self.primary
+            remaining = self.pins.get(user, 0)
+            if remaining:
+                if remaining > 1:
+                    self.pins[user] = remaining - 1
+                else:
+                    self.pins.pop(user)
+                self.routed["pinned"] += 1
+                return self.primary
+            self.routed["replica"] += 1
+            return self.replica
+
+
+@st.cache_resource
+def get_read_router():
+    replica, _ = get_replica_engine()
+    router = ReadRouter(engine, replica)
+    write_tracker.subscribe(router.on_commit)
+    return router
+
+
+read_router = get_read_router()
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False)
+
+
+@contextmanager
+def read_session():
+    """
+    📖 جلسة قراءة فقط للصفحات والدوال المخزّنة:
+    النسخة المتماثلة إن وُجدت، أو الأساسية خلال حماية read-your-own-writes وداخل الدوال المخزّنة
+    """
+    db = ReadSessionLocal(bind=read_router.engine_for(current_username()))
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@contextmanager
+def unit_of_work():
+    """
+    ✅ جلسة واحدة لكل تشغيل للصفحة (Unit of Work)
+
+    لا يُحجز اتصال من الـ pool إلا عند أول استعلام فعلي، ثم:
+    commit عند انتهاء الصفحة بنجاح، rollback عند أي خطأ، وإغلاق دائماً.
+    """
+    db = SessionLocal(info={"user": current_username()})
+    try:
+        yield db
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
 @contextmanager
 def get_safe_session():
     """
@@ -313,89 +1533,1018 @@ def get_session():
     """احصل على session جديدة"""
     return SessionLocal()
 
-# ==========================================
-# مثال على الاستخدام الصحيح:
-# ==========================================
 
-# ❌ الطريقة القديمة (خطأ):
-# users = session.query(User).all()
+# ===== إعادة التشغيل الجزئية (fragments) =====
+# الأقسام الثقيلة التفاعلية (نموذج الدفعات، محرر المستأجرين، فلتر العقود، تنبيهات
+# اللوحة) تعمل كـ st.fragment: تفاعل عنصر بداخلها يعيد تشغيل القسم وحده بدل
+# السكربت كاملاً (الشريط الجانبي، اللقطة المرجعية، بقية الصفحة).
+# التشغيل الكامل يمرّر جلسة الصفحة للقسم؛ إعادة التشغيل الجزئية لا تمر عبر main،
+# لذا يفتح القسم فيها جلسته الخاصة.
+
 
-# ✅ الطريقة الصحيحة (بعد تعريف User):
-with get_safe_session() as session:
-    users = session.query(User).all()
+def in_fragment_rerun():
+    """هل التشغيل الحالي إعادة تشغيل جزئية لقسم (وليس تشغيلاً كاملاً للسكربت)؟"""
+    ctx = get_script_run_ctx()
+    return bool(ctx and ctx.fragment_ids_this_run)
+
+
+def rerun_fragment():
+    """
+    إعادة تشغيل القسم الحالي فقط بعد الحفظ؛ أثناء التشغيل الكامل
+    (أول عرض للصفحة) لا يُسمح بالنطاق الجزئي فيُعاد تشغيل السكربت كاملاً
+    """
+    st.rerun(scope="fragment" if in_fragment_rerun() else "app")
+
+
+def page_fragment(section, read_only=False, needs_session=True, **fragment_kwargs):
+    """
+    تحويل قسم من الصفحة إلى fragment:
+    الدالة تُكتب بالشكل body(session, *args) وتُستدعى بـ body(*args, page_session=session)
+    - التشغيل الكامل: تُستخدم جلسة الصفحة نفسها (اتصال واحد من الـ pool لكل تشغيل)
+    - إعادة التشغيل الجزئية: جلسة الصفحة أُغلقت، فيفتح القسم جلسته الخاصة
+    (needs_session=False للأقسام التي تقرأ من الدوال المخزّنة فقط)،
+    وتُسجَّل كلفة كل إعادة تشغيل جزئية في لوحة صحة النظام
+    """
+    def decorate(body):
+        @wraps(body)
+        def run(*args, page_session=None, **kwargs):
+            partial = in_fragment_rerun()
+            if partial:
+                started_at = time.perf_counter()
+                rerun_metrics.begin()
+            try:
+                if not needs_session:
+                    return body(*args, **kwargs)
+                if page_session is not None and not partial:
+                    return body(page_session, *args, **kwargs)
+                with (read_session() if read_only else unit_of_work()) as session:
+                    return body(session, *args, **kwargs)
+            finally:
+                if partial:
+                    rerun_metrics.record_interaction(section, "جزئي ⚡", started_at)
+        return st.fragment(run, **fragment_kwargs)
+    return decorate
+
+
+# ===== تنفيذ الاستعلامات المستقلة بالتوازي =====
+# كل استعلام إلى Supabase عبر الشبكة رحلة ذهاب وعودة 30–80 ms؛ الدوال المستقلة
+# (مؤشرات، تنبيهات، تجميع...) تُنفَّذ في خيوط متوازية فوق نفس الـ pool فيصبح زمن
+# الصفحة الباردة ≈ أبطأ استعلام بدلاً من مجموعها. كل خيط يحمل ScriptRunContext
+# للجلسة (st.session_state وتوجيه read-your-own-writes يعملان كالمعتاد).
+QUERY_CONCURRENCY = 6  # أقصى عدد خيوط لكل نداء (أقل من pool_size حتى لا تنتظر الصفحات الأخرى)
+
+
+def run_concurrently(*calls, max_workers=QUERY_CONCURRENCY):
+    """
+    تنفيذ دوال بلا معاملات (أو lambda) بالتوازي وإرجاع نتائجها بنفس الترتيب:
+
+    stats, alerts = run_concurrently(get_dashboard_stats, lambda: get_payment_alert_days(30))
+
+    أول استثناء يُعاد رفعه في خيط الصفحة بعد انتهاء الجميع.
+    الاستعلامات المنفذة في الخيوط تُضاف لعدّاد إعادة التشغيل الحالية.
+    """
+    if len(calls) <= 1:
+        return [call() for call in calls]
+
+    ctx = get_script_run_ctx(suppress_warning=True)
+    results = [None] * len(calls)
+    errors = [None] * len(calls)
+    statements = [0] * len(calls)
+    slots = threading.Semaphore(max_workers)
+
+    def worker(index, call):
+        with slots:
+            baseline = rerun_metrics.statements()
+            try:
+                results[index] = call()
+            except BaseException as exc:
+                errors[index] = exc
+            finally:
+                statements[index] = rerun_metrics.statements() - baseline
+
+    threads = [threading.Thread(target=worker, args=(index, call), name=f"query-{index}", daemon=True)
+               for index, call in enumerate(calls)]
+    for thread in threads:
+        if ctx is not None:
+            add_script_run_ctx(thread, ctx)
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    rerun_metrics.absorb(sum(statements))
+    for exc in errors:
+        if exc is not None:
+            raise exc
+    return results
 
 
 # ==========================================
 # إضافة Caching - ضعه بعد imports
 # ==========================================
 
-from functools import lru_cache
 from datetime import datetime, timedelta
 
-# Cache للبيانات الثابتة (تنتهي صلاحيته كل 5 دقائق)
-@st.cache_data(ttl=300)
-def get_cached_assets():
-    with get_safe_session() as session:
-        return pd.read_sql(session.query(Asset).statement, session.bind)
+# ===== ذاكرة مؤقتة مرتبطة بإصدارات الجداول =====
+# كل دالة تعلن الجداول التي تقرأها؛ كل commit يكتب على جدول يرفع إصداره في جدول
+# cache_versions داخل نفس المعاملة، فتتغير مفاتيح الكاش المعتمدة عليه في كل العمليات:
+# - PostgreSQL: NOTIFY app_cache يصل لخيط LISTEN في كل عملية فوراً
+# - SQLite (أو transaction pooler بدون listen_url): خيط يقرأ cache_versions كل ثانيتين
+# لا انتهاء صلاحية بالوقت إلا تغيّر اليوم (لأن المتأخرات والتنبيهات محسوبة نسبة إلى date.today()).
+CACHE_NOTIFY_CHANNEL = "app_cache"
+CACHE_POLL_SECONDS = 2
+
+class TableVersions:
+    """نسخة محلية من جدول cache_versions (مشتركة على مستوى العملية)"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.versions = {}
+        self.dependents = {}    # جدول → {اسم الدالة: cached_loader}
+        self.lock = threading.Lock()
+        self.mode = None        # "listen" | "poll"
+        self.last_sync = None
+        self.notifications = 0
+        self.error = None
+
+    def key(self, tables):
+        return tuple(self.versions.get(table, 0) for table in (CACHE_EPOCH,) + tuple(tables))
+
+    def register(self, loader):
+        for table in (CACHE_EPOCH,) + tuple(loader.tables):
+            self.dependents.setdefault(table, {})[loader.__name__] = loader
+
+    def apply(self, new_versions):
+        """دمج إصدارات مقروءة من القاعدة ومسح الدوال المعتمدة على ما تغيّر"""
+        with self.lock:
+            epoch = new_versions.get(CACHE_EPOCH)
+            if epoch is not None and self.versions.get(CACHE_EPOCH, epoch) != epoch:
+                # القاعدة استُبدلت (استرجاع نسخة): إصداراتها قد تكون أقل، فتُعتمد كما هي
+                self.versions = {}
+            # الإصدارات تتزايد فقط (قراءة متأخرة لا ترجعها للخلف)
+            changed = [t for t, v in new_versions.items()
+                       if (v != self.versions.get(t) if t == CACHE_EPOCH else v > self.versions.get(t, 0))]
+            for table in changed:
+                self.versions[table] = new_versions[table]
+            self.last_sync = datetime.now()
+        for table in changed:
+            for loader in list(self.dependents.get(table, {}).values()):
+                loader.invalidate()
+        return changed
+
+    def sync(self, conn):
+        rows = conn.execute(select(cache_versions.c.table_name, cache_versions.c.version)).all()
+        return self.apply(dict(rows))
+
+    def check(self, conn, statement):
+        """فحص فوري لإصدارات جداول محددة باستعلام واحد يعيد صفاً واحداً (أعمدته أسماء الجداول)"""
+        row = conn.execute(statement).one()
+        return self.apply({table: version for table, version in row._mapping.items() if version is not None})
+
+    def bump_in_transaction(self, session, tables):
+        """داخل معاملة الكتابة: رفع الإصدارات + NOTIFY (لا يُرسل إلا إذا نجح commit)"""
+        tables = sorted(set(tables) & set(CACHE_INVALIDATION_TABLES))
+        if not tables:
+            return
+        # تنفيذ على مستوى Connection حتى لا يُحسب cache_versions ضمن جداول الجلسة
+        conn = session.connection()
+        conn.execute(
+            cache_versions.update()
+            .where(cache_versions.c.table_name.in_(tables))
+            .values(version=cache_versions.c.version + 1, updated_at=datetime.now())
+        )
+        session.info["cache_versions"] = dict(conn.execute(
+            select(cache_versions.c.table_name, cache_versions.c.version)
+            .where(cache_versions.c.table_name.in_(tables))
+        ).all())
+        if conn.dialect.name == "postgresql":
+            for table in tables:
+                conn.execute(text("SELECT pg_notify(:channel, :table)"),
+                             {"channel": CACHE_NOTIFY_CHANNEL, "table": table})
+
+    def on_commit(self, session, tables):
+        self.apply(session.info.pop("cache_versions", {}))
+
+    def start(self, listen_url=None):
+        target, args = (self._listen, (listen_url,)) if listen_url else (self._poll, ())
+        self.mode = "listen" if listen_url else "poll"
+        threading.Thread(target=target, args=args, name="cache-invalidation", daemon=True).start()
+        return self
+
+    def _poll(self):
+        while True:
+            time.sleep(CACHE_POLL_SECONDS)
+            try:
+                with self.engine.connect() as conn:
+                    self.sync(conn)
+                self.error = None
+            except Exception as e:
+                self.error = str(e)
+
+    def _listen(self, listen_url):
+        import select as io_select
+        import psycopg2
+
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(listen_url)
+                conn.autocommit = True
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {CACHE_NOTIFY_CHANNEL}")
+                # مزامنة كاملة بعد كل (إعادة) اتصال: ربما فاتتنا إشعارات أثناء الانقطاع
+                cur.execute("SELECT table_name, version FROM cache_versions")
+                self.apply(dict(cur.fetchall()))
+                self.error = None
+                while True:
+                    if io_select.select([conn], [], [], 60) == ([], [], []):
+                        cur.execute("SELECT 1")  # إبقاء الاتصال حياً
+                        continue
+                    conn.poll()
+                    tables = set()
+                    while conn.notifies:
+                        tables.add(conn.notifies.pop(0).payload)
+                    if tables:
+                        self.notifications += len(tables)
+                        cur.execute("SELECT table_name, version FROM cache_versions WHERE table_name = ANY(%s)",
+                                    (list(tables),))
+                        self.apply(dict(cur.fetchall()))
+            except Exception as e:
+                self.error = str(e)
+                time.sleep(5)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+def cache_listen_url():
+    """
+    رابط LISTEN: listen_url من secrets، أو رابط الاتصال نفسه في النمط pooled.
+    transaction pooler لا يدعم LISTEN، لذا بدون listen_url نستخدم القراءة الدورية
+    """
+    if db_type != "postgresql":
+        return None
+    config = st.secrets["connections"]["postgresql"]
+    url = config.get("listen_url") or (config["url"] if pool_mode == "pooled" else None)
+    if not url:
+        return None
+    url = url.replace('postgres://', 'postgresql://', 1)
+    return make_url(url).set(drivername="postgresql").render_as_string(hide_password=False)
 
-@st.cache_data(ttl=300)
-def get_cached_units(asset_id=None):
-    with get_safe_session() as session:
-        query = session.query(Unit)
-        if asset_id:
-            query = query.filter_by(asset_id=asset_id)
-        return pd.read_sql(query.statement, session.bind)
 
-@st.cache_data(ttl=300)
-def get_cached_tenants():
-    with get_safe_session() as session:
-        return pd.read_sql(session.query(Tenant).statement, session.bind)
+@st.cache_resource
+def get_table_versions():
+    versions = TableVersions(engine)
+    with engine.connect() as conn:
+        versions.sync(conn)
+    write_tracker.subscribe_before_commit(versions.bump_in_transaction)
+    write_tracker.subscribe(versions.on_commit)
+    return versions.start(cache_listen_url())
+
+
+table_versions = get_table_versions()
+# ===== ذاكرة مؤقتة مشتركة بطبقتين =====
+# طبقة 1: LRU داخل العملية محدودة بالبايت | طبقة 2: ملف SQLite مشترك بين كل العمليات على نفس الخادم
+# الإعدادات من secrets (اختياري): [cache] dir = "...", memory_mb = 64, disk_mb = 512
+CACHE_DEFAULT_TTL = 24 * 3600
+
+
+def default_cache_dir():
+    """
+    مجلد الطبقة المشتركة خاص بالقاعدة: بجوار ملف SQLite، أو مجلد مؤقت باسم مشتق من رابط PostgreSQL
+    (عمليات نفس القاعدة تتشارك، وأي قاعدة أخرى على نفس الخادم لها ملفها)
+    """
+    if engine.dialect.name == "sqlite" and engine.url.database:
+        return os.path.join(os.path.dirname(os.path.abspath(engine.url.database)), "real_estate_cache")
+    url = engine.url.render_as_string(hide_password=True)
+    return os.path.join(tempfile.gettempdir(), "real_estate_cache", hashlib.sha256(url.encode()).hexdigest()[:12])
+
+
+class _Flight:
+    """حساب جارٍ لمفتاح واحد: المنتظرون ينتظرون الحدث ثم يقرؤون النتيجة المُسلسَلة"""
+    __slots__ = ("event", "blob", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.blob = None
+        self.error = None
+
+
+class TwoTierCache:
+    """
+    ذاكرة مؤقتة بطبقتين: القيم تُخزَّن مُسلسَلة (pickle) في الطبقتين،
+    فكل قراءة تعيد نسخة مستقلة كما في st.cache_data.
+
+    - single-flight: الطلبات المتزامنة لنفس المفتاح تنتظر حساباً واحداً
+    - stale-while-revalidate: بعد ttl وخلال stale_ttl تُعاد القيمة القديمة فوراً ويُحدَّث المفتاح في الخلفية
+    """
+
+    FILE_FORMAT = 2
+
+    def __init__(self, directory, memory_bytes, disk_bytes):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.memory = OrderedDict()     # key → (loader, blob, fresh_until, expires_at)
+        self.memory_used = 0
+        self.lock = threading.Lock()
+        self.inflight = {}              # key → _Flight
+        self.local = threading.local()  # اتصال SQLite لكل خيط
+        self.stats = {}                 # loader → {"memory", "disk", "miss", "coalesced", "stale"}
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "cache.db")
+        with self._disk() as conn:
+            if conn.execute("PRAGMA user_version").fetchone()[0] != self.FILE_FORMAT:
+                conn.execute("DROP TABLE IF EXISTS entries")  # الملف مؤقت: تغيير الصيغة = البدء من جديد
+                conn.execute(f"PRAGMA user_version = {self.FILE_FORMAT}")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, loader TEXT, value BLOB,"
+                " size INTEGER, fresh_until REAL, expires_at REAL, accessed_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_entries_accessed_at ON entries (accessed_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_entries_loader ON entries (loader)")
+
+    def _disk(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            import sqlite3
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _count(self, loader, kind):
+        with self.lock:
+            stats = self.stats.setdefault(loader, {"memory": 0, "disk": 0, "miss": 0, "coalesced": 0, "stale": 0})
+            stats[kind] += 1
+
+    def _remember(self, key, loader, blob, fresh_until, expires_at):
+        """إضافة للطبقة الأولى مع إخراج الأقدم استخداماً عند تجاوز الحجم"""
+        if len(blob) > self.memory_bytes:
+            return
+        with self.lock:
+            old = self.memory.pop(key, None)
+            if old:
+                self.memory_used -= len(old[1])
+            self.memory[key] = (loader, blob, fresh_until, expires_at)
+            self.memory_used += len(blob)
+            while self.memory_used > self.memory_bytes:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_used -= len(evicted[1])
+
+    def get(self, key, loader):
+        """يعيد (الحالة، القيمة): الحالة "fresh" أو "stale" أو None عند الإخفاق"""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry and entry[3] > now:
+                self.memory.move_to_end(key)
+            else:
+                entry = None
+        if entry is not None:
+            self._count(loader, "memory")
+            return ("fresh" if entry[2] > now else "stale"), pickle.loads(entry[1])
+
+        try:
+            row = self._disk().execute(
+                "SELECT value, fresh_until, expires_at, accessed_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+        except Exception:
+            row = None  # الطبقة المشتركة اختيارية: أي خطأ فيها = إخفاق
+        if row and row[2] > now:
+            if now - row[3] > 60:  # تحديث وقت الاستخدام مرة كل دقيقة على الأكثر
+                self._disk().execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+            self._remember(key, loader, row[0], row[1], row[2])
+            self._count(loader, "disk")
+            return ("fresh" if row[1] > now else "stale"), pickle.loads(row[0])
+
+        return None, None
+
+    def set(self, key, loader, value, ttl=CACHE_DEFAULT_TTL, stale_ttl=0):
+        """تخزين القيمة في الطبقتين وإعادة نسختها المُسلسَلة"""
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        fresh_until = time.time() + ttl
+        expires_at = fresh_until + stale_ttl
+        self._remember(key, loader, blob, fresh_until, expires_at)
+        if len(blob) > self.disk_bytes:
+            return blob
+        try:
+            conn = self._disk()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, loader, value, size, fresh_until, expires_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, loader, blob, len(blob), fresh_until, expires_at, time.time()),
+            )
+            self._evict_disk(conn)
+        except Exception:
+            pass
+        return blob
+
+    def _evict_disk(self, conn):
+        """حذف المنتهية ثم الأقدم استخداماً حتى يعود الملف تحت الحد"""
+        conn.execute("DELETE FROM entries WHERE expires_at < ?", (time.time(),))
+        used = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        while used > self.disk_bytes:
+            rows = conn.execute("SELECT key, size FROM entries ORDER BY accessed_at LIMIT 20").fetchall()
+            if not rows:
+                break
+            conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in rows])
+            used -= sum(size for _, size in rows)
+
+    def _join_or_lead(self, key):
+        """إرجاع (flight، هل نحن من يحسب)"""
+        with self.lock:
+            flight = self.inflight.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self.inflight[key] = _Flight()
+            return flight, True
+
+    def _lead(self, flight, key, loader, compute, ttl, stale_ttl):
+        try:
+            flight.blob = self.set(key, loader, compute(), ttl, stale_ttl)
+        except BaseException as e:
+            flight.error = e
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+            flight.event.set()
+
+    def call(self, loader, key_parts, compute, ttl=CACHE_DEFAULT_TTL, stale_ttl=0):
+        """إعادة القيمة المخزنة أو حسابها مرة واحدة مهما تزامن الطلب عليها"""
+        key = hashlib.sha256(pickle.dumps((loader, key_parts))).hexdigest()
+        state, value = self.get(key, loader)
+        if state == "fresh":
+            return value
+
+        flight, leader = self._join_or_lead(key)
+        if state == "stale":
+            # القيمة القديمة فوراً، وتحديث واحد فقط في الخلفية
+            self._count(loader, "stale")
+            if leader:
+                threading.Thread(target=self._lead, args=(flight, key, loader, compute, ttl, stale_ttl),
+                                 name="cache-refresh", daemon=True).start()
+            return value
+
+        if leader:
+            self._count(loader, "miss")
+            self._lead(flight, key, loader, compute, ttl, stale_ttl)
+        else:
+            self._count(loader, "coalesced")
+            flight.event.wait()
+        if flight.error is not None:
+            raise flight.error
+        return pickle.loads(flight.blob)
+
+    def clear_memory(self):
+        """تفريغ الطبقة الأولى كاملة (بعد استبدال القاعدة)"""
+        with self.lock:
+            self.memory.clear()
+            self.memory_used = 0
+
+    def forget(self, loader):
+        """حذف مدخلات دالة من الطبقة الأولى فقط (الطبقة المشتركة مفاتيحها بالإصدارات)"""
+        with self.lock:
+            for key in [k for k, entry in self.memory.items() if entry[0] == loader]:
+                self.memory_used -= len(self.memory.pop(key)[1])
+
+    def clear(self, loader):
+        self.forget(loader)
+        try:
+            self._disk().execute("DELETE FROM entries WHERE loader = ?", (loader,))
+        except Exception:
+            pass
+
+    def memoize(self, ttl=CACHE_DEFAULT_TTL, stale_ttl=0):
+        """بديل مباشر لـ @st.cache_data(ttl=...) يستخدم الطبقتين"""
+        def decorator(fn):
+            loader = loader_name(fn)
+
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                return self.call(loader, (args, kwargs), lambda: fn(*args, **kwargs), ttl, stale_ttl)
+
+            wrapper.clear = lambda: self.clear(loader)
+            return wrapper
+        return decorator
+
+    def disk_usage(self):
+        try:
+            return self._disk().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        except Exception:
+            return 0, 0
+
+
+# قيم عامة تدخل في بصمة الدالة إذا ذكرتها (ثوابت الوحدة مثل ALERT_ROWS_LIMIT)
+FINGERPRINT_CONSTANT_TYPES = (int, float, str, bytes, bool, date, timedelta, type(None))
+
+
+def _is_constant(value):
+    """قيمة ثابتة يتطابق تمثيلها بين العمليات (لا دوال ولا كائنات فيها عنوان ذاكرة)"""
+    if isinstance(value, (tuple, frozenset)):
+        return all(_is_constant(item) for item in value)
+    if isinstance(value, dict):
+        return all(_is_constant(k) and _is_constant(v) for k, v in value.items())
+    return isinstance(value, FINGERPRINT_CONSTANT_TYPES)
+
+
+def _code_names(code, digest):
+    """bytecode + الثوابت + الأسماء لكائن كود وكل الدوال المتداخلة فيه؛ يعيد الأسماء العامة المستخدمة"""
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode())
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _code_names(const, digest)
+        else:
+            digest.update(repr(const).encode())
+    return names
+
+
+def _fingerprint(fn, digest, seen):
+    """بصمة الدالة ومصدرها وقيمها الافتراضية، وقيم الثوابت العامة والدوال المساعدة (من نفس الوحدة) التي تستدعيها"""
+    if fn in seen:
+        return
+    seen.add(fn)
+    try:
+        digest.update(py_inspect.getsource(fn).encode())
+    except (OSError, TypeError):
+        pass
+    digest.update(repr((fn.__defaults__, fn.__kwdefaults__)).encode())
+    names = _code_names(fn.__code__, digest)
+    for name in sorted(names):
+        value = fn.__globals__.get(name)
+        if _is_constant(value):
+            digest.update(f"{name}={value!r}".encode())
+        elif isinstance(value, ClauseElement):
+            digest.update(f"{name}={value}".encode())
+        elif isinstance(value, types.FunctionType) and value.__module__ == fn.__module__:
+            _fingerprint(value, digest, seen)
+        elif type(value).__module__ == fn.__module__ and hasattr(value, "__dict__"):
+            # عبارات مبنية مسبقاً على كائن من نفس الوحدة: نص SQL جزء من البصمة
+            for attr in sorted(names & vars(value).keys()):
+                if isinstance(vars(value)[attr], ClauseElement):
+                    digest.update(f"{name}.{attr}={vars(value)[attr]}".encode())
+
+
+@st.cache_resource
+def get_loader_names():
+    """بصمات الدوال لكل عملية: كائن الكود نفسه يُعاد استخدامه بين إعادات التشغيل فتُحسب البصمة مرة واحدة"""
+    return {}
+
+
+def loader_name(fn):
+    """اسم الدالة + بصمة الكود والثوابت وعبارات SQL: تغيير أي منها بعد النشر لا يعيد قيماً قديمة من الملف المشترك"""
+    names = get_loader_names()
+    entry = names.get(id(fn.__code__))
+    if entry is None or entry[0] is not fn.__code__:
+        digest = hashlib.md5()
+        _fingerprint(fn, digest, set())
+        entry = names[id(fn.__code__)] = (fn.__code__, f"{fn.__qualname__}:{digest.hexdigest()[:8]}")
+    return entry[1]
+
+
+@st.cache_resource
+def get_shared_cache():
+    try:
+        config = dict(st.secrets.get("cache", {}))
+    except Exception:
+        config = {}
+    return TwoTierCache(
+        config.get("dir") or default_cache_dir(),
+        int(config.get("memory_mb", 64)) * 1024 * 1024,
+        int(config.get("disk_mb", 512)) * 1024 * 1024,
+    )
+
+
+shared_cache = get_shared_cache()
+CACHED_LOADERS = {}
+
+
+def cached_loader(*tables, ttl=CACHE_DEFAULT_TTL, stale_ttl=0):
+    """
+    بديل st.cache_data(ttl=...) عبر الذاكرة المشتركة، مفتاحه إصدارات الجداول المعلنة + تاريخ اليوم
+
+    @cached_loader("payments", "contracts")
+    def get_something(...): ...
+    """
+    def decorator(fn):
+        loader = loader_name(fn)
+
+        def compute(*args, **kwargs):
+            with read_router.on_primary():
+                return fn(*args, **kwargs)
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            key_parts = (table_versions.key(tables), date.today(), args, kwargs)
+            return shared_cache.call(loader, key_parts, lambda: compute(*args, **kwargs), ttl, stale_ttl)
+
+        wrapper.tables = tables
+        wrapper.loader = loader
+        wrapper.clear = lambda: shared_cache.clear(loader)
+        # عند تغيّر إصدار جدول: تحرير الذاكرة المحلية فقط (المفاتيح القديمة في الملف لن تُطلب مجدداً)
+        wrapper.invalidate = lambda: shared_cache.forget(loader)
+        CACHED_LOADERS[fn.__name__] = wrapper
+        table_versions.register(wrapper)
+        return wrapper
+    return decorator
 
-@st.cache_data(ttl=60)  # 1 minute للبيانات المتغيرة
-def get_cached_contracts(status="نشط"):
-    """جلب العقود مع caching"""
-    with get_safe_session() as session:
-        return session.query(Contract).filter_by(status=status).all()
 
 # ==========================================
-# مثال الاستخدام:
+# لقطة البيانات المرجعية (أصول، وحدات، مستأجرون، عقود نشطة)
 # ==========================================
 
-# ❌ القديم:
-# assets = session.query(Asset).all()
+REFERENCE_TABLES = ("assets", "units", "tenants", "contracts")
+
+
+class _Ref:
+    """سجل خفيف بـ __slots__ للقراءة فقط (مشترك بين كل الجلسات فلا يجوز تعديله)"""
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} للقراءة فقط")
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{n}={getattr(self, n)!r}' for n in self.__slots__)})"
+
+
+class AssetRef(_Ref):
+    __slots__ = ("id", "name", "type")
+
+
+class UnitRef(_Ref):
+    __slots__ = ("id", "asset_id", "unit_number", "floor", "area", "usage_type", "status")
+
+
+class TenantRef(_Ref):
+    __slots__ = ("id", "name", "type")
+
+
+class ContractRef(_Ref):
+    __slots__ = ("id", "contract_number", "tenant_id", "contract_type")
+
+
+class ReferenceSnapshot:
+    """
+    نسخة واحدة لكل إصدار من الجداول المرجعية تُشارك بين الجلسات عبر cache_resource:
+    الإصابة تعيد نفس الكائن بلا pickle ولا نسخ DataFrame، والبحث بالمعرّف عبر قواميس id → موضع
+    """
+    __slots__ = ("versions", "assets", "units", "tenants", "contracts",
+                 "asset_index", "unit_index", "tenant_index", "contract_index",
+                 "units_by_asset", "contracts_by_tenant", "built_ms")
+
+    def __init__(self, versions, assets, units, tenants, contracts, built_ms=0.0):
+        self.versions = versions
+        self.assets = tuple(assets)
+        self.units = tuple(units)
+        self.tenants = tuple(tenants)
+        self.contracts = tuple(contracts)
+        self.asset_index = {a.id: i for i, a in enumerate(self.assets)}
+        self.unit_index = {u.id: i for i, u in enumerate(self.units)}
+        self.tenant_index = {t.id: i for i, t in enumerate(self.tenants)}
+        self.contract_index = {c.id: i for i, c in enumerate(self.contracts)}
+        units_by_asset, contracts_by_tenant = {}, {}
+        for u in self.units:
+            units_by_asset.setdefault(u.asset_id, []).append(u)
+        for c in self.contracts:
+            contracts_by_tenant.setdefault(c.tenant_id, []).append(c)
+        self.units_by_asset = {k: tuple(v) for k, v in units_by_asset.items()}
+        self.contracts_by_tenant = {k: tuple(v) for k, v in contracts_by_tenant.items()}
+        self.built_ms = built_ms
+
+    def asset(self, asset_id):
+        i = self.asset_index.get(asset_id)
+        return None if i is None else self.assets[i]
+
+    def tenant(self, tenant_id):
+        i = self.tenant_index.get(tenant_id)
+        return None if i is None else self.tenants[i]
+
+    def tenant_name(self, tenant_id):
+        tenant = self.tenant(tenant_id)
+        return tenant.name if tenant else "-"
+
+    def units_of(self, asset_id):
+        return self.units_by_asset.get(asset_id, ())
+
+    def contracts_of(self, tenant_id):
+        return self.contracts_by_tenant.get(tenant_id, ())
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _build_reference_snapshot(versions):
+    """تُبنى مرة واحدة لكل إصدار؛ أي commit على أحد الجداول المرجعية يغيّر المفتاح"""
+    started = time.perf_counter()
+    # من القاعدة الأساسية دائماً: البناء مرة لكل إصدار، وتأخر النسخة المقروءة قد يثبّت بيانات قديمة تحت إصدار جديد
+    with engine.connect() as conn:
+        assets = [AssetRef(*row) for row in conn.execute(
+            select(Asset.id, Asset.name, Asset.type).order_by(Asset.id))]
+        units = [UnitRef(*row) for row in conn.execute(
+            select(Unit.id, Unit.asset_id, Unit.unit_number, Unit.floor, Unit.area, Unit.usage_type, Unit.status)
+            .order_by(Unit.id))]
+        tenants = [TenantRef(*row) for row in conn.execute(
+            select(Tenant.id, Tenant.name, Tenant.type).order_by(Tenant.id))]
+        contracts = [ContractRef(*row) for row in conn.execute(
+            select(Contract.id, Contract.contract_number, Contract.tenant_id, Contract.contract_type)
+            .where(Contract.status == "نشط").order_by(Contract.id))]
+    return ReferenceSnapshot(versions, assets, units, tenants, contracts, (time.perf_counter() - started) * 1000)
+
+
+def reference_snapshot():
+    """اللقطة المرجعية الحالية (للقراءة فقط)"""
+    return _build_reference_snapshot(table_versions.key(REFERENCE_TABLES))
 
-# ✅ الجديد:
-assets = get_cached_assets()
 
 # ==========================================
-# 4. تحديث الجداول الموجودة (Migration)
+# نموذج القراءة: استعلامات Core بأعمدة محددة للعرض فقط
+# صفوف خفيفة بلا كائنات ORM ولا identity map؛ للتعديل يُحمَّل الصف المختار وحده بـ session.get
 # ==========================================
 
-@st.cache_resource # 🔥 تعمل مرة واحدة فقط عند تشغيل السيرفر
-def run_migrations():
-    """تحديث هيكل قاعدة البيانات بدون إبطاء التطبيق"""
-    inspector = inspect(engine)
-    try:
-        with engine.begin() as conn:
-            # تحديث جدول العقود
-            contracts_cols = [col['name'] for col in inspector.get_columns('contracts')]
-            if 'status' not in contracts_cols:
-                conn.execute(text("ALTER TABLE contracts ADD COLUMN status VARCHAR DEFAULT 'نشط'"))
-            
-            if 'cancellation_reason' not in contracts_cols:
-                conn.execute(text("ALTER TABLE contracts ADD COLUMN cancellation_reason TEXT"))
+class ContractListRow(_Ref):
+    __slots__ = ("id", "contract_number", "tenant_name", "contract_type", "rent_amount",
+                 "start_date", "end_date", "status", "unit_numbers")
+
+
+class TenantListRow(_Ref):
+    __slots__ = ("id", "name", "type", "phone", "email", "contracts_count", "running_count")
+
+
+class AssetListRow(_Ref):
+    __slots__ = ("id", "name", "type", "location", "description", "units_count", "rented_count")
+
+
+class PaymentRow(_Ref):
+    __slots__ = ("id", "contract_id", "payment_number", "due_date", "total",
+                 "paid_amount", "remaining_amount", "status", "payment_method")
+
+
+PAYMENT_ROW_COLUMNS = (Payment.id, Payment.contract_id, Payment.payment_number, Payment.due_date, Payment.total,
+                       Payment.paid_amount, Payment.remaining_amount, Payment.status, Payment.payment_method)
+
+
+def read_frame(session, stmt, params=None):
+    """نتيجة select مباشرة إلى DataFrame بأسماء الأعمدة (على اتصال الجلسة نفسه)"""
+    result = session.execute(stmt, params)
+    return pd.DataFrame(result.all(), columns=list(result.keys()))
+
+
+def contract_list_rows(session, status=None):
+    """قائمة العقود مع اسم المستأجر وأرقام الوحدات (استعلامان مهما كان عدد العقود)"""
+    stmt = select(Contract.id, Contract.contract_number, Tenant.name, Contract.contract_type, Contract.rent_amount,
+                  Contract.start_date, Contract.end_date, Contract.status)\
+        .outerjoin(Tenant, Tenant.id == Contract.tenant_id)\
+        .order_by(Contract.id)
+    unit_stmt = select(contract_units.c.contract_id, Unit.unit_number)\
+        .join(Unit, Unit.id == contract_units.c.unit_id)\
+        .order_by(contract_units.c.contract_id, Unit.id)
+    if status is not None:
+        stmt = stmt.where(Contract.status == status)
+        unit_stmt = unit_stmt.join(Contract, Contract.id == contract_units.c.contract_id)\
+            .where(Contract.status == status)
+
+    rows = session.execute(stmt).all()
+    units = {}
+    if rows:
+        for contract_id, unit_number in session.execute(unit_stmt):
+            units.setdefault(contract_id, []).append(unit_number)
+    return [ContractListRow(*row, tuple(units.get(row[0], ()))) for row in rows]
+
+
+def tenant_list_rows(session):
+    """المستأجرون مع عدد عقودهم النشطة والسارية منها في استعلام مجمّع واحد"""
+    active = Contract.status == "نشط"
+    stmt = select(
+        Tenant.id, Tenant.name, Tenant.type, Tenant.phone, Tenant.email,
+        func.coalesce(func.sum(case((active, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((and_(active, Contract.end_date >= date.today()), 1), else_=0)), 0),
+    ).outerjoin(Contract, Contract.tenant_id == Tenant.id)\
+     .group_by(Tenant.id)\
+     .order_by(Tenant.id)
+    return [TenantListRow(*row) for row in session.execute(stmt)]
+
+
+def asset_list_rows(session):
+    """الأصول مع عدد وحداتها والمؤجر منها في استعلام مجمّع واحد"""
+    stmt = select(
+        Asset.id, Asset.name, Asset.type, Asset.location, Asset.description,
+        func.count(Unit.id),
+        func.coalesce(func.sum(case((Unit.status == "مؤجر", 1), else_=0)), 0),
+    ).outerjoin(Unit, Unit.asset_id == Asset.id)\
+     .group_by(Asset.id)\
+     .order_by(Asset.id)
+    return [AssetListRow(*row) for row in session.execute(stmt)]
+
+
+def tenant_payments_frame(session, tenant_id):
+    """دفعات العقود النشطة لمستأجر واحد كـ DataFrame جاهز للعرض"""
+    stmt = select(
+        func.coalesce(Contract.contract_number, cast(Contract.id, String)).label("العقد"),
+        Payment.due_date.label("الاستحقاق"),
+        Payment.total.label("الإجمالي"),
+        Payment.paid_amount.label("المدفوع"),
+        Payment.remaining_amount.label("المتبقي"),
+        Payment.status.label("الحالة"),
+        Payment.payment_method.label("طريقة السداد"),
+    ).select_from(Payment)\
+     .join(Contract, Payment.contract_id == Contract.id)\
+     .where(Contract.tenant_id == tenant_id, Contract.status == "نشط")\
+     .order_by(Contract.id, Payment.id)
+    return read_frame(session, stmt)
+
+
+# ==========================================
+# أعمار الذمم (aging): تجميع واحد في SQL
+# ==========================================
+# المبالغ المتبقية للعقود النشطة في فئات حسب أيام التأخير. حدود الفئات تواريخ تُحسب مرة
+# واحدة في Python وتُمرَّر كمعاملات، فالمقارنة على due_date مباشرة (بلا حساب تاريخ لكل صف)
+# وتُقرأ من الفهرس الجزئي ix_payments_aging وحده. التجميع على مرحلتين: لكل عقد من الفهرس
+# (مرتب حسب العقد فلا فرز)، ثم ربط بضعة آلاف عقد بالمستأجر والأصل (أصل أول وحدة كالتقارير).
+AGING_CURRENT_DAYS = 30  # "جاري" = غير متأخر ويستحق خلال هذه المدة (الجدولة المستقبلية ليست ذمماً بعد)
+# (الاسم، المعامل الأدنى، المعامل الأعلى) — الحد الأدنى شامل والأعلى غير شامل
+AGING_BUCKETS = (
+    ("جاري", "today", None),
+    ("1-30", "overdue_30", "today"),
+    ("31-60", "overdue_60", "overdue_30"),
+    ("61-90", "overdue_90", "overdue_60"),
+    ("+90", None, "overdue_90"),
+)
+AGING_BUCKET_NAMES = tuple(name for name, _, _ in AGING_BUCKETS)
+
+
+def aging_boundaries(today):
+    """قيم معاملات الفئات لتاريخ اليوم"""
+    return {
+        "horizon": today + timedelta(days=AGING_CURRENT_DAYS),
+        "today": today,
+        "overdue_30": today - timedelta(days=30),
+        "overdue_60": today - timedelta(days=60),
+        "overdue_90": today - timedelta(days=90),
+    }
+
+
+def _aging_condition(bucket):
+    """شرط فئة على due_date (بين معاملي حدودها)"""
+    _, lower, upper = next(b for b in AGING_BUCKETS if b[0] == bucket)
+    conditions = []
+    if lower:
+        conditions.append(Payment.due_date >= bindparam(lower))
+    if upper:
+        conditions.append(Payment.due_date < bindparam(upper))
+    return and_(*conditions)
+
+
+def _aging_outstanding():
+    """الدفعات ذات المبالغ المتبقية حتى أفق "جاري" (نفس شرط الفهرس الجزئي حرفياً ليستخدمه SQLite)"""
+    return and_(Payment.remaining_amount > literal_column("0"), Payment.due_date < bindparam("horizon"))
+
+
+def _aging_contract_asset():
+    """(العقد، أصل أول وحدة مرتبطة به) — 0 للعقود بلا وحدات"""
+    first_unit = select(contract_units.c.contract_id, func.min(contract_units.c.unit_id).label("unit_id"))\
+        .group_by(contract_units.c.contract_id).subquery()
+    return select(first_unit.c.contract_id, Unit.asset_id)\
+        .join(Unit, Unit.id == first_unit.c.unit_id).subquery()
 
-            # تحديث جدول الدفعات
-            payments_cols = [col['name'] for col in inspector.get_columns('payments')]
-            if 'paid_amount' not in payments_cols:
-                conn.execute(text("ALTER TABLE payments ADD COLUMN paid_amount FLOAT DEFAULT 0.0"))
-            
-        return "✅ Migrations completed successfully"
-    except Exception as e:
-        return f"⚠️ Migration skipped: {e}"
 
-# تنفيذ الهجرة مرة واحدة
-migration_status = run_migrations()
+def aging_matrix_statement():
+    """
+    مصفوفة (المستأجر، الأصل) × الفئات بمجموع المتبقي وعدد الدفعات في استعلام واحد؛
+    المعاملات من aging_boundaries
+    """
+    per_contract = select(
+        Payment.contract_id,
+        *(func.sum(case((_aging_condition(name), Payment.remaining_amount), else_=0)).label(f"b{i}")
+          for i, name in enumerate(AGING_BUCKET_NAMES)),
+        func.count().label("payments"),
+    ).where(_aging_outstanding()).group_by(Payment.contract_id).subquery()
+    contract_asset = _aging_contract_asset()
+    asset_id = func.coalesce(contract_asset.c.asset_id, 0)
+
+    return select(
+        Tenant.id.label("tenant_id"),
+        Tenant.name.label("المستأجر"),
+        asset_id.label("asset_id"),
+        *(func.sum(per_contract.c[f"b{i}"]).label(name) for i, name in enumerate(AGING_BUCKET_NAMES)),
+        func.sum(per_contract.c.payments).label("الدفعات"),
+    ).select_from(per_contract)\
+        .join(Contract, Contract.id == per_contract.c.contract_id)\
+        .join(Tenant, Tenant.id == Contract.tenant_id)\
+        .outerjoin(contract_asset, contract_asset.c.contract_id == Contract.id)\
+        .where(Contract.status == "نشط")\
+        .group_by(Tenant.id, Tenant.name, asset_id)\
+        .order_by(Tenant.name, asset_id)
+
+
+def aging_payments_statement(tenant_id=None, asset_id=None, bucket=None, limit=None):
+    """الدفعات خلف خلية من المصفوفة: مستأجر و/أو أصل (0 = بلا وحدات) وفئة (None = كل الفئات)"""
+    contract_asset = _aging_contract_asset()
+    asset = func.coalesce(contract_asset.c.asset_id, 0)
+    stmt = select(
+        Payment.id.label("رقم"),
+        Contract.contract_number.label("العقد"),
+        Tenant.name.label("المستأجر"),
+        Payment.due_date.label("الاستحقاق"),
+        Payment.total.label("الإجمالي"),
+        Payment.remaining_amount.label("المتبقي"),
+        Payment.status.label("الحالة"),
+    ).select_from(Payment)\
+        .join(Contract, Contract.id == Payment.contract_id)\
+        .join(Tenant, Tenant.id == Contract.tenant_id)\
+        .outerjoin(contract_asset, contract_asset.c.contract_id == Contract.id)\
+        .where(_aging_outstanding(), Contract.status == "نشط")\
+        .order_by(Payment.due_date, Payment.id)
+    if tenant_id is not None:
+        stmt = stmt.where(Tenant.id == tenant_id)
+    if asset_id is not None:
+        stmt = stmt.where(asset == asset_id)
+    if bucket is not None:
+        stmt = stmt.where(_aging_condition(bucket))
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+# ==========================================
+# عبارات SQL مبنية مسبقاً للمسارات الساخنة
+# ==========================================
+# Streamlit يعيد تعريف النماذج والجداول في كل إعادة تشغيل، ومفتاح compiled cache في SQLAlchemy
+# مرتبط بكائن الجدول نفسه: أي استعلام يُبنى داخل الصفحة يُترجم من جديد في كل إعادة تشغيل.
+# هذه العبارات تُبنى مرة واحدة لكل عملية والقيم المتغيرة فيها bindparam، فتُؤخذ ترجمتها من الذاكرة.
+
+# الجداول التي تعتمد عليها لوحة المؤشرات (رمز التغيير للتحديث التلقائي)
+DASHBOARD_TABLES = ("payments", "contracts", "units", "tenants", "contract_units")
+
+
+class HotStatements:
+    """select() جاهزة تُنفَّذ بقاموس معاملات فقط"""
+
+    def __init__(self):
+        active = Contract.status == "نشط"
+        unpaid = Payment.status != "مدفوع"
+
+        self.user_by_username = select(User.id, User.username, User.password_hash, User.role)\
+            .where(User.username == bindparam("username"))
+
+        self.payments_by_contract = select(*PAYMENT_ROW_COLUMNS)\
+            .where(Payment.contract_id == bindparam("contract_id"))\
+            .order_by(Payment.due_date)
+
+        # مؤشرات اللوحة: صف واحد بالمفتاح الأساسي + ما صار متأخراً منذ آخر ترحيل
+        self.kpi_row = kpi_current_statement()
+
+        # تنبيهات التحصيل: ملخص بعدد ومجموع لكل يوم استحقاق، والتفاصيل بحد أقصى للصفوف
+        # (أقرب N دفعة في النافذة، أو دفعات يوم واحد عند الطلب)
+        upcoming = select(Payment.id, Payment.due_date, Payment.total, Tenant.name, Contract.contract_number)\
+            .join(Contract, Payment.contract_id == Contract.id)\
+            .join(Tenant, Contract.tenant_id == Tenant.id)\
+            .where(unpaid)
+        self.payment_alert_days = select(Payment.due_date, func.count(Payment.id), func.sum(Payment.total))\
+            .join(Contract, Payment.contract_id == Contract.id)\
+            .join(Tenant, Contract.tenant_id == Tenant.id)\
+            .where(unpaid, Payment.due_date >= bindparam("today"), Payment.due_date <= bindparam("until"))\
+            .group_by(Payment.due_date)\
+            .order_by(Payment.due_date)
+        self.upcoming_payments = upcoming\
+            .where(Payment.due_date >= bindparam("today"), Payment.due_date <= bindparam("until"))\
+            .order_by(Payment.due_date, Payment.id)\
+            .limit(bindparam("limit"))
+        self.payments_due_on = upcoming\
+            .where(Payment.due_date == bindparam("day"))\
+            .order_by(Tenant.name, Payment.id)\
+            .limit(bindparam("limit"))
+
+        # العدد الكلي مع أول N صف في نفس الاستعلام (count over نافذة كاملة)
+        self.expiring_contracts = select(Contract.id, Contract.contract_number, Contract.end_date, Tenant.name,
+                                         func.count().over())\
+            .join(Tenant, Contract.tenant_id == Tenant.id)\
+            .where(active, Contract.end_date >= bindparam("today"), Contract.end_date <= bindparam("until"))\
+            .order_by(Contract.end_date)\
+            .limit(bindparam("limit"))
+
+        self.aging_matrix = aging_matrix_statement()
+
+        # رمز تغيّر اللوحة: إصدار كل جدول في عمود واحد بصف واحد (بحث بالمفتاح الأساسي)
+        self.dashboard_versions = select(*(
+            func.max(case((cache_versions.c.table_name == table, cache_versions.c.version))).label(table)
+            for table in DASHBOARD_TABLES
+        )).where(cache_versions.c.table_name.in_(DASHBOARD_TABLES))
+
+    def named(self):
+        return dict(vars(self))
+
+
+@st.cache_resource
+def get_hot_statements():
+    return HotStatements()
+
+
+hot_statements = get_hot_statements()
+
 
 # ==========================================
 # 5. دوال مساعدة
@@ -408,9 +2557,8 @@ def check_login(username, password):
     """التحقق من الدخول باستخدام جلسة آمنة"""
     username = username.strip().lower()
     with get_safe_session() as session:
-        user = session.query(User).filter_by(username=username).first()
+        user = session.execute(hot_statements.user_by_username, {"username": username}).first()
         if user and user.password_hash == hash_password(password):
-            # نرجع كائن المستخدم قبل إغلاق الجلسة
             return {"username": user.username, "role": user.role, "id": user.id}
     return None
 
@@ -553,7 +2701,7 @@ def restore_backup(uploaded_file):
 # 10. صفحة النسخ الاحتياطي المحدثة
 # ==========================================
 
-def backup_page():
+def backup_page(session):
     """صفحة إدارة النسخ الاحتياطية"""
     
     st.header("💾 إدارة النسخ الاحتياطية")
@@ -627,16 +2775,27 @@ def get_login_styles():
     </style>
     """
 
+@st.cache_resource
+def get_logo_html():
+    """قراءة اللوجو مرة واحدة وتحويله إلى وسم img مضمّن"""
+    logo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logo.png")
+    if not os.path.exists(logo_path):
+        return None
+    with open(logo_path, "rb") as f:
+        encoded = base64.b64encode(f.read()).decode()
+    return f"<img src='data:image/png;base64,{encoded}' style='width:100%;'>"
+
 def login_page():
     st.markdown(get_login_styles(), unsafe_allow_html=True)
     st.markdown("<br><br>", unsafe_allow_html=True)
     
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
-        # محاولة تحميل اللوجو مرة واحدة وتخزينه في الكاش
-        try:
-            st.image("logo.png", use_container_width=True)
-        except:
+        # اللوجو يُقرأ مرة واحدة ويُخزَّن في الكاش (بدون st.image حتى لا تُحمَّل numpy في صفحة الدخول)
+        logo_html = get_logo_html()
+        if logo_html:
+            st.markdown(logo_html, unsafe_allow_html=True)
+        else:
             st.markdown("<h1 style='text-align:center; color:#6B9B7A;'>جمعية زواج</h1>", unsafe_allow_html=True)
 
         # استخدام st.form لمنع التطبيق من إعادة التشغيل مع كل حرف تكتبه (تسريع مذهل)
@@ -661,69 +2820,258 @@ def login_page():
                         st.error("❌ بيانات غير صحيحة")
 
 
-from sqlalchemy import func
-
-@st.cache_data(ttl=600)  # تخزين النتائج لمدة 10 دقائق
+@cached_loader("payments", "contracts", "units")
 def get_dashboard_stats():
-    """حساب المؤشرات داخل قاعدة البيانات مباشرة لسرعة قصوى"""
-    with get_safe_session() as session:
-        # 1. إجمالي الدخل المحصل
-        income = session.query(func.sum(Payment.total)).join(Contract).filter(
-            Payment.status == 'مدفوع',
-            Contract.status == "نشط"
-        ).scalar() or 0
-
-        # 2. المتأخرات (المبلغ والعدد)
-        overdue_query = session.query(
-            func.count(Payment.id),
-            func.sum(Payment.total)
-        ).join(Contract).filter(
-            Payment.status != 'مدفوع',
-            Payment.due_date < date.today(),
-            Contract.status == "نشط"
-        ).first()
-        
-        # 3. حالات الوحدات
-        rented = session.query(func.count(Unit.id)).filter_by(status='مؤجر').scalar()
-        empty = session.query(func.count(Unit.id)).filter_by(status='فاضي').scalar()
-
-        return {
-            "income": income,
-            "overdue_count": overdue_query[0] or 0,
-            "overdue_amount": overdue_query[1] or 0,
-            "rented": rented,
-            "empty": empty
-        }
-    
-@st.cache_data(ttl=300)
-def get_dashboard_alerts():
-    with get_safe_session() as session:
-        # تنبيهات الدفعات (خلال 30 يوم قادمة)
-        upcoming_pays = session.query(Payment, Tenant.name).\
-            join(Contract, Payment.contract_id == Contract.id).\
-            join(Tenant, Contract.tenant_id == Tenant.id).\
-            filter(Payment.status != "مدفوع").\
-            filter(Payment.due_date >= date.today()).\
-            filter(Payment.due_date <= date.today() + timedelta(days=30)).\
-            order_by(Payment.due_date).all()
-
-        # تنبيهات انتهاء العقود (خلال 60 يوم قادمة)
-        exp_date = date.today() + timedelta(days=60)
-        expiring_contracts = session.query(Contract, Tenant.name).\
-            join(Tenant, Contract.tenant_id == Tenant.id).\
-            filter(Contract.status == "نشط").\
-            filter(Contract.end_date >= date.today()).\
-            filter(Contract.end_date <= exp_date).\
-            order_by(Contract.end_date).all()
-            
-        return upcoming_pays, expiring_contracts
-    
-def dashboard():
+    """المؤشرات من صف واحد في kpi_summary تحدّثه المشغّلات (قراءة فقط، زمن ثابت مهما كبر جدول الدفعات)"""
+    today = date.today()
+    with read_session() as session:
+        row = session.execute(hot_statements.kpi_row, {"today": today}).first()
+        # الصف مفقود (تُعيد بناءه المطابقة الليلية): حساب كامل للقراءة فقط
+        values = row._mapping if row is not None else compute_kpis(session.connection(), today)
+
+    return {
+        "income": values["paid_income"] or 0,
+        "overdue_count": values["overdue_count"] or 0,
+        "overdue_amount": values["overdue_amount"] or 0,
+        "rented": values["rented_units"] or 0,
+        "empty": values["empty_units"] or 0,
+    }
+
+
+ALERT_WINDOWS = (7, 30, 60, 90)  # نوافذ تنبيهات التحصيل المتاحة في اللوحة (بالأيام)
+
+
+ALERT_ROWS_LIMIT = 25  # أقصى عدد صفوف تفاصيل تُرسل للمتصفح في أي قائمة تنبيهات
+EXPIRING_CONTRACT_DAYS = 60
+
+
+@cached_loader("payments", "contracts", "tenants")
+def get_payment_alert_days(days=30):
+    """(تاريخ الاستحقاق، عدد الدفعات، المجموع) لكل يوم خلال days يوماً: صف لكل يوم مهما كثرت الدفعات"""
+    today = date.today()
+    with read_session() as session:
+        rows = session.execute(
+            hot_statements.payment_alert_days, {"today": today, "until": today + timedelta(days=days)}
+        ).all()
+        return [tuple(row) for row in rows]
+
+
+@cached_loader("payments", "contracts", "tenants")
+def get_payment_alerts(days=30, day=None, limit=ALERT_ROWS_LIMIT):
+    """
+    (رقم، تاريخ الاستحقاق، المبلغ، المستأجر، رقم العقد) بحد أقصى limit صفاً:
+    أقرب الدفعات استحقاقاً خلال days يوماً، أو دفعات يوم day وحده
+    """
+    today = date.today()
+    with read_session() as session:
+        if day is None:
+            rows = session.execute(hot_statements.upcoming_payments, {
+                "today": today, "until": today + timedelta(days=days), "limit": limit
+            }).all()
+        else:
+            rows = session.execute(hot_statements.payments_due_on, {"day": day, "limit": limit}).all()
+        return [tuple(row) for row in rows]
+
+
+@cached_loader("contracts", "tenants")
+def get_expiring_contracts(limit=ALERT_ROWS_LIMIT):
+    """
+    (العدد الكلي، [(رقم، رقم العقد، النهاية، المستأجر)...]) للعقود النشطة المنتهية
+    خلال EXPIRING_CONTRACT_DAYS يوماً، أقربها أولاً بحد أقصى limit صفاً
+    """
+    today = date.today()
+    with read_session() as session:
+        rows = session.execute(hot_statements.expiring_contracts, {
+            "today": today, "until": today + timedelta(days=EXPIRING_CONTRACT_DAYS), "limit": limit
+        }).all()
+        return (rows[0][-1] if rows else 0), [tuple(row[:-1]) for row in rows]
+
+
+def due_label(due_date):
+    """وصف قرب الاستحقاق بنفس ألوان التنبيهات: اليوم / غداً / بعد N يوم"""
+    days_left = (due_date - date.today()).days
+    if days_left == 0:
+        return "🔴 اليوم"
+    if days_left == 1:
+        return "🟠 غداً"
+    return f"🔵 بعد {days_left} يوم"
+
+
+@page_fragment("تنبيهات اللوحة", needs_session=False)
+def dashboard_alerts():
+    """
+    تنبيهات التحصيل: جدول واحد بصف لكل يوم (العدد والمبلغ محسوبان في SQL)،
+    وتفاصيل الدفعات تُجلب عند الطلب فقط بحد أقصى ALERT_ROWS_LIMIT صفاً.
+    تغيير النافذة أو اليوم يعيد تشغيل هذا القسم وحده
+    """
+    st.subheader("⏰ تنبيهات التحصيل")
+    days = st.radio(
+        "النافذة (يوم)", ALERT_WINDOWS, index=ALERT_WINDOWS.index(30),
+        horizontal=True, key='dashboard_alert_days'
+    )
+    summary = get_payment_alert_days(days)
+    if not summary:
+        st.success("✅ لا توجد دفعات مستحقة قريباً")
+        return
+
+    total_count = sum(count for _, count, _ in summary)
+    total_amount = sum(amount or 0 for _, _, amount in summary)
+    st.markdown(f"**{total_count:,}** دفعة بمبلغ **{total_amount:,.0f} ريال** خلال {days} يوم")
+    st.dataframe(pd.DataFrame([{
+        "الاستحقاق": due_label(due_date),
+        "التاريخ": due_date.strftime('%Y-%m-%d'),
+        "الدفعات": count,
+        "المبلغ": f"{amount or 0:,.0f}",
+    } for due_date, count, amount in summary]), use_container_width=True, hide_index=True, height=250)
+
+    counts = {due_date: count for due_date, count, _ in summary}
+    detail = st.selectbox(
+        "🔎 التفاصيل", [None, "nearest"] + list(counts), key=f'dashboard_alert_detail_{days}',
+        format_func=lambda option: (
+            "— اختر لعرض الدفعات —" if option is None
+            else f"أقرب {ALERT_ROWS_LIMIT} دفعة" if option == "nearest"
+            else f"{option:%Y-%m-%d} ({counts[option]} دفعة)"
+        )
+    )
+    if detail is None:
+        return
+    if detail == "nearest":
+        rows, matching = get_payment_alerts(days), total_count
+    else:
+        rows, matching = get_payment_alerts(day=detail), counts[detail]
+    st.dataframe(pd.DataFrame([{
+        "الاستحقاق": due_label(due_date),
+        "المستأجر": t_name,
+        "العقد": contract_number or "-",
+        "المبلغ": f"{total or 0:,.0f}",
+    } for _, due_date, total, t_name, contract_number in rows]), use_container_width=True, hide_index=True)
+    if matching > len(rows):
+        st.caption(f"عرض {len(rows)} من {matching:,} دفعة — التقارير تعرض القائمة الكاملة")
+
+
+# ===== التحديث التلقائي للوحة المؤشرات =====
+DASHBOARD_REFRESH_SECONDS = (15, 30, 60, 300)
+# كل قسم ← الجداول التي يعتمد عليها (لا يُعاد حساب إلا ما تغيّرت جداوله)
+DASHBOARD_SECTIONS = {
+    "المؤشرات": ("payments", "contracts", "units"),
+    "الإشغال": ("units",),
+    "تنبيهات التحصيل": ("payments", "contracts", "tenants"),
+    "العقود المنتهية": ("contracts", "tenants"),
+    "اتجاه التحصيل": ("payments", "contracts", "units", "contract_units"),
+}
+
+
+def dashboard_changes():
+    """
+    نبضة التحديث: عند إعادة التشغيل الجزئية استعلام واحد بصف واحد على cache_versions
+    (لا ننتظر خيط المزامنة)، ثم مقارنة الإصدارات بآخر ما عُرض في هذه الجلسة.
+    الأقسام التي لم تتغير جداولها تُقرأ من الذاكرة المؤقتة بلا أي استعلام.
+    """
+    if in_fragment_rerun():
+        with engine.connect() as conn:
+            table_versions.check(conn, hot_statements.dashboard_versions)
+    current = dict(zip(DASHBOARD_TABLES, table_versions.key(DASHBOARD_TABLES)[1:]))
+    previous = st.session_state.get('dashboard_versions')
+    st.session_state['dashboard_versions'] = current
+    if previous is None:
+        return None
+    changed = {table for table in DASHBOARD_TABLES if current[table] != previous.get(table)}
+    return [section for section, tables in DASHBOARD_SECTIONS.items() if changed & set(tables)]
+
+
+TREND_MONTHS = (12, 24, 36)
+
+
+@cached_loader("payments", "contracts", "units", "contract_units")
+def get_collection_rollup(months=24):
+    """صفوف التجميع اليومي لآخر months شهراً (بضع مئات صف بدلاً من جدول الدفعات)"""
+    today = date.today()
+    year, month = divmod(today.year * 12 + today.month - months, 12)
+    start = date(year, month + 1, 1)
+    year, month = divmod(today.year * 12 + today.month, 12)
+    end = date(year, month + 1, 1)
+    with read_session() as session:
+        return read_frame(session, select(collections_daily).where(
+            collections_daily.c.day >= start, collections_daily.c.day < end
+        ))
+
+
+@page_fragment("اتجاه التحصيل", needs_session=False)
+def dashboard_trend():
+    """المستحق مقابل المحصّل والمتأخر شهرياً لكل الأصول أو لأصل واحد، من جدول التجميع فقط"""
+    st.subheader("📈 اتجاه التحصيل الشهري")
+    names = {a.id: a.name for a in reference_snapshot().assets}
+    names[0] = "بدون وحدات"
+    c1, c2 = st.columns([2, 1])
+    asset_id = c1.selectbox(
+        "الأصل", [None] + list(names), key='trend_asset',
+        format_func=lambda i: "جميع الأصول" if i is None else names.get(i, f"#{i}")
+    )
+    months = c2.selectbox("المدة (شهر)", TREND_MONTHS, index=1, key='trend_months')
+
+    rollup = get_collection_rollup(months)
+    rows = rollup if asset_id is None else rollup[rollup["asset_id"] == asset_id]
+    if rows.empty:
+        st.info("لا توجد دفعات في هذه الفترة")
+        return
+
+    days = pd.to_datetime(rows["day"])
+    trend = pd.DataFrame({
+        "الشهر": days.dt.strftime("%Y-%m"),
+        "المستحق": rows["amount_due"],
+        "المحصّل": rows["amount_collected"],
+        # المتبقي على أيام مضت فقط = متأخر
+        "المتأخر": rows["amount_outstanding"].where(days < pd.Timestamp(date.today()), 0),
+    }).groupby("الشهر").sum()
+    st.line_chart(trend)
+
+    if asset_id is None:
+        per_asset = rows.groupby("asset_id")[["amount_due", "amount_collected"]].sum()
+        st.dataframe(pd.DataFrame([{
+            "الأصل": names.get(asset, f"#{asset}"),
+            "المستحق": f"{due:,.0f}",
+            "المحصّل": f"{collected:,.0f}",
+            "نسبة التحصيل": f"{collected / due:.0%}" if due else "-",
+        } for asset, due, collected in per_asset.itertuples()]), use_container_width=True, hide_index=True)
+    st.caption(f"من {len(rollup)} صفاً في collections_daily (بلا قراءة جدول الدفعات)")
+
+
+def dashboard(session):
     st.title("📊 لوحة المؤشرات الذكية")
-    
-    # جلب البيانات
-    stats = get_dashboard_stats()
-    upcoming_pays, expiring_contracts = get_dashboard_alerts()
+
+    c_auto, c_every = st.columns([1, 2])
+    auto_refresh = c_auto.checkbox("🔄 تحديث تلقائي", key='dashboard_auto_refresh')
+    every = c_every.selectbox(
+        "كل (ثانية)", DASHBOARD_REFRESH_SECONDS, index=1,
+        key='dashboard_refresh_every', disabled=not auto_refresh
+    )
+
+    # القسم الحي: fragment يُعاد تشغيله وحده كل N ثانية (بلا مؤقت عند إيقاف التحديث)
+    live = page_fragment(
+        "لوحة المؤشرات (تحديث تلقائي)", needs_session=False,
+        run_every=every if auto_refresh else None
+    )(dashboard_body)
+    live(auto_refresh)
+
+
+def dashboard_body(auto_refresh):
+    """المؤشرات والرسم والتنبيهات؛ كل الأرقام من دوال مخزّنة مفتاحها إصدارات الجداول"""
+    changed_sections = dashboard_changes()
+    if auto_refresh:
+        status = "لا تغييرات" if not changed_sections else "أُعيد حساب: " + "، ".join(changed_sections)
+        st.caption(f"🟢 آخر فحص {datetime.now().strftime('%H:%M:%S')} — {status}")
+
+    # جلب البيانات: الاستعلامات مستقلة فتُنفَّذ بالتوازي، ومعها تسخين أقسام اللوحة الجزئية
+    # (التنبيهات والاتجاه واللقطة المرجعية) بقيمها الحالية فتقرأ من الذاكرة المؤقتة مباشرة
+    alert_days = st.session_state.get('dashboard_alert_days', 30)
+    trend_months = st.session_state.get('trend_months', TREND_MONTHS[1])
+    stats, expiring_contracts, _, _, _ = run_concurrently(
+        get_dashboard_stats,
+        get_expiring_contracts,
+        lambda: get_payment_alert_days(alert_days),
+        lambda: get_collection_rollup(trend_months),
+        reference_snapshot,
+    )
 
     # عرض الـ KPIs (المؤشرات الرئيسية)
     c1, c2, c3, c4 = st.columns(4)
@@ -750,43 +3098,37 @@ def dashboard():
         st.bar_chart(status_df.set_index('الحالة'), color="#3b82f6")
 
     with col_alerts:
-        st.subheader("⏰ تنبيهات التحصيل (30 يوم)")
-        if upcoming_pays:
-            for item in upcoming_pays:
-                # التأكد من طريقة فك الحزمة (Unpacking)
-                pay, t_name = item 
-                
-                days = (pay.due_date - date.today()).days
-                # تنسيق المبلغ والحالة
-                amt = pay.total or 0
-                if days == 0:
-                    st.error(f"🔴 **اليوم**: {t_name} (المبلغ: {amt:,.0f} ريال)")
-                elif days == 1:
-                    st.warning(f"🟠 **غداً**: {t_name} (المبلغ: {amt:,.0f} ريال)")
-                else:
-                    st.info(f"🔵 **بعد {days} يوم**: {t_name} (المبلغ: {amt:,.0f} ريال)")
-        else:
-            st.success("✅ لا توجد دفعات مستحقة قريباً")
+        dashboard_alerts()
 
     st.markdown("---")
     
     # تنبيهات العقود
     with st.expander("📋 عقود تقترب من الانتهاء (تجديد/إخلاء)", expanded=True):
-        if expiring_contracts:
-            for item in expiring_contracts:
-                cont, t_name = item
-                days = (cont.end_date - date.today()).days
-                st.warning(f"⚠️ عقد **{t_name}** (رقم: {cont.contract_number or cont.id}) - ينتهي خلال {days} يوم")
+        matching, expiring = expiring_contracts
+        if expiring:
+            st.warning(f"⚠️ {matching} عقد ينتهي خلال {EXPIRING_CONTRACT_DAYS} يوماً")
+            st.dataframe(pd.DataFrame([{
+                "المستأجر": t_name,
+                "رقم العقد": contract_number or contract_id,
+                "تاريخ الانتهاء": end_date.strftime('%Y-%m-%d'),
+                "المتبقي (يوم)": (end_date - date.today()).days,
+            } for contract_id, contract_number, end_date, t_name in expiring]), use_container_width=True, hide_index=True)
+            if matching > len(expiring):
+                st.caption(f"عرض أقرب {len(expiring)} من {matching} عقد")
         else:
             st.success("✅ جميع العقود سارية لفترة كافية")
 
-def manage_assets():
+    st.markdown("---")
+    dashboard_trend()
+
+
+def manage_assets(session):
     st.header("🏢 إدارة الأصول والوحدات")
     
-    # 1. جلب الأصول باستخدام الكاش (سريع جداً)
-    assets_df = get_cached_assets() 
+    # 1. الأصول والوحدات من اللقطة المرجعية المشتركة (بلا استعلام ولا نسخ)
+    snapshot = reference_snapshot()
 
-    if assets_df.empty:
+    if not snapshot.assets:
         st.info("لا توجد أصول مُضافة بعد.")
         return
     
@@ -795,7 +3137,7 @@ def manage_assets():
     
     st.subheader("📊 ملخص الأصول")
     col1, col2, col3 = st.columns(3)
-    col1.metric("إجمالي الأصول", len(assets_df))
+    col1.metric("إجمالي الأصول", len(snapshot.assets))
     col2.metric("إجمالي الوحدات", stats['rented'] + stats['empty'])
     col3.metric("الوحدات المؤجرة", stats['rented'])
     
@@ -809,60 +3151,64 @@ def manage_assets():
         with tab1:
             st.markdown("#### تعديل أو حذف وحدة")
             
-            # بدلاً من الاستعلام، نأخذ الأسماء من الـ DataFrame الموجود في الذاكرة
-            asset_options = dict(zip(assets_df['name'], assets_df['id']))
+            # بدلاً من الاستعلام، نأخذ الأسماء من اللقطة المرجعية
+            asset_options = {a.name: a.id for a in snapshot.assets}
             selected_asset_name = st.selectbox("🏢 اختر الأصل", options=list(asset_options.keys()), key='edit_asset_sel')
             selected_asset_id = asset_options[selected_asset_name]
 
-            # جلب الوحدات لهذا الأصل فقط
-            with get_safe_session() as session:
-                units = session.query(Unit).filter_by(asset_id=selected_asset_id).all()
+            # وحدات هذا الأصل فقط
+            units = snapshot.units_of(selected_asset_id)
                 
-                if units:
-                    # تحويل الوحدات لقاموس لسهولة الوصول
-                    unit_map = {f"وحدة {u.unit_number} - {u.usage_type} ({u.status})": u.id for u in units}
-                    selected_unit_label = st.selectbox("🔑 اختر الوحدة", options=list(unit_map.keys()))
-                    unit_id = unit_map[selected_unit_label]
+            if units:
+                # تحويل الوحدات لقاموس لسهولة الوصول
+                unit_map = {f"وحدة {u.unit_number} - {u.usage_type} ({u.status})": u.id for u in units}
+                selected_unit_label = st.selectbox("🔑 اختر الوحدة", options=list(unit_map.keys()))
+                unit_id = unit_map[selected_unit_label]
                     
-                    # جلب بيانات الوحدة المختارة
-                    unit_to_manage = session.get(Unit, unit_id)
+                # جلب بيانات الوحدة المختارة
+                unit_to_manage = session.get(Unit, unit_id)
+                if unit_to_manage is None:
+                    st.warning("⚠️ الوحدة لم تعد موجودة، حدّث الصفحة")
+                    return
                     
-                    # فحص العقود المرتبطة (استعلام سريع)
-                    has_active = session.query(Contract).filter(
-                        Contract.linked_units_ids.like(f"%{unit_id}%"),
+                # فحص العقود المرتبطة (استعلام مفهرس عبر جدول الربط)
+                has_active = session.query(contract_units.c.contract_id)\
+                    .join(Contract, Contract.id == contract_units.c.contract_id)\
+                    .filter(
+                        contract_units.c.unit_id == unit_id,
                         Contract.status == "نشط"
-                    ).count() > 0
-
-                    st.markdown("---")
-                    e_tab, d_tab = st.tabs(["📝 تعديل", "🗑️ حذف"])
+                    ).first() is not None
 
-                    with e_tab:
-                        with st.form("quick_edit_unit"):
-                            col_a, col_b = st.columns(2)
-                            new_floor = col_a.text_input("الدور", value=unit_to_manage.floor or "")
-                            new_status = col_b.selectbox("الحالة", ["فاضي", "مؤجر", "تحت الصيانة"], 
-                            index=["فاضي", "مؤجر", "تحت الصيانة"].index(unit_to_manage.status))
+                st.markdown("---")
+                e_tab, d_tab = st.tabs(["📝 تعديل", "🗑️ حذف"])
+
+                with e_tab:
+                    with st.form("quick_edit_unit"):
+                        col_a, col_b = st.columns(2)
+                        new_floor = col_a.text_input("الدور", value=unit_to_manage.floor or "")
+                        new_status = col_b.selectbox("الحالة", ["فاضي", "مؤجر", "تحت الصيانة"], 
+                        index=["فاضي", "مؤجر", "تحت الصيانة"].index(unit_to_manage.status))
                             
-                            if st.form_submit_button("💾 حفظ التعديلات", use_container_width=True):
-                                unit_to_manage.floor = new_floor
-                                unit_to_manage.status = new_status
+                        if st.form_submit_button("💾 حفظ التعديلات", use_container_width=True):
+                            unit_to_manage.floor = new_floor
+                            unit_to_manage.status = new_status
+                            session.commit()
+                            st.success("✅ تم التحديث")
+                            st.rerun()
+
+                with d_tab:
+                    if has_active:
+                        st.error("🚫 لا يمكن الحذف: الوحدة مرتبطة بعقد نشط")
+                    else:
+                        st.warning("⚠️ سيتم حذف الوحدة نهائياً")
+                        if st.checkbox(f"تأكيد حذف وحدة {unit_to_manage.unit_number}"):
+                            if st.button("🗑️ تنفيذ الحذف الآن"):
+                                session.delete(unit_to_manage)
                                 session.commit()
-                                st.success("✅ تم التحديث")
+                                st.success("Deleted!")
                                 st.rerun()
-
-                    with d_tab:
-                        if has_active:
-                            st.error("🚫 لا يمكن الحذف: الوحدة مرتبطة بعقد نشط")
-                        else:
-                            st.warning("⚠️ سيتم حذف الوحدة نهائياً")
-                            if st.checkbox(f"تأكيد حذف وحدة {unit_to_manage.unit_number}"):
-                                if st.button("🗑️ تنفيذ الحذف الآن"):
-                                    session.delete(unit_to_manage)
-                                    session.commit()
-                                    st.success("Deleted!")
-                                    st.rerun()
-                else:
-                    st.info("لا توجد وحدات في هذا الأصل")
+            else:
+                st.info("لا توجد وحدات في هذا الأصل")
         
         # ===================================================================
         # Tab 2: إضافة وحدة جديدة (Admin)
@@ -871,10 +3217,9 @@ def manage_assets():
             st.markdown("#### إضافة وحدة جديدة للأصل")
             
             with st.form("add_unit_form", clear_on_submit=True):
-                # استخدام session جديد هنا
-                with get_safe_session() as session_add:
-                    asset_list_add = session_add.query(Asset).all()
-                    asset_names_add = [a.name for a in asset_list_add]
+                # قائمة الأصول من اللقطة المرجعية
+                asset_list_add = snapshot.assets
+                asset_names_add = [a.name for a in asset_list_add]
                 
                 selected_asset_add = st.selectbox(
                     "🏢 اختر الأصل",
@@ -902,30 +3247,29 @@ def manage_assets():
                     if not unit_num_new.strip():
                         st.error("⚠️ الرجاء إدخال رقم/اسم الوحدة")
                     else:
-                        with get_safe_session() as session_submit:
-                            selected_asset_obj = next((a for a in asset_list_add if a.name == selected_asset_add), None)
+                        selected_asset_obj = next((a for a in asset_list_add if a.name == selected_asset_add), None)
                             
-                            if selected_asset_obj:
-                                existing = session_submit.query(Unit).filter(
-                                    Unit.asset_id == selected_asset_obj.id,
-                                    Unit.unit_number == unit_num_new.strip()
-                                ).first()
+                        if selected_asset_obj:
+                            existing = session.query(Unit).filter(
+                                Unit.asset_id == selected_asset_obj.id,
+                                Unit.unit_number == unit_num_new.strip()
+                            ).first()
                                 
-                                if existing:
-                                    st.error(f"⚠️ رقم الوحدة '{unit_num_new}' موجود بالفعل في هذا الأصل")
-                                else:
-                                    new_unit = Unit(
-                                        asset_id=selected_asset_obj.id,
-                                        unit_number=unit_num_new.strip(),
-                                        usage_type=usage_new,
-                                        floor=floor_new.strip() if floor_new else None,
-                                        area=area_new if area_new > 0 else None,
-                                        status="فاضي"
-                                    )
-                                    session_submit.add(new_unit)
-                                    session_submit.commit()
-                                    st.success(f"✅ تم إضافة الوحدة **{unit_num_new}** بنجاح!")
-                                    st.rerun()
+                            if existing:
+                                st.error(f"⚠️ رقم الوحدة '{unit_num_new}' موجود بالفعل في هذا الأصل")
+                            else:
+                                new_unit = Unit(
+                                    asset_id=selected_asset_obj.id,
+                                    unit_number=unit_num_new.strip(),
+                                    usage_type=usage_new,
+                                    floor=floor_new.strip() if floor_new else None,
+                                    area=area_new if area_new > 0 else None,
+                                    status="فاضي"
+                                )
+                                session.add(new_unit)
+                                session.commit()
+                                st.success(f"✅ تم إضافة الوحدة **{unit_num_new}** بنجاح!")
+                                st.rerun()
 
     # -------------------------------------------------------------------------
     # 2. للموظف (Employee): إضافة فقط
@@ -935,10 +3279,9 @@ def manage_assets():
         st.info("ℹ️ كموظف، يمكنك إضافة وحدات جديدة فقط. للتعديل أو الحذف، تواصل مع المدير.")
         
         with st.form("add_unit_form_employee", clear_on_submit=True):
-            # استخدام session جديد للموظف
-            with get_safe_session() as session_emp:
-                asset_list_add = session_emp.query(Asset).all()
-                asset_names_add = [a.name for a in asset_list_add]
+            # قائمة الأصول من اللقطة المرجعية
+            asset_list_add = snapshot.assets
+            asset_names_add = [a.name for a in asset_list_add]
             
             selected_asset_add = st.selectbox(
                 "🏢 اختر الأصل",
@@ -966,30 +3309,29 @@ def manage_assets():
                 if not unit_num_new.strip():
                     st.error("⚠️ الرجاء إدخال رقم/اسم الوحدة")
                 else:
-                    with get_safe_session() as session_submit_emp:
-                        selected_asset_obj = next((a for a in asset_list_add if a.name == selected_asset_add), None)
+                    selected_asset_obj = next((a for a in asset_list_add if a.name == selected_asset_add), None)
                         
-                        if selected_asset_obj:
-                            existing = session_submit_emp.query(Unit).filter(
-                                Unit.asset_id == selected_asset_obj.id,
-                                Unit.unit_number == unit_num_new.strip()
-                            ).first()
+                    if selected_asset_obj:
+                        existing = session.query(Unit).filter(
+                            Unit.asset_id == selected_asset_obj.id,
+                            Unit.unit_number == unit_num_new.strip()
+                        ).first()
                             
-                            if existing:
-                                st.error(f"⚠️ رقم الوحدة '{unit_num_new}' موجود بالفعل في هذا الأصل")
-                            else:
-                                new_unit = Unit(
-                                    asset_id=selected_asset_obj.id,
-                                    unit_number=unit_num_new.strip(),
-                                    usage_type=usage_new,
-                                    floor=floor_new.strip() if floor_new else None,
-                                    area=area_new if area_new > 0 else None,
-                                    status="فاضي"
-                                )
-                                session_submit_emp.add(new_unit)
-                                session_submit_emp.commit()
-                                st.success(f"✅ تم إضافة الوحدة **{unit_num_new}** بنجاح!")
-                                st.rerun()
+                        if existing:
+                            st.error(f"⚠️ رقم الوحدة '{unit_num_new}' موجود بالفعل في هذا الأصل")
+                        else:
+                            new_unit = Unit(
+                                asset_id=selected_asset_obj.id,
+                                unit_number=unit_num_new.strip(),
+                                usage_type=usage_new,
+                                floor=floor_new.strip() if floor_new else None,
+                                area=area_new if area_new > 0 else None,
+                                status="فاضي"
+                            )
+                            session.add(new_unit)
+                            session.commit()
+                            st.success(f"✅ تم إضافة الوحدة **{unit_num_new}** بنجاح!")
+                            st.rerun()
 
     # =========================================================================
     # قسم عرض تفاصيل الوحدات (للجميع)
@@ -997,7 +3339,7 @@ def manage_assets():
     st.markdown("---")
     st.subheader("🔍 عرض تفاصيل الوحدات")
     
-    view_asset_names = assets_df['name'].tolist()  # استخدام assets_df بدلاً من assets
+    view_asset_names = [a.name for a in snapshot.assets]
     
     if view_asset_names:
         selected_view_asset = st.selectbox(
@@ -1006,86 +3348,196 @@ def manage_assets():
             key='view_asset_select'
         )
         
-        # العثور على ID الأصل من DataFrame
-        view_asset_row = assets_df[assets_df['name'] == selected_view_asset]
-        if not view_asset_row.empty:
-            view_asset_id = int(view_asset_row['id'].values[0])
+        # العثور على ID الأصل من اللقطة
+        view_asset = next((a for a in snapshot.assets if a.name == selected_view_asset), None)
+        if view_asset:
+            view_asset_id = view_asset.id
             
-            # جلب الوحدات باستخدام session جديد
-            with get_safe_session() as session_view:
-                view_units = session_view.query(Unit).filter(Unit.asset_id == view_asset_id).all()
-                
-                if view_units:
-                    # عرض إحصائيات سريعة
-                    vacant = sum(1 for u in view_units if u.status == 'فاضي')
-                    rented = sum(1 for u in view_units if u.status == 'مؤجر')
-                    maintenance = sum(1 for u in view_units if u.status == 'تحت الصيانة')
+            # وحدات الأصل المختار
+            view_units = snapshot.units_of(view_asset_id)
+                
+            if view_units:
+                # عرض إحصائيات سريعة
+                vacant = sum(1 for u in view_units if u.status == 'فاضي')
+                rented = sum(1 for u in view_units if u.status == 'مؤجر')
+                maintenance = sum(1 for u in view_units if u.status == 'تحت الصيانة')
                     
-                    col1, col2, col3 = st.columns(3)
-                    with col1: st.metric("🟢 فارغة", vacant)
-                    with col2: st.metric("🔴 مؤجرة", rented)
-                    with col3: st.metric("🟡 صيانة", maintenance)
+                col1, col2, col3 = st.columns(3)
+                with col1: st.metric("🟢 فارغة", vacant)
+                with col2: st.metric("🔴 مؤجرة", rented)
+                with col3: st.metric("🟡 صيانة", maintenance)
                     
-                    # إنشاء DataFrame للعرض
-                    units_display_data = []
-                    for u in view_units:
-                        status_icon = {
-                            "فاضي": "🟢",
-                            "مؤجر": "🔴",
-                            "تحت الصيانة": "🟡"
-                        }.get(u.status, "⚪")
+                # إنشاء DataFrame للعرض
+                units_display_data = []
+                for u in view_units:
+                    status_icon = {
+                        "فاضي": "🟢",
+                        "مؤجر": "🔴",
+                        "تحت الصيانة": "🟡"
+                    }.get(u.status, "⚪")
                         
-                        units_display_data.append({
-                            'رقم الوحدة': u.unit_number,
-                            'الدور': u.floor if u.floor else '-',
-                            'النوع': u.usage_type,
-                            'الحالة': f"{status_icon} {u.status}",
-                            'المساحة (م²)': u.area if u.area else '-'
-                        })
+                    units_display_data.append({
+                        'رقم الوحدة': u.unit_number,
+                        'الدور': u.floor if u.floor else '-',
+                        'النوع': u.usage_type,
+                        'الحالة': f"{status_icon} {u.status}",
+                        'المساحة (م²)': u.area if u.area else '-'
+                    })
                     
-                    units_df = pd.DataFrame(units_display_data)
+                units_df = pd.DataFrame(units_display_data)
                     
-                    st.dataframe(
-                        units_df,
-                        use_container_width=True,
-                        hide_index=True
-                    )
-                else:
-                    st.info("لا توجد وحدات مضافة لهذا الأصل بعد.")
+                st.dataframe(
+                    units_df,
+                    use_container_width=True,
+                    hide_index=True
+                )
+            else:
+                st.info("لا توجد وحدات مضافة لهذا الأصل بعد.")
         else:
             st.error("حدث خطأ في تحديد الأصل المختار.")
     else:
-        st.info("لا توجد أصول لعرض وحداتها.")
+        st.info("لا توجد أصول لعرض وحداتها.")
+
+# ==========================================
+# محرك جدولة الدفعات (موحّد لكل مسارات توليد الدفعات)
+# ==========================================
+
+PAYMENT_FREQ_MONTHS = {"شهري": 1, "ربع سنوي": 3, "نصف سنوي": 6, "سنوي": 12}
+COPY_THRESHOLD = 1000  # عدد الصفوف الذي يُستخدم بعده COPY على PostgreSQL
+
+def build_payment_schedule(contracts):
+    """
+    حساب جدول الدفعات لعقد واحد أو مجموعة عقود دفعة واحدة (حساب متجه بـ NumPy)
+
+    Args:
+        contracts: عقود (كائنات ORM أو صفوف) تحتوي id, start_date, end_date,
+                   rent_amount (سنوي), payment_freq, vat_rate
+
+    Returns:
+        list[dict]: صفوف الدفعات جاهزة للإدراج الجماعي
+    """
+    contracts = list(contracts)
+    if not contracts:
+        return []
+
+    ids = np.array([c.id for c in contracts], dtype=np.int64)
+    starts = np.array([c.start_date for c in contracts], dtype='datetime64[D]')
+    ends = np.array([c.end_date for c in contracts], dtype='datetime64[D]')
+    rents = np.array([float(c.rent_amount or 0) for c in contracts])
+    steps = np.array([PAYMENT_FREQ_MONTHS.get(c.payment_freq, 12) for c in contracts], dtype=np.int64)
+    vat_rates = np.array([float(c.vat_rate or 0) for c in contracts])
+    vat_rates = np.where(vat_rates >= 1, vat_rates / 100, vat_rates)  # 15 → 0.15
+
+    # عدد الدفعات لكل عقد = عدد الأشهر ÷ الدورية (دفعة واحدة على الأقل)
+    start_months = starts.astype('datetime64[M]')
+    total_months = (ends.astype('datetime64[M]') - start_months).astype(np.int64)
+    counts = np.maximum(1, total_months // steps)
+
+    # فهرس الدفعة داخل عقدها (0, 1, 2, ...) لكل الصفوف مرة واحدة
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    seq = np.arange(counts.sum()) - offsets
+
+    # تاريخ الاستحقاق: نفس يوم البداية، مع القص لآخر الشهر (مثل relativedelta)
+    due_months = np.repeat(start_months, counts) + (seq * np.repeat(steps, counts)).astype('timedelta64[M]')
+    month_days = ((due_months + 1).astype('datetime64[D]') - due_months.astype('datetime64[D]')).astype(np.int64)
+    start_days = (starts - start_months.astype('datetime64[D]')).astype(np.int64)
+    day_index = np.minimum(np.repeat(start_days, counts), month_days - 1)
+    due_dates = due_months.astype('datetime64[D]') + day_index.astype('timedelta64[D]')
+
+    # المبالغ: الإيجار السنوي مقسوم على عدد الدفعات في السنة + الضريبة
+    amounts = np.round(np.repeat(rents * steps / 12, counts), 2)
+    vats = np.round(amounts * np.repeat(vat_rates, counts), 2)
+    totals = np.round(amounts + vats, 2)
+
+    return [
+        {
+            "contract_id": contract_id,
+            "payment_number": number,
+            "due_date": due_date,
+            "amount": amount,
+            "vat": vat,
+            "total": total,
+            "paid_amount": 0.0,
+            "remaining_amount": total,
+            "status": "مستحق",
+        }
+        for contract_id, number, due_date, amount, vat, total in zip(
+            np.repeat(ids, counts).tolist(),
+            (seq + 1).tolist(),
+            due_dates.tolist(),
+            amounts.tolist(),
+            vats.tolist(),
+            totals.tolist(),
+        )
+    ]
+
+
+def _copy_payments(session, rows):
+    """إدراج الدفعات بأمر COPY داخل نفس معاملة الجلسة (PostgreSQL فقط)"""
+    columns = list(rows[0].keys())
+
+    def fmt(value):
+        if value is None:
+            return "\\N"
+        if isinstance(value, date):
+            return value.isoformat()
+        return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(fmt(row[col]) for col in columns) + "\n")
+    buffer.seek(0)
+
+    dbapi_conn = session.connection().connection.dbapi_connection
+    with dbapi_conn.cursor() as cur:
+        cur.copy_expert(f"COPY payments ({', '.join(columns)}) FROM STDIN", buffer)
+    # COPY يتجاوز ORM، لذا تُسجَّل الكتابة يدوياً
+    WriteTracker.mark(session, "payments")
+
+
+def insert_payment_schedule(session, rows):
+    """إدراج جماعي للدفعات: COPY على PostgreSQL للدفعات الكبيرة، وإلا executemany"""
+    if not rows:
+        return 0
+    if session.bind.dialect.name == "postgresql" and len(rows) >= COPY_THRESHOLD:
+        _copy_payments(session, rows)
+    else:
+        session.execute(insert(Payment), rows)
+    return len(rows)
+
 
 def generate_contract_payments(session, contract):
     """توليد دفعات الإيجار تلقائياً بناءً على المدة والدورية"""
-    from dateutil.relativedelta import relativedelta
-    
-    # تحديد عدد الشهور بناءً على الدورية
-    freq_map = {"شهري": 1, "ربع سنوي": 3, "نصف سنوي": 6, "سنوي": 12}
-    months_step = freq_map.get(contract.payment_freq, 12)
-    
-    # حساب عدد الدفعات الإجمالي
-    total_months = (contract.end_date.year - contract.start_date.year) * 12 + (contract.end_date.month - contract.start_date.month)
-    num_payments = max(1, total_months // months_step)
-    
-    # القيمة لكل دفعة (شاملة الضريبة إذا كان تجارياً)
-    amount_per_period = (contract.rent_amount / (12 / months_step))
-    vat_amount = amount_per_period * contract.vat_rate
-    total_with_vat = amount_per_period + vat_amount
-
-    for i in range(num_payments):
-        payment_date = contract.start_date + relativedelta(months=(i * months_step))
-        new_payment = Payment(
-            contract_id=contract.id,
-            amount=total_with_vat,
-            due_date=payment_date,
-            status="معلق"
-        )
-        session.add(new_payment)
+    return insert_payment_schedule(session, build_payment_schedule([contract]))
+
 
+def backfill_payment_schedules(session, batch_size=500):
+    """
+    توليد الجداول لكل العقود النشطة التي لا تملك أي دفعات
 
-def manage_contracts():
+    Returns:
+        tuple: (عدد العقود, عدد الدفعات المُدرجة)
+    """
+    has_payments = exists().where(Payment.contract_id == Contract.id)
+    contracts = session.query(
+        Contract.id, Contract.start_date, Contract.end_date,
+        Contract.rent_amount, Contract.payment_freq, Contract.vat_rate
+    ).filter(
+        Contract.status == "نشط",
+        Contract.rent_amount > 0,
+        Contract.start_date.isnot(None),
+        Contract.end_date.isnot(None),
+        ~has_payments
+    ).all()
+
+    inserted = 0
+    for i in range(0, len(contracts), batch_size):
+        rows = build_payment_schedule(contracts[i:i + batch_size])
+        inserted += insert_payment_schedule(session, rows)
+    return len(contracts), inserted
+
+
+def manage_contracts(session):
     st.header("📄 إدارة العقود")
     # الموظف يقدر يضيف عقود فقط، المدير يقدر يضيف ويعدل
     if st.session_state['user_role'] in ['Admin', 'Employee']:
@@ -1094,19 +3546,20 @@ def manage_contracts():
         
         with st.expander("إنشاء عقد جديد", expanded=True):
             with st.form("new_contract"):
-                tenants = session.query(Tenant).all()
-                t_dict = {t.name: t.id for t in tenants}
-                
-                # وحدات غير مؤجرة
-                all_units = session.query(Unit).all()
-                u_options = {}
-                for u in all_units:
-                    contract_exists = session.query(Contract).filter(
-                        Contract.linked_units_ids.like(f"%{u.id}%")
-                    ).first()
-                    
-                    if u.status == 'فاضي' or (u.status == 'مؤجر' and not contract_exists):
-                        u_options[f"{u.unit_number} ({u.asset.name})"] = u.id
+                t_dict = {t.name: t.id for t in reference_snapshot().tenants}
+                
+                # وحدات غير مؤجرة (استعلام واحد بدلاً من استعلام لكل وحدة)
+                has_contract = exists().where(contract_units.c.unit_id == Unit.id)
+                available_units = session.query(Unit.id, Unit.unit_number, Asset.name)\
+                    .outerjoin(Asset, Unit.asset_id == Asset.id)\
+                    .filter(or_(
+                        Unit.status == 'فاضي',
+                        and_(Unit.status == 'مؤجر', ~has_contract)
+                    )).all()
+                u_options = {
+                    f"{unit_number} ({asset_name})": uid
+                    for uid, unit_number, asset_name in available_units
+                }
 
                 st.markdown("#### 📋 بيانات العقد الأساسية")
                 
@@ -1208,7 +3661,9 @@ def manage_contracts():
                         # 1. حساب تاريخ النهاية بدقة (باستخدام relativedelta)
                         e_date = s_date + relativedelta(years=int(contract_duration))
                         
-                        u_ids = ",".join([str(u_options[u]) for u in sel_units])
+                        selected_units = session.query(Unit).filter(
+                            Unit.id.in_([u_options[u] for u in sel_units])
+                        ).all()
                         vat = 0.15 if c_type == "تجاري" else 0.0
                         
                         # 2. إنشاء كائن العقد
@@ -1221,42 +3676,18 @@ def manage_contracts():
                             start_date=s_date, 
                             end_date=e_date,
                             vat_rate=vat, 
-                            linked_units_ids=u_ids,
+                            units=selected_units,
                             status="نشط"
                         )
                         session.add(new_c)
                         session.flush()  # للحصول على معرف العقد (ID) قبل الحفظ النهائي
 
                         # 3. تحديث حالة الوحدات إلى مؤجر
-                        for u_label in sel_units:
-                            uid = u_options[u_label]
-                            u_obj = session.get(Unit, uid)
-                            if u_obj:
-                                u_obj.status = "مؤجر"
-                        
-                        # 4. توليد الدفعات المالية تلقائياً
-                        # ==========================================
-                        freq_map = {"شهري": 1, "ربع سنوي": 3, "نصف سنوي": 6, "سنوي": 12}
-                        months_step = freq_map.get(freq, 12)
-                        
-                        # حساب عدد الدفعات بناءً على المدة والدورية
-                        total_months = int(contract_duration) * 12
-                        num_payments = total_months // months_step
+                        for u_obj in selected_units:
+                            u_obj.status = "مؤجر"
                         
-                        # حساب قيمة الدفعة الواحدة مع الضريبة
-                        base_payment = rent / (12 / months_step)
-                        total_payment = base_payment * (1 + vat)
-
-                        for i in range(num_payments):
-                            p_due_date = s_date + relativedelta(months=(i * months_step))
-                            new_p = Payment(
-                                contract_id=new_c.id,
-                                amount=total_payment,
-                                due_date=p_due_date,
-                                status="معلق"
-                            )
-                            session.add(new_p)
-                        # ==========================================
+                        # 4. توليد الدفعات المالية تلقائياً (محرك الجدولة الموحّد)
+                        num_payments = generate_contract_payments(session, new_c)
 
                         session.commit()
                         st.success(f"✅ تم إنشاء العقد رقم {contract_number} وجدولة {num_payments} دفعات بنجاح!")
@@ -1265,7 +3696,12 @@ def manage_contracts():
     # عرض العقود
     st.markdown("---")
     st.subheader("📋 قائمة العقود")
-    
+    contracts_list_section(page_session=session)
+
+
+@page_fragment("قائمة العقود", read_only=True)
+def contracts_list_section(session):
+    """قائمة العقود: تغيير الفلتر يعيد تشغيل هذا القسم وحده (جلسة قراءة فقط)"""
     # فلتر العقود
     filter_status = st.radio(
         "عرض:",
@@ -1273,37 +3709,22 @@ def manage_contracts():
         horizontal=True
     )
     
-    # جلب العقود حسب الفلتر
-    if filter_status == "العقود النشطة فقط":
-        contracts = session.query(Contract).filter_by(status="نشط").all()
-    elif filter_status == "العقود الملغية فقط":
-        contracts = session.query(Contract).filter_by(status="ملغي").all()
-    else:
-        contracts = session.query(Contract).all()
+    # جلب العقود حسب الفلتر (صفوف نموذج القراءة: استعلامان مهما كان عدد العقود)
+    status = {"العقود النشطة فقط": "نشط", "العقود الملغية فقط": "ملغي"}.get(filter_status)
+    contracts = contract_list_rows(session, status)
     
     if contracts:
         contracts_data = []
         
-        # تحسين: جلب جميع الوحدات مرة واحدة وتخزينها في قاموس للسرعة
-        all_units_lookup = {u.id: u.unit_number for u in session.query(Unit).all()}
-        
         for c in contracts:
             status_icon = "✅" if c.status == "نشط" else "🚫"
             
-            # معالجة الوحدات من القاموس مباشرة بدلاً من استعلام قاعدة البيانات لكل وحدة
-            unit_names = []
-            if c.linked_units_ids:
-                for uid in c.linked_units_ids.split(','):
-                    u_num = all_units_lookup.get(int(uid))
-                    if u_num:
-                        unit_names.append(u_num)
-            
             contracts_data.append({
                 'رقم العقد': c.contract_number or str(c.id),
-                'المستأجر': c.tenant.name,
+                'المستأجر': c.tenant_name or '-',
                 'النوع': c.contract_type,
                 'القيمة السنوية': f"{c.rent_amount:,.0f} ريال",
-                'الوحدات': ' | '.join(unit_names) if unit_names else '-',
+                'الوحدات': ' | '.join(c.unit_numbers) if c.unit_numbers else '-',
                 'تاريخ البداية': c.start_date,
                 'تاريخ النهاية': c.end_date,
                 'الحالة': f"{status_icon} {c.status}"
@@ -1313,7 +3734,9 @@ def manage_contracts():
         st.dataframe(contracts_df, use_container_width=True, hide_index=True)
     else:
         st.info("لا توجد عقود مطابقة للفلتر المحدد")
-def cancel_contract_page():
+
+
+def cancel_contract_page(session):
     """صفحة إلغاء العقود (للمدير فقط)"""
     st.header("🚫 إلغاء العقد")
     
@@ -1323,17 +3746,17 @@ def cancel_contract_page():
     
     st.warning("⚠️ تنبيه: إلغاء العقد لا يحذفه من النظام، بل يغير حالته إلى 'ملغي' للحفاظ على السجل التاريخي.")
     
-    # جلب العقود النشطة فقط
-    active_contracts = session.query(Contract).filter_by(status="نشط").all()
+    # العقود النشطة وأسماء المستأجرين من اللقطة المرجعية (بلا تحميل كسول لكل عقد)
+    snapshot = reference_snapshot()
     
-    if not active_contracts:
+    if not snapshot.contracts:
         st.info("لا توجد عقود نشطة لإلغائها")
         return
     
     # اختيار العقد
     contract_options = {}
-    for c in active_contracts:
-        label = f"عقد #{c.contract_number if c.contract_number else c.id} - {c.tenant.name} ({c.contract_type})"
+    for c in snapshot.contracts:
+        label = f"عقد #{c.contract_number if c.contract_number else c.id} - {snapshot.tenant_name(c.tenant_id)} ({c.contract_type})"
         contract_options[label] = c.id
     
     selected_contract_label = st.selectbox(
@@ -1343,7 +3766,10 @@ def cancel_contract_page():
     )
     
     contract_id = contract_options[selected_contract_label]
-    contract = session.get(Contract, contract_id)
+    contract = session.get(
+        Contract, contract_id,
+        options=[selectinload(Contract.units).joinedload(Unit.asset)]
+    )
     
     if contract:
         # عرض تفاصيل العقد
@@ -1360,13 +3786,8 @@ def cancel_contract_page():
                 st.write(f"**إلى:** {contract.end_date}")
             
             # عرض الوحدات المرتبطة
-            if contract.linked_units_ids:
-                unit_ids = contract.linked_units_ids.split(',')
-                unit_names = []
-                for uid in unit_ids:
-                    u = session.get(Unit, int(uid))
-                    if u:
-                        unit_names.append(f"{u.unit_number} ({u.asset.name})")
+            if contract.units:
+                unit_names = [f"{u.unit_number} ({u.asset.name if u.asset else '-'})" for u in contract.units]
                 st.write(f"**الوحدات:** {', '.join(unit_names)}")
         
         # التحقق من وجود دفعات
@@ -1459,12 +3880,8 @@ def cancel_contract_page():
                 contract.cancellation_date = date.today()
                 
                 # تحرير الوحدات
-                if contract.linked_units_ids:
-                    unit_ids = contract.linked_units_ids.split(',')
-                    for uid in unit_ids:
-                        unit = session.get(Unit, int(uid))
-                        if unit:
-                            unit.status = "فاضي"
+                for unit in contract.units:
+                    unit.status = "فاضي"
                 
                 # حذف الدفعات غير المدفوعة (اختياري)
                 pending_payments_to_delete = session.query(Payment).filter(
@@ -1490,33 +3907,49 @@ def cancel_contract_page():
                 
                 st.balloons()
                 st.rerun()
-def manage_payments():
+def manage_payments(session):
     st.header("💰 إدارة الدفعات")
 
     if st.session_state.get('user_role') == 'Employee':
         st.info("ℹ️ كموظف، يمكنك تسجيل الدفعات فقط")
 
+    if st.session_state.get('user_role') == 'Admin':
+        with st.expander("🔄 توليد الجداول لجميع العقود بدون دفعات"):
+            st.caption("يولّد دفعات كل العقود النشطة التي لا تملك جدولاً، بإدراج جماعي واحد لكل دفعة عقود.")
+            if st.button("🚀 توليد الجداول الناقصة", key='backfill_schedules_btn'):
+                with st.spinner("جاري توليد الجداول..."):
+                    contracts_count, payments_count = backfill_payment_schedules(session)
+                    session.commit()
+                if contracts_count:
+                    st.success(f"✅ تم توليد {payments_count} دفعة لـ {contracts_count} عقد")
+                else:
+                    st.info("جميع العقود النشطة لديها جداول دفعات")
+
+    payments_section(page_session=session)
+
+
+@page_fragment("إدارة الدفعات")
+def payments_section(session):
+    """اختيار العقد وجدول دفعاته ونموذج التحصيل: كل تفاعل هنا يعيد تشغيل هذا القسم وحده"""
     # ----------------------------------
-    # جلب العقود النشطة مع المستأجر (تحسين الأداء)
+    # العقود النشطة من اللقطة المرجعية، ثم تحميل العقد المختار فقط
     # ----------------------------------
-    from sqlalchemy.orm import joinedload
+    snapshot = reference_snapshot()
 
-    contracts = session.query(Contract)\
-        .options(joinedload(Contract.tenant))\
-        .filter(Contract.status == "نشط")\
-        .all()
-
-    if not contracts:
+    if not snapshot.contracts:
         st.warning("لا توجد عقود نشطة")
         return
 
     contract_map = {
-        f"عقد #{c.contract_number or c.id} - {c.tenant.name}": c
-        for c in contracts
+        f"عقد #{c.contract_number or c.id} - {snapshot.tenant_name(c.tenant_id)}": c.id
+        for c in snapshot.contracts
     }
 
     selected_label = st.selectbox("اختر العقد", contract_map.keys())
-    contract = contract_map[selected_label]
+    contract = session.get(Contract, contract_map[selected_label], options=[joinedload(Contract.tenant)])
+    if contract is None:
+        st.warning("⚠️ العقد لم يعد موجوداً، حدّث الصفحة")
+        return
 
     # ----------------------------------
     # معلومات العقد
@@ -1535,10 +3968,9 @@ def manage_payments():
     # ----------------------------------
     # جلب الدفعات
     # ----------------------------------
-    payments = session.query(Payment)\
-        .filter(Payment.contract_id == contract.id)\
-        .order_by(Payment.due_date)\
-        .all()
+    payments = [PaymentRow(*row) for row in session.execute(
+        hot_statements.payments_by_contract, {"contract_id": contract.id}
+    )]
 
     # ----------------------------------
     # توليد الدفعات (لو غير موجودة)
@@ -1552,48 +3984,15 @@ def manage_payments():
                 st.error("❌ مبلغ العقد غير صحيح")
                 return
 
-            from dateutil.relativedelta import relativedelta
-
-            freq_map = {"شهري": 1, "ربع سنوي": 3, "نصف سنوي": 6, "سنوي": 12}
-            step = freq_map.get(contract.payment_freq, 12)
-
-            # حساب مدة العقد بالأشهر
-            total_months = (contract.end_date.year - contract.start_date.year) * 12 + \
-                           (contract.end_date.month - contract.start_date.month)
-
-            num_payments = total_months // step
-            amount_per_payment = float(contract.rent_amount) / num_payments
-
-            vat_rate = float(contract.vat_rate or 0)
-            if vat_rate >= 1:
-                vat_rate /= 100
-
-            payments_to_add = []
-            due_date = contract.start_date
-
-            for i in range(1, num_payments + 1):
-                vat_value = round(amount_per_payment * vat_rate, 2)
-                total = round(amount_per_payment + vat_value, 2)
-
-                payments_to_add.append(Payment(
-                    contract_id=contract.id,
-                    payment_number=i,
-                    due_date=due_date,
-                    amount=round(amount_per_payment, 2),
-                    vat=vat_value,
-                    total=total,
-                    paid_amount=0.0,
-                    remaining_amount=total,
-                    status="مستحق"
-                ))
-
-                due_date += relativedelta(months=step)
+            if not contract.start_date or not contract.end_date:
+                st.error("❌ تواريخ العقد غير مكتملة")
+                return
 
-            session.add_all(payments_to_add)
+            generated = generate_contract_payments(session, contract)
             session.commit()
 
-            st.success(f"✅ تم توليد {len(payments_to_add)} دفعة بنجاح")
-            st.rerun()
+            st.success(f"✅ تم توليد {generated} دفعة بنجاح")
+            rerun_fragment()
 
     # ----------------------------------
     # ملخص مالي
@@ -1668,25 +4067,214 @@ def manage_payments():
 
                     session.commit()
                     st.success("✅ تم تسجيل السداد")
-                    st.rerun()
+                    rerun_fragment()
         else:
             st.success("🎉 تم تحصيل جميع دفعات العقد")
 
-def reports_page():
+# ==========================================
+# نتائج التقارير (مخزنة حسب نوع التقرير + المعاملات + إصدارات الجداول)
+# ==========================================
+
+def _report_result(df, **totals):
+    """نتيجة جاهزة للعرض: الجدول + ملف CSV محسوب مسبقاً + المجاميع"""
+    return {"df": df, "csv": df.to_csv(index=False).encode("utf-8-sig"), **totals}
+
+
+@cached_loader("payments", "contracts", "tenants", "units", "assets", "contract_units")
+def financial_report(asset_name, status, limit):
+    """التقرير المالي الشامل (الأصل يُحسب من جدول الربط contract_units)؛ None = الكل"""
+    # 1. أصل العقد = أصل أول وحدة مرتبطة به (استعلام فرعي مفهرس على contract_units)
+    contract_asset = select(Asset.name)\
+        .select_from(contract_units)\
+        .join(Unit, Unit.id == contract_units.c.unit_id)\
+        .join(Asset, Asset.id == Unit.asset_id)\
+        .where(contract_units.c.contract_id == Contract.id)\
+        .order_by(contract_units.c.unit_id)\
+        .limit(1)\
+        .correlate(Contract)\
+        .scalar_subquery()
+
+    with read_session() as session:
+        # 2. استعلام الدفعات مع العقود والمستأجرين والأصل في استعلام واحد
+        query = session.query(
+            Payment.id.label("رقم"),
+            Contract.contract_number.label("العقد"),
+            Tenant.name.label("المستأجر"),
+            Payment.due_date.label("الاستحقاق"),
+            Payment.total.label("الإجمالي"),
+            Payment.paid_amount.label("المدفوع"),
+            Payment.remaining_amount.label("المتبقي"),
+            Payment.status.label("الحالة"),
+            Payment.payment_method.label("طريقة السداد"),
+            func.coalesce(contract_asset, "غير محدد").label("الأصل")
+        ).select_from(Payment)\
+         .join(Contract, Payment.contract_id == Contract.id)\
+         .join(Tenant, Contract.tenant_id == Tenant.id)\
+         .filter(Contract.status == "نشط")
+
+        if status is not None:
+            query = query.filter(Payment.status == status)
+
+        # 3. التصفية حسب الأصل داخل قاعدة البيانات (قبل حد الصفوف)
+        if asset_name is not None:
+            query = query.filter(contract_asset == asset_name)
+
+        df = read_frame(session, query.limit(limit).statement)
+
+    # 4. معالجة القيم الفارغة للحسابات
+    for col in ['الإجمالي', 'المدفوع', 'المتبقي']:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+
+    return _report_result(df, total=float(df['الإجمالي'].sum()), remaining=float(df['المتبقي'].sum()))
+
+
+@cached_loader("payments", "contracts", "tenants")
+def overdue_report():
+    """الدفعات المتأخرة للعقود النشطة (المفتاح يشمل تاريخ اليوم)"""
+    with read_session() as session:
+        query = session.query(
+            Tenant.name.label("المستأجر"),
+            Tenant.phone.label("الهاتف"),
+            Payment.due_date.label("تاريخ الاستحقاق"),
+            Payment.remaining_amount.label("المبلغ المتأخر"),
+            Payment.payment_method.label("طريقة السداد")
+        ).select_from(Payment)\
+         .join(Contract, Payment.contract_id == Contract.id)\
+         .join(Tenant, Contract.tenant_id == Tenant.id)\
+         .filter(
+             Payment.remaining_amount > 0,
+             Payment.due_date < date.today(),
+             Contract.status == "نشط"
+         )
+        df = read_frame(session, query.statement)
+
+    return _report_result(df, total=float(df['المبلغ المتأخر'].sum()))
+
+
+@cached_loader("payments", "contracts")
+def tenant_report(tenant_id):
+    """دفعات العقود النشطة لمستأجر واحد في استعلام واحد"""
+    with read_session() as session:
+        return _report_result(tenant_payments_frame(session, tenant_id))
+
+
+AGING_DETAIL_LIMIT = 500  # أقصى عدد دفعات في تفاصيل خلية من تقرير الأعمار
+AGING_VIEWS = {"المستأجر": ("tenant_id", "المستأجر"), "الأصل": ("asset_id", "الأصل")}
+
+
+def _aging_with_totals(frame, label):
+    """جدول التصدير/العرض: بلا أعمدة المعرّفات + صف الإجمالي"""
+    shown = frame.drop(columns=[c for c in ("tenant_id", "asset_id") if c in frame])
+    totals = {column: shown[column].sum() for column in shown.select_dtypes("number")}
+    return pd.concat([shown, pd.DataFrame([{label: "الإجمالي", **totals}])], ignore_index=True)
+
+
+@cached_loader("payments", "contracts", "tenants", "units", "assets", "contract_units")
+def aging_report():
+    """
+    أعمار الذمم: مصفوفة (المستأجر، الأصل) من استعلام تجميع واحد، ثم تجميعها حسب المستأجر
+    وحسب الأصل (بضع مئات صف لا صفوف دفعات)، مع ملفات CSV و Excel جاهزة
+    """
+    with read_session() as session:
+        matrix = read_frame(session, hot_statements.aging_matrix, aging_boundaries(date.today()))
+    names = {asset.id: asset.name for asset in reference_snapshot().assets}
+    matrix.insert(3, "الأصل", matrix["asset_id"].map(names).fillna("غير محدد"))
+    amounts = list(AGING_BUCKET_NAMES) + ["الإجمالي", "الدفعات"]
+    matrix.insert(3 + len(AGING_BUCKET_NAMES) + 1, "الإجمالي", matrix[list(AGING_BUCKET_NAMES)].sum(axis=1))
+
+    views = {
+        view: matrix.groupby(list(columns), as_index=False)[amounts].sum().sort_values("الإجمالي", ascending=False)
+        for view, columns in AGING_VIEWS.items()
+    }
+    excel = io.BytesIO()
+    with pd.ExcelWriter(excel, engine='openpyxl') as writer:
+        for view, frame in views.items():
+            _aging_with_totals(frame, view).to_excel(writer, sheet_name=f"حسب {view}", index=False)
+        _aging_with_totals(matrix, "المستأجر").to_excel(writer, sheet_name="المستأجر والأصل", index=False)
+
+    return {
+        "views": views,
+        "totals": matrix[amounts].sum().to_dict(),
+        "csv": {view: _aging_with_totals(frame, view).to_csv(index=False).encode("utf-8-sig")
+                for view, frame in views.items()},
+        "excel": excel.getvalue(),
+    }
+
+
+@cached_loader("payments", "contracts", "tenants", "units", "contract_units")
+def aging_details(tenant_id=None, asset_id=None, bucket=None):
+    """الدفعات خلف خلية من تقرير الأعمار (أقدمها أولاً، بحد AGING_DETAIL_LIMIT)"""
+    today = date.today()
+    with read_session() as session:
+        df = read_frame(session, aging_payments_statement(tenant_id, asset_id, bucket, AGING_DETAIL_LIMIT),
+                        aging_boundaries(today))
+    df.insert(4, "أيام التأخير", (pd.Timestamp(today) - pd.to_datetime(df["الاستحقاق"])).dt.days.clip(lower=0))
+    return df
+
+
+def aging_report_section():
+    """تقرير أعمار الذمم: الفئات، الجدول حسب المستأجر أو الأصل، التصدير، وتفاصيل أي خلية"""
+    report = aging_report()
+    totals = report["totals"]
+    if not totals["الدفعات"]:
+        st.success("✅ لا توجد مبالغ مستحقة")
+        return
+
+    columns = st.columns(len(AGING_BUCKET_NAMES) + 1)
+    for column, name in zip(columns, AGING_BUCKET_NAMES + ("الإجمالي",)):
+        column.metric(name, f"{totals[name]:,.0f}")
+    st.caption(f"جاري = يستحق خلال {AGING_CURRENT_DAYS} يوماً ولم يتأخر؛ بقية الفئات بأيام التأخير. "
+               f"{totals['الدفعات']:,.0f} دفعة في العقود النشطة")
+
+    view = st.radio("حسب", list(AGING_VIEWS), horizontal=True, key='aging_view')
+    frame = report["views"][view]
+    shown = _aging_with_totals(frame, view)
+    st.dataframe(shown.round(0), use_container_width=True, hide_index=True)
+
+    col1, col2 = st.columns(2)
+    col1.download_button("⬇️ تحميل CSV", report["csv"][view], f"aging_by_{AGING_VIEWS[view][0]}.csv", "text/csv")
+    col2.download_button(
+        "⬇️ تحميل Excel", report["excel"], "aging_report.xlsx",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+
+    # ===== تفاصيل خلية: صف من الجدول × فئة =====
+    st.markdown("**🔎 الدفعات خلف خلية**")
+    id_column, label_column = AGING_VIEWS[view]
+    labels = dict(zip(frame[id_column], frame[label_column]))
+    col1, col2 = st.columns([2, 1])
+    row_id = col1.selectbox(
+        view, [None] + list(labels), key=f'aging_detail_{id_column}',
+        format_func=lambda i: "— اختر لعرض الدفعات —" if i is None else labels[i]
+    )
+    bucket = col2.selectbox("الفئة", ("الكل",) + AGING_BUCKET_NAMES, key='aging_detail_bucket')
+    if row_id is None:
+        return
+    details = aging_details(
+        **{id_column: int(row_id)}, bucket=None if bucket == "الكل" else bucket
+    )
+    if details.empty:
+        st.info("لا توجد دفعات في هذه الخلية")
+        return
+    st.dataframe(details, use_container_width=True, hide_index=True)
+    if len(details) == AGING_DETAIL_LIMIT:
+        st.caption(f"عرض أقدم {AGING_DETAIL_LIMIT} دفعة فقط")
+
+
+def reports_page(session):
     st.header("📑 التقارير")
 
     report_type = st.radio(
         "اختر نوع التقرير",
-        ["تقرير مالي شامل", "المتأخرات", "تقرير المستأجر التفصيلي"],
+        ["تقرير مالي شامل", "المتأخرات", "أعمار الذمم", "تقرير المستأجر التفصيلي"],
         horizontal=True
     )
 
    # ======================================================
-    # 📊 التقرير المالي الشامل (النسخة المصلحة لهيكلة linked_units_ids)
+    # 📊 التقرير المالي الشامل
     # ======================================================
     if report_type == "تقرير مالي شامل":
-        assets = session.query(Asset).all()
-        asset_names = ["الكل"] + [a.name for a in assets]
+        asset_names = ["الكل"] + [a.name for a in reference_snapshot().assets]
 
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -1699,71 +4287,29 @@ def reports_page():
         with col3:
             limit = st.number_input("عدد الصفوف", 100, 5000, 1000)
 
-        # 1. استعلام الدفعات مع العقود والمستأجرين فقط (بدون الأصول حالياً)
-        query = session.query(
-            Payment.id.label("رقم"),
-            Contract.contract_number.label("العقد"),
-            Tenant.name.label("المستأجر"),
-            Contract.linked_units_ids, # سنجلب هذا الحقل لنعرف الوحدة
-            Payment.due_date.label("الاستحقاق"),
-            Payment.total.label("الإجمالي"),
-            Payment.paid_amount.label("المدفوع"),
-            Payment.remaining_amount.label("المتبقي"),
-            Payment.status.label("الحالة"),
-            Payment.payment_method.label("طريقة السداد")
-        ).select_from(Payment)\
-         .join(Contract, Payment.contract_id == Contract.id)\
-         .join(Tenant, Contract.tenant_id == Tenant.id)\
-         .filter(Contract.status == "نشط")
-
-        if selected_status != "الكل":
-            query = query.filter(Payment.status == selected_status)
-
-        query = query.limit(limit)
-        df = pd.read_sql(query.statement, session.bind)
+        # معاملات موحّدة: نفس التصفية = نفس المفتاح مهما تنقّل المستخدم بين الخيارات
+        report = financial_report(
+            None if selected_asset == "الكل" else selected_asset,
+            None if selected_status == "الكل" else selected_status,
+            int(limit),
+        )
+        df = report["df"]
 
         if df.empty:
             st.info("لا توجد بيانات")
             return
 
-        # 2. ربط "الأصل" برمجياً (لأن الحقل linked_units_ids نصي)
-        # سنقوم بإنشاء قاموس للوحدات والأصول لتسريع العملية
-        units = session.query(Unit).all()
-        unit_to_asset = {str(u.id): (session.query(Asset).filter_by(id=u.asset_id).first().name if u.asset_id else "بدون أصل") for u in units}
-        
-        def get_asset_name(unit_ids_str):
-            if not unit_ids_str: return "غير محدد"
-            # نأخذ أول معرف وحدة موجود في النص
-            first_unit_id = unit_ids_str.split(',')[0].strip()
-            return unit_to_asset.get(first_unit_id, "غير معروف")
-
-        df['الأصل'] = df['linked_units_ids'].apply(get_asset_name)
-
-        # 3. التصفية حسب الأصل بعد المعالجة
-        if selected_asset != "الكل":
-            df = df[df['الأصل'] == selected_asset]
-
-        # 4. معالجة القيم الفارغة للحسابات
-        for col in ['الإجمالي', 'المدفوع', 'المتبقي']:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-
         # ================= عرض النتائج =================
-        if df.empty:
-            st.warning("لا توجد نتائج لهذا الأصل")
-            return
-
         c1, c2, c3 = st.columns(3)
         c1.metric("عدد الدفعات", len(df))
-        c2.metric("إجمالي المبلغ", f"{df['الإجمالي'].sum():,.0f} ر.س")
-        c3.metric("إجمالي المتبقي", f"{df['المتبقي'].sum():,.0f} ر.س")
+        c2.metric("إجمالي المبلغ", f"{report['total']:,.0f} ر.س")
+        c3.metric("إجمالي المتبقي", f"{report['remaining']:,.0f} ر.س")
 
-        # إخفاء العمود التقني قبل العرض
-        display_df = df.drop(columns=['linked_units_ids'])
-        st.dataframe(display_df, use_container_width=True, hide_index=True)
+        st.dataframe(df, use_container_width=True, hide_index=True)
 
         st.download_button(
             "⬇️ تحميل CSV",
-            display_df.to_csv(index=False).encode("utf-8-sig"),
+            report["csv"],
             "financial_report.csv",
             "text/csv"
         )
@@ -1772,68 +4318,43 @@ def reports_page():
     # ⏰ تقرير المتأخرات
     # ======================================================
     elif report_type == "المتأخرات":
-        query = session.query(
-            Tenant.name.label("المستأجر"),
-            Tenant.phone.label("الهاتف"),
-            Payment.due_date.label("تاريخ الاستحقاق"),
-            Payment.remaining_amount.label("المبلغ المتأخر"),
-            Payment.payment_method.label("طريقة السداد")
-        ).select_from(Payment)\
-         .join(Contract, Payment.contract_id == Contract.id)\
-         .join(Tenant, Contract.tenant_id == Tenant.id)\
-         .filter(
-             Payment.remaining_amount > 0,
-             Payment.due_date < date.today(),
-             Contract.status == "نشط"
-         )
-
-        df = pd.read_sql(query.statement, session.bind)
+        report = overdue_report()
+        df = report["df"]
 
         if df.empty:
             st.success("✅ لا توجد متأخرات")
             return
 
-        st.error(f"💰 إجمالي المتأخرات: {df['المبلغ المتأخر'].sum():,.2f} ر.س")
+        st.error(f"💰 إجمالي المتأخرات: {report['total']:,.2f} ر.س")
         st.dataframe(df, use_container_width=True)
 
         st.download_button(
             "⬇️ تحميل تقرير المتأخرات",
-            df.to_csv(index=False).encode("utf-8-sig"),
+            report["csv"],
             "overdue_report.csv",
             "text/csv"
         )
 
+    # ======================================================
+    # 📅 أعمار الذمم
+    # ======================================================
+    elif report_type == "أعمار الذمم":
+        aging_report_section()
+
     # ======================================================
     # 🧾 تقرير المستأجر التفصيلي
     # ======================================================
     else:
-        tenants = session.query(Tenant).all()
-        if not tenants:
+        snapshot = reference_snapshot()
+        if not snapshot.tenants:
             st.warning("لا يوجد مستأجرين")
             return
 
-        tenant_name = st.selectbox("اختر المستأجر", [t.name for t in tenants])
-        tenant = session.query(Tenant).filter(Tenant.name == tenant_name).first()
+        tenant_name = st.selectbox("اختر المستأجر", [t.name for t in snapshot.tenants])
+        tenant = next(t for t in snapshot.tenants if t.name == tenant_name)
 
-        contracts = session.query(Contract)\
-            .filter(Contract.tenant_id == tenant.id, Contract.status == "نشط")\
-            .all()
-
-        rows = []
-        for contract in contracts:
-            payments = session.query(Payment).filter(Payment.contract_id == contract.id).all()
-            for pay in payments:
-                rows.append({
-                    "العقد": contract.contract_number or contract.id,
-                    "الاستحقاق": pay.due_date,
-                    "الإجمالي": pay.total,
-                    "المدفوع": pay.paid_amount,
-                    "المتبقي": pay.remaining_amount,
-                    "الحالة": pay.status,
-                    "طريقة السداد": pay.payment_method
-                })
-
-        df = pd.DataFrame(rows)
+        report = tenant_report(tenant.id)
+        df = report["df"]
         if df.empty:
             st.info("لا توجد بيانات لهذا المستأجر")
             return
@@ -1841,13 +4362,13 @@ def reports_page():
         st.dataframe(df, use_container_width=True)
         st.download_button(
             "⬇️ تحميل تقرير المستأجر",
-            df.to_csv(index=False).encode("utf-8-sig"),
+            report["csv"],
             f"tenant_{tenant.name}.csv",
             "text/csv"
         )
 
 
-def settings_page():
+def settings_page(session):
     st.header("⚙️ إعدادات المستخدم")
     
     if st.session_state['user_role'] == 'Admin':
@@ -1905,7 +4426,7 @@ def settings_page():
 # =================================================================
 
 
-def manage_tenants():
+def manage_tenants(session):
     st.header("👥 إدارة المستأجرين")
     
     # عرض ملخص سريع
@@ -1926,7 +4447,16 @@ def manage_tenants():
         st.metric("مستأجرين بدون عقود", total_tenants - tenants_with_contracts)
     
     st.markdown("---")
-    
+
+    tenants_section(page_session=session)
+
+
+@page_fragment("إدارة المستأجرين")
+def tenants_section(session):
+    """
+    محرر المستأجرين + القائمة: اختيار مستأجر أو البحث أو حفظ تعديل يعيد تشغيل هذا القسم وحده
+    (الإضافة والحذف تعيد تشغيل الصفحة كاملة لأنهما يغيّران الملخص أعلاها)
+    """
     # =========================================================================
     # قسم الإدارة - متاح للمدير والموظف (مع اختلاف الصلاحيات)
     # =========================================================================
@@ -1957,7 +4487,7 @@ def manage_tenants():
             else:
                 st.markdown("#### تعديل بيانات مستأجر")
             
-            tenants_list = session.query(Tenant).all()
+            tenants_list = reference_snapshot().tenants
             
             if tenants_list:
                 tenant_names = [f"{t.name} - {t.type or 'غير محدد'}" for t in tenants_list]
@@ -1970,7 +4500,10 @@ def manage_tenants():
                 
                 # العثور على المستأجر المختار
                 selected_index = tenant_names.index(selected_tenant_label)
-                selected_tenant = tenants_list[selected_index]
+                selected_tenant = session.get(Tenant, tenants_list[selected_index].id)
+                if selected_tenant is None:
+                    st.warning("⚠️ المستأجر لم يعد موجوداً، حدّث الصفحة")
+                    return
                 
                 # عرض بيانات المستأجر الحالية في expander
                 with st.expander("📄 البيانات الحالية", expanded=True):
@@ -1989,17 +4522,14 @@ def manage_tenants():
                         st.write(f"**ملاحظات:** {selected_tenant.notes}")
                 
                 # عرض العقود المرتبطة
-                tenant_contracts = session.query(Contract).filter_by(tenant_id=selected_tenant.id).all()
+                tenant_contracts = session.query(Contract)\
+                    .options(selectinload(Contract.units).joinedload(Unit.asset))\
+                    .filter_by(tenant_id=selected_tenant.id).all()
                 if tenant_contracts:
                     st.markdown("##### 📑 العقود المرتبطة")
                     contracts_data = []
                     for c in tenant_contracts:
-                        unit_names = []
-                        if c.linked_units_ids:
-                            for uid in c.linked_units_ids.split(','):
-                                u = session.get(Unit, int(uid))
-                                if u:
-                                    unit_names.append(f"{u.unit_number} ({u.asset.name})")
+                        unit_names = [f"{u.unit_number} ({u.asset.name if u.asset else '-'})" for u in c.units]
                         
                         contracts_data.append({
                             'رقم العقد': c.contract_number or c.id,
@@ -2096,7 +4626,7 @@ def manage_tenants():
                                 
                                 session.commit()
                                 st.success(f"✅ تم تحديث بيانات **{new_name}** بنجاح!")
-                                st.rerun()
+                                rerun_fragment()
                 
                 # ===== Tab: حذف المستأجر (للمدير فقط) =====
                 if st.session_state['user_role'] == 'Admin':
@@ -2124,12 +4654,7 @@ def manage_tenants():
                             
                             with st.expander("📋 العقود النشطة"):
                                 for contract in active_contracts:
-                                    unit_names = []
-                                    if contract.linked_units_ids:
-                                        for uid in contract.linked_units_ids.split(','):
-                                            u = session.get(Unit, int(uid))
-                                            if u:
-                                                unit_names.append(f"{u.unit_number} ({u.asset.name})")
+                                    unit_names = [f"{u.unit_number} ({u.asset.name if u.asset else '-'})" for u in contract.units]
                                     
                                     st.write(f"- عقد #{contract.contract_number or contract.id}")
                                     st.write(f"  - النوع: {contract.contract_type}")
@@ -2316,27 +4841,19 @@ def manage_tenants():
     st.markdown("---")
     st.subheader("📋 قائمة المستأجرين")
     
-    all_tenants = session.query(Tenant).all()
+    all_tenants = tenant_list_rows(session)
     
     if all_tenants:
         tenants_display = []
         for t in all_tenants:
-            contracts_count = session.query(Contract).filter_by(tenant_id=t.id, status="نشط").count()
-            
-            active_contracts = session.query(Contract).filter(
-                Contract.tenant_id == t.id,
-                Contract.end_date >= date.today(),
-                Contract.status == "نشط"
-            ).count()
-            
-            status = "🟢 نشط" if active_contracts > 0 else "⚪ غير نشط"
+            status = "🟢 نشط" if t.running_count > 0 else "⚪ غير نشط"
             
             tenants_display.append({
                 'الاسم': t.name,
                 'النوع': t.type or '-',
                 'الهاتف': t.phone or '-',
                 'البريد الإلكتروني': t.email or '-',
-                'عدد العقود': contracts_count,
+                'عدد العقود': t.contracts_count,
                 'الحالة': status
             })
         
@@ -2377,12 +4894,12 @@ def manage_tenants():
 
 # يفترض الكود وجود session و models (Asset, Unit, Contract) معرفة مسبقاً في التطبيق
 
-def manage_assets_only():
+def manage_assets_only(session):
     """صفحة مخصصة لإدارة الأصول فقط"""
     st.header("🏢 إدارة الأصول")
     
-    # جلب جميع الأصول
-    all_assets = session.query(Asset).all()
+    # جميع الأصول مع عدد وحداتها (صفوف نموذج القراءة)
+    all_assets = asset_list_rows(session)
     total_assets = len(all_assets)
     
     # عرض ملخص سريع
@@ -2423,17 +4940,13 @@ def manage_assets_only():
             if all_assets:
                 assets_display = []
                 for asset in all_assets:
-                    # عد الوحدات في كل أصل
-                    units_count = session.query(Unit).filter_by(asset_id=asset.id).count()
-                    rented_units = session.query(Unit).filter_by(asset_id=asset.id, status="مؤجر").count()
-                    
                     assets_display.append({
                         'ID': asset.id,
                         'اسم الأصل': asset.name,
                         'النوع': asset.type,
                         'الموقع': asset.location or '-',
-                        'عدد الوحدات': units_count,
-                        'الوحدات المؤجرة': rented_units,
+                        'عدد الوحدات': asset.units_count,
+                        'الوحدات المؤجرة': asset.rented_count,
                         'الوصف': asset.description or '-'
                     })
                 
@@ -2527,7 +5040,10 @@ def manage_assets_only():
                 
                 # العثور على الأصل المختار
                 selected_index = asset_names.index(selected_asset_label)
-                selected_asset = all_assets[selected_index]
+                selected_asset = session.get(Asset, all_assets[selected_index].id)
+                if selected_asset is None:
+                    st.warning("⚠️ الأصل لم يعد موجوداً، حدّث الصفحة")
+                    return
                 
                 # عرض معلومات الأصل الحالية
                 with st.expander("📄 البيانات الحالية", expanded=True):
@@ -2544,16 +5060,14 @@ def manage_assets_only():
                     units_count = len(units_in_asset)
                     rented_count = sum(1 for u in units_in_asset if u.status == "مؤجر")
                     
-                    # حساب العقود المرتبطة
-                    unit_ids = [str(u.id) for u in units_in_asset]
-                    contracts_linked = []
-                    if unit_ids:
-                        all_contracts = session.query(Contract).filter(Contract.status == "نشط").all()
-                        for contract in all_contracts:
-                            if contract.linked_units_ids:
-                                contract_unit_ids = contract.linked_units_ids.split(',')
-                                if any(uid in contract_unit_ids for uid in unit_ids):
-                                    contracts_linked.append(contract)
+                    # حساب العقود النشطة المرتبطة بوحدات الأصل (join مفهرس عبر جدول الربط)
+                    asset_contract_ids = select(contract_units.c.contract_id)\
+                        .join(Unit, Unit.id == contract_units.c.unit_id)\
+                        .where(Unit.asset_id == selected_asset.id)
+                    contracts_linked = session.query(Contract)\
+                        .options(joinedload(Contract.tenant))\
+                        .filter(Contract.status == "نشط", Contract.id.in_(asset_contract_ids))\
+                        .all()
                     
                     col_stat1, col_stat2, col_stat3 = st.columns(3)
                     with col_stat1:
@@ -2748,16 +5262,13 @@ def manage_assets_only():
             if all_assets:
                 assets_display = []
                 for asset in all_assets:
-                    units_count = session.query(Unit).filter_by(asset_id=asset.id).count()
-                    rented_count = session.query(Unit).filter_by(asset_id=asset.id, status="مؤجر").count()
-                    
                     assets_display.append({
                         'ID': asset.id,
                         'اسم الأصل': asset.name,
                         'النوع': asset.type,
                         'الموقع': asset.location or '-',
-                        'عدد الوحدات': units_count,
-                        'الوحدات المؤجرة': rented_count
+                        'عدد الوحدات': asset.units_count,
+                        'الوحدات المؤجرة': asset.rented_count
                     })
                 
                 assets_df = pd.DataFrame(assets_display)
@@ -2869,6 +5380,9 @@ def create_backup():
         backup_filename = f"نسخة_احتياطية_{timestamp}.db"
         backup_path = os.path.join(backup_dir, backup_filename)
         
+        # دمج ملف WAL أولاً حتى تحتوي النسخة على آخر التعديلات
+        checkpoint_sqlite_wal(engine)
+        
         # نسخ الملف
         shutil.copy2(source_db, backup_path)
         
@@ -2900,14 +5414,35 @@ def restore_backup(uploaded_file):
         # اسم قاعدة البيانات الحالية
         db_file = "real_estate_v2.db"
         
+        # دمج WAL وإغلاق اتصالات المجمّع قبل استبدال الملف
+        checkpoint_sqlite_wal(engine)
+        engine.dispose()
+        
         # حفظ نسخة احتياطية من القاعدة الحالية قبل الاستبدال
         if os.path.exists(db_file):
             backup_current = f"{db_file}.backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
             shutil.copy2(db_file, backup_current)
         
-        # كتابة الملف الجديد
+        # كتابة الملف الجديد وحذف ملفات WAL القديمة حتى لا تُطبَّق عليه
         with open(db_file, "wb") as f:
             f.write(uploaded_file.getbuffer())
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(db_file + suffix):
+                os.remove(db_file + suffix)
+        
+        # النسخة قد تسبق هجرات هذا الإصدار: إعادة مرحلة البدء تطبّقها قبل أي استعلام للصفحات
+        run_startup.clear()
+        migrations = run_startup()["migrations"]
+        if migrations["pending"]:
+            return False, f"❌ تم الاسترجاع لكن فشل تحديث المخطط: {migrations['status']}"
+        
+        # إصدارات النسخة أقل من الحالية: بصمة جديدة للقاعدة حتى لا يُطابق أي مفتاح مخزّن من قبل،
+        # ثم إعادة ضبط الإصدارات المحلية وتفريغ الذاكرة المحلية
+        with engine.begin() as conn:
+            rotate_cache_epoch(conn)
+        with engine.connect() as conn:
+            table_versions.sync(conn)
+        shared_cache.clear_memory()
         
         return True, "✅ تم استرجاع النسخة الاحتياطية بنجاح!"
         
@@ -2919,7 +5454,7 @@ def restore_backup(uploaded_file):
 # 3️⃣ دالة الحصول على معلومات قاعدة البيانات
 # ============================================================
 
-def get_database_info():
+def get_database_info(session):
     """
     الحصول على معلومات وإحصائيات قاعدة البيانات
     
@@ -2972,7 +5507,7 @@ def get_database_info():
 # 4️⃣ دالة تصدير البيانات إلى Excel (نسخة احتياطية إضافية)
 # ============================================================
 
-def export_to_excel():
+def export_to_excel(session):
     """
     تصدير جميع البيانات إلى ملف Excel (نسخة احتياطية قابلة للقراءة)
     
@@ -3014,7 +5549,7 @@ def export_to_excel():
 # 5️⃣ صفحة إدارة النسخ الاحتياطية (الواجهة الكاملة)
 # ============================================================
 
-def backup_page():
+def backup_page(session):
     """صفحة إدارة النسخ الاحتياطية - الواجهة الرئيسية"""
     
     st.header("💾 إدارة النسخ الاحتياطية")
@@ -3033,7 +5568,7 @@ def backup_page():
     """, unsafe_allow_html=True)
     
     # الحصول على معلومات قاعدة البيانات
-    db_info = get_database_info()
+    db_info = get_database_info(session)
     
     # عرض إحصائيات قاعدة البيانات
     st.markdown("---")
@@ -3140,7 +5675,8 @@ def backup_page():
             help="تصدير البيانات في ملف Excel قابل للقراءة"
         ):
             with st.spinner("جاري تصدير البيانات..."):
-                success, excel_path, message = export_to_excel()
+                with read_session() as read_db:
+                    success, excel_path, message = export_to_excel(read_db)
                 
                 if success:
                     with open(excel_path, "rb") as f:
@@ -3323,10 +5859,604 @@ def backup_page():
         """)
 
 
+# ==========================================
+# 12. الأداء والتشخيص (للمدير)
+# ==========================================
+
+ADVISOR_LARGE_TABLE_ROWS = 1000  # الجداول الأكبر من هذا الحد يُعتبر المسح الكامل عليها مشكلة
+
+# سجل الاستعلامات الساخنة: اسم → دالة تبني الاستعلام بقيم تمثيلية
+HOT_QUERIES = {}
+
+def hot_query(name):
+    """تسجيل استعلام ساخن ليحلله مستشار الفهارس"""
+    def register(builder):
+        HOT_QUERIES[name] = builder
+        return builder
+    return register
+
+@hot_query("دفعات العقد (إدارة الدفعات)")
+def _hq_payments_by_contract():
+    return select(Payment).where(Payment.contract_id == 1).order_by(Payment.due_date)
+
+@hot_query("ملخص المؤشرات (لوحة المؤشرات)")
+def _hq_kpi_summary():
+    return select(kpi_summary).where(kpi_summary.c.id == 1)
+
+@hot_query("المتأخرات منذ آخر ترحيل (لوحة المؤشرات / المطابقة الليلية)")
+def _hq_kpi_roll_forward():
+    return select(func.count(Payment.id), func.sum(Payment.total))\
+        .join(Contract, Payment.contract_id == Contract.id)\
+        .where(Payment.status != 'مدفوع', Contract.status == "نشط",
+               Payment.due_date >= date.today() - timedelta(days=1), Payment.due_date < date.today())
+
+@hot_query("إجمالي التحصيل (المطابقة الليلية)")
+def _hq_paid_income():
+    return select(func.sum(Payment.total))\
+        .join(Contract, Payment.contract_id == Contract.id)\
+        .where(Payment.status == 'مدفوع', Contract.status == "نشط")
+
+@hot_query("المتأخرات (التقارير / المطابقة الليلية)")
+def _hq_overdue():
+    return select(func.count(Payment.id), func.sum(Payment.total))\
+        .join(Contract, Payment.contract_id == Contract.id)\
+        .where(Payment.status != 'مدفوع', Payment.due_date < date.today(), Contract.status == "نشط")
+
+@hot_query("ملخص تنبيهات التحصيل لكل يوم خلال 30 يوم")
+def _hq_payment_alert_days():
+    return select(Payment.due_date, func.count(Payment.id), func.sum(Payment.total))\
+        .join(Contract, Payment.contract_id == Contract.id)\
+        .join(Tenant, Contract.tenant_id == Tenant.id)\
+        .where(
+            Payment.status != "مدفوع",
+            Payment.due_date >= date.today(),
+            Payment.due_date <= date.today() + timedelta(days=30)
+        ).group_by(Payment.due_date).order_by(Payment.due_date)
+
+@hot_query("أقرب الدفعات المستحقة (تفاصيل التنبيهات)")
+def _hq_upcoming_payments():
+    return select(Payment.id, Tenant.name)\
+        .join(Contract, Payment.contract_id == Contract.id)\
+        .join(Tenant, Contract.tenant_id == Tenant.id)\
+        .where(
+            Payment.status != "مدفوع",
+            Payment.due_date >= date.today(),
+            Payment.due_date <= date.today() + timedelta(days=30)
+        ).order_by(Payment.due_date, Payment.id).limit(ALERT_ROWS_LIMIT)
+
+@hot_query("دفعات يوم استحقاق (تفاصيل التنبيهات)")
+def _hq_payments_due_on():
+    return select(Payment.id, Tenant.name)\
+        .join(Contract, Payment.contract_id == Contract.id)\
+        .join(Tenant, Contract.tenant_id == Tenant.id)\
+        .where(Payment.status != "مدفوع", Payment.due_date == date.today())\
+        .order_by(Tenant.name, Payment.id).limit(ALERT_ROWS_LIMIT)
+
+@hot_query("أعمار الذمم (التقارير)")
+def _hq_aging_matrix():
+    return aging_matrix_statement().params(**aging_boundaries(date.today()))
+
+@hot_query("عقود تقترب من الانتهاء")
+def _hq_expiring_contracts():
+    return select(Contract.id, Tenant.name, func.count().over())\
+        .join(Tenant, Contract.tenant_id == Tenant.id)\
+        .where(
+            Contract.status == "نشط",
+            Contract.end_date >= date.today(),
+            Contract.end_date <= date.today() + timedelta(days=EXPIRING_CONTRACT_DAYS)
+        ).order_by(Contract.end_date).limit(ALERT_ROWS_LIMIT)
+
+@hot_query("عقود المستأجر")
+def _hq_contracts_by_tenant():
+    return select(Contract).where(Contract.tenant_id == 1)
+
+@hot_query("وحدات الأصل حسب الحالة")
+def _hq_units_by_asset():
+    return select(func.count(Unit.id)).where(Unit.asset_id == 1, Unit.status == "مؤجر")
+
+@hot_query("البحث عن مستأجر بالاسم")
+def _hq_tenant_by_name():
+    return select(Tenant).where(Tenant.name == "-")
+
+@hot_query("العقود المرتبطة بوحدة")
+def _hq_contracts_by_unit():
+    return select(contract_units.c.contract_id)\
+        .join(Contract, Contract.id == contract_units.c.contract_id)\
+        .where(contract_units.c.unit_id == 1, Contract.status == "نشط")
+
+
+def _table_row_counts(conn):
+    """عدد الصفوف لكل جدول (تقديري من الإحصائيات على PostgreSQL)"""
+    if conn.dialect.name == "postgresql":
+        rows = conn.execute(text(
+            "SELECT relname, reltuples::bigint FROM pg_class "
+            "WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace"
+        ))
+        return {name: max(0, int(count)) for name, count in rows}
+    return {
+        table.name: conn.execute(select(func.count()).select_from(table)).scalar()
+        for table in Base.metadata.sorted_tables
+    }
+
+
+def explain_hot_queries(large_table_rows=ADVISOR_LARGE_TABLE_ROWS):
+    """
+    تشغيل EXPLAIN على الاستعلامات الساخنة واكتشاف المسح الكامل للجداول الكبيرة
+
+    Returns:
+        list[dict]: لكل استعلام: الاسم، الجداول الممسوحة بالكامل، التحذير، وخطة التنفيذ
+    """
+    results = []
+    with engine.connect() as conn:
+        row_counts = _table_row_counts(conn)
+        for name, builder in HOT_QUERIES.items():
+            sql = str(builder().compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+            if conn.dialect.name == "postgresql":
+                plan = [row[0] for row in conn.exec_driver_sql("EXPLAIN " + sql)]
+                scanned = re.findall(r"Seq Scan on (\w+)", "\n".join(plan))
+            else:
+                plan = [row[3] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql)]
+                scanned = [m.group(1) for line in plan if (m := re.match(r"SCAN (?:TABLE )?(\w+)$", line))]
+
+            flagged = sorted({t for t in scanned if row_counts.get(t, 0) >= large_table_rows})
+            results.append({
+                "query": name,
+                "seq_scans": sorted(set(scanned)),
+                "flagged": flagged,
+                "plan": "\n".join(plan),
+            })
+    return results
+
+
+def index_advisor_panel():
+    """لوحة مستشار الفهارس"""
+    st.caption(
+        f"يشغّل EXPLAIN على الاستعلامات الساخنة المسجلة ويحذّر من أي مسح كامل "
+        f"لجدول يزيد عن {ADVISOR_LARGE_TABLE_ROWS:,} صف."
+    )
+    if st.button("🔍 تحليل الاستعلامات", key='run_index_advisor'):
+        with st.spinner("جاري تحليل خطط التنفيذ..."):
+            results = explain_hot_queries()
+
+        flagged_count = sum(1 for r in results if r["flagged"])
+        if flagged_count:
+            st.warning(f"⚠️ {flagged_count} استعلام يمسح جداول كبيرة بالكامل")
+        else:
+            st.success("✅ كل الاستعلامات الساخنة تستخدم الفهارس على الجداول الكبيرة")
+
+        st.dataframe(pd.DataFrame([{
+            "الاستعلام": r["query"],
+            "مسح كامل": ", ".join(r["seq_scans"]) or "-",
+            "الحالة": f"⚠️ {', '.join(r['flagged'])}" if r["flagged"] else "✅",
+        } for r in results]), use_container_width=True, hide_index=True)
+
+        for r in results:
+            with st.expander(f"📋 خطة التنفيذ: {r['query']}"):
+                st.code(r["plan"], language="text")
+
+
+def migrations_panel():
+    """عرض إصدار المخطط والهجرات المعلّقة (تشغيل تجريبي بدون تطبيق)"""
+    report = run_migrations(dry_run=True)
+    col1, col2 = st.columns(2)
+    col1.metric("الإصدار الحالي", report["current"])
+    col2.metric("آخر إصدار", report["latest"])
+
+    if report["pending"]:
+        st.warning(report["status"])
+        st.dataframe(pd.DataFrame(report["pending"], columns=["الإصدار", "الوصف"]),
+                     use_container_width=True, hide_index=True)
+        if st.button("▶️ تطبيق الهجرات الآن", key='apply_migrations_btn'):
+            applied = run_migrations()
+            st.info(applied["status"])
+    else:
+        st.success(report["status"])
+
+    st.caption(f"حالة بدء التشغيل: {migration_status['status']}")
+
+
+# ===== تقرير بدء التشغيل البارد =====
+LAZY_MODULES = ("pandas", "numpy", "openpyxl", "dateutil")
+IMPORT_BENCHMARK_MODULES = ("streamlit", "sqlalchemy.orm", "pandas", "numpy", "openpyxl", "dateutil.relativedelta")
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def mark_first_render(page, started_at):
+    """تسجيل أول عرض لكل صفحة في هذه العملية والمكتبات الثقيلة المحمّلة وقتها"""
+    marks = get_cold_start_marks()
+    if page in marks["first_renders"]:
+        return
+    now = time.perf_counter()
+    marks["first_renders"][page] = {
+        "منذ أول تشغيل (ms)": round((now - marks["first_run_started_at"]) * 1000, 1),
+        "زمن هذا التشغيل (ms)": round((now - started_at) * 1000, 1),
+        "المكتبات الثقيلة المحمّلة": "، ".join(m for m in LAZY_MODULES if m in sys.modules) or "لا شيء",
+    }
+
+
+def measure_import_times(modules=IMPORT_BENCHMARK_MODULES, top=5):
+    """
+    قياس زمن الاستيراد البارد لكل مكتبة في عملية Python جديدة (python -X importtime)
+    يعيد لكل مكتبة الزمن التراكمي وأثقل الوحدات الفرعية
+    """
+    results = []
+    for name in modules:
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {name}"],
+            capture_output=True, text=True, timeout=120,
+        )
+        rows = []
+        for line in proc.stderr.splitlines():
+            match = IMPORTTIME_LINE.match(line)
+            if match:
+                rows.append((int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2, match.group(4)))
+        if proc.returncode != 0 or not rows:
+            results.append({"المكتبة": name, "الزمن (ms)": None, "أثقل الوحدات": "❌ فشل الاستيراد"})
+            continue
+        # السطر الأب يُطبع بعد أبنائه؛ ما قبل أول سطر علوي لحزمتنا يخص بدء المفسّر
+        root = name.split(".")[0]
+        top_level = [i for i, row in enumerate(rows) if row[2] == 0]
+        ours = [i for i in top_level if rows[i][3] == root or rows[i][3].startswith(root + ".")]
+        start = max((i for i in top_level if i < ours[0]), default=-1) + 1
+        total_us = sum(rows[i][1] for i in ours)
+        heaviest = sorted(rows[start:], key=lambda row: row[0], reverse=True)[:top]
+        results.append({
+            "المكتبة": name,
+            "الزمن (ms)": round(total_us / 1000, 1),
+            "أثقل الوحدات": "، ".join(f"{mod} ({self_us / 1000:.0f})" for self_us, _, _, mod in heaviest),
+        })
+    return results
+
+
+def cold_start_panel():
+    """لوحة بدء التشغيل البارد: أول عرض لكل صفحة + زمن تحميل المكتبات الكسولة"""
+    marks = get_cold_start_marks()
+
+    login = marks["first_renders"].get("تسجيل الدخول")
+    if login:
+        st.metric("⏱️ زمن أول عرض لصفحة الدخول", f"{login['منذ أول تشغيل (ms)']} ms")
+
+    if marks["first_renders"]:
+        st.markdown("**أول عرض لكل صفحة في هذه العملية**")
+        st.dataframe(pd.DataFrame([{"الصفحة": page, **info} for page, info in marks["first_renders"].items()]),
+                     use_container_width=True, hide_index=True)
+
+    if marks["modules"]:
+        st.markdown("**تحميل المكتبات الكسولة**")
+        st.dataframe(pd.DataFrame([
+            {"المكتبة": name, "زمن التحميل (ms)": info["load_ms"],
+             "وقت التحميل": info["loaded_at"].strftime('%H:%M:%S')}
+            for name, info in marks["modules"].items()
+        ]), use_container_width=True, hide_index=True)
+
+    st.markdown("**📦 زمن الاستيراد البارد لكل مكتبة**")
+    st.caption("يُشغَّل كل استيراد في عملية جديدة؛ الأرقام بين القوسين زمن الوحدة الذاتي بالميلي ثانية")
+    if st.button("▶️ تشغيل قياس الاستيراد", key='run_import_benchmark'):
+        with st.spinner("جاري القياس..."):
+            st.dataframe(pd.DataFrame(measure_import_times()), use_container_width=True, hide_index=True)
+
+
+# ===== ملف SQLite: الإعدادات والصيانة =====
+def sqlite_profile_panel():
+    """لوحة إعدادات SQLite ومهام الصيانة"""
+    if db_type == "sqlite":
+        with engine.connect() as conn:
+            current = {name: conn.exec_driver_sql(f"PRAGMA {name}").scalar() for name in SQLITE_PRAGMAS}
+        st.dataframe(pd.DataFrame([
+            {"PRAGMA": name, "المطلوب": str(SQLITE_PRAGMAS[name]), "الحالي": str(value)}
+            for name, value in current.items()
+        ]), use_container_width=True, hide_index=True)
+        if current.get("auto_vacuum") != 2:
+            st.warning("⚠️ القاعدة أُنشئت قبل ملف الإعدادات: incremental_vacuum لا يعمل حتى التحويل. "
+                       "التحويل VACUUM كامل يمنع كل الكتابات حتى ينتهي، فشغّله في وقت بلا مستخدمين")
+            if st.button("🗜️ تحويل إلى auto_vacuum=INCREMENTAL", key='enable_incremental_vacuum'):
+                with st.spinner("جاري VACUUM..."):
+                    st.info(sqlite_enable_incremental_vacuum(engine))
+    else:
+        st.info("ℹ️ القاعدة الحالية PostgreSQL؛ ملف الإعدادات يُطبَّق على نمط SQLite الاحتياطي فقط")
+
+    st.markdown("**🛠️ مهام الصيانة الدورية**")
+    tasks = maintenance.status()
+    if tasks:
+        st.dataframe(pd.DataFrame(tasks), use_container_width=True, hide_index=True)
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            task_name = st.selectbox("المهمة", [t["المهمة"] for t in tasks], key='maintenance_task')
+        with col2:
+            st.write("")
+            if st.button("▶️ تشغيل الآن", key='run_maintenance_task'):
+                st.info(maintenance.run_task(task_name))
+    else:
+        st.caption("لا توجد مهام مسجلة لهذه القاعدة")
+
+    st.markdown("**⚖️ قياس التزامن (قراءة/كتابة متزامنة على قاعدة مؤقتة)**")
+    st.code("python -m benchmarks.sqlite_concurrency --seconds 3 --readers 4 --writers 2", language="bash")
+
+
+def aging_panel():
+    """لوحة تقرير أعمار الذمم: كيف يُحسب التقرير وأين يُقاس"""
+    st.caption("تقرير أعمار الذمم (التقارير ← أعمار الذمم) استعلام تجميع واحد بفئات CASE على due_date "
+               "بحدود محسوبة مسبقاً؛ الفهرس الجزئي ix_payments_aging يغطيه (المبالغ المتبقية فقط، مرتبة حسب العقد)")
+    st.code("python -m benchmarks.aging --rows 1000000", language="bash")
+
+
+def kpi_panel():
+    """لوحة ملخص المؤشرات: الصف الحالي وآخر مطابقة وانحرافها"""
+    with engine.connect() as conn:
+        row = conn.execute(select(kpi_summary).where(kpi_summary.c.id == 1)).first()
+    if row is None:
+        st.warning("⚠️ صف kpi_summary غير موجود (تُعيد بناءه المطابقة؛ اللوحة تحسب المؤشرات كاملة حتى ذلك)")
+    else:
+        st.dataframe(pd.DataFrame([dict(row._mapping)]), use_container_width=True, hide_index=True)
+        if row.reconciled_at is None:
+            st.caption("لم تُجرَ مطابقة بعد")
+        elif row.last_drift:
+            st.warning(f"⚠️ آخر مطابقة ({row.reconciled_at:%Y-%m-%d %H:%M}) وجدت انحرافاً وصحّحته: {row.last_drift}")
+        else:
+            st.success(f"✅ آخر مطابقة ({row.reconciled_at:%Y-%m-%d %H:%M}) بلا انحراف")
+    st.caption(f"المطابقة الكاملة تعمل يومياً الساعة {KPI_RECONCILE_HOUR}:00 ضمن مهام الصيانة")
+    if st.button("🔍 مطابقة الآن", key='run_kpi_reconcile'):
+        st.info(maintenance.run_task(KPI_RECONCILE_TASK))
+
+
+def rollup_panel():
+    """لوحة التجميع اليومي: الحجم مقابل جدول الدفعات، المطابقة مع التجميع الكامل وإعادة البناء"""
+    with engine.connect() as conn:
+        rollup_rows = conn.execute(select(func.count()).select_from(collections_daily)).scalar()
+        payment_rows = conn.execute(select(func.count(Payment.id))).scalar()
+    col1, col2 = st.columns(2)
+    col1.metric("صفوف collections_daily", f"{rollup_rows:,}")
+    col2.metric("صفوف payments", f"{payment_rows:,}")
+    st.caption(f"تُحدَّث بالمشغّلات مع كل دفعة، وتُطابق يومياً الساعة {KPI_RECONCILE_HOUR}:10 ضمن مهام الصيانة")
+
+    col1, col2 = st.columns(2)
+    if col1.button("🔍 مطابقة مع التجميع الكامل", key='check_rollup'):
+        with engine.connect() as conn:
+            drift = rollup_drift(conn)
+        if drift:
+            st.error(f"❌ {len(drift)} صف مختلف")
+            st.dataframe(pd.DataFrame(drift).astype(str), use_container_width=True, hide_index=True)
+        else:
+            st.success("✅ التجميع مطابق لجدول الدفعات")
+    if col2.button("🔁 إعادة بناء كاملة", key='rebuild_rollup'):
+        with st.spinner("جاري إعادة البناء..."):
+            with engine.begin() as conn:
+                rebuilt = rebuild_collections_rollup(conn)
+        get_collection_rollup.clear()
+        st.success(f"✅ أُعيد بناء {rebuilt} صف")
+
+
+def read_model_panel():
+    """لوحة نموذج القراءة: الصفحات المستفيدة وأين يُقاس التحميل مقابل ORM"""
+    st.caption("قوائم العقود والمستأجرين والأصول وتقارير المستأجر تُقرأ عبر select بأعمدة محددة "
+               "إلى صفوف __slots__ أو DataFrame مباشرة، بلا كائنات ORM ولا identity map")
+    st.code("python -m benchmarks.hydration --rows 50000", language="bash")
+
+
+def compile_cache_panel():
+    """لوحة compiled cache: نسبة الإصابة لكل محرك وللعبارات الساخنة، وأكثر النصوص إعادة ترجمة"""
+    rows = []
+    for label, counts in compile_cache.totals.items():
+        compiled = counts["hit"] + counts["miss"]
+        size, capacity = compile_cache.cache_size(label)
+        rows.append({
+            "المحرك": label, "إصابة": counts["hit"], "ترجمة جديدة": counts["miss"], "SQL نصي": counts["raw"],
+            "نسبة الإصابة": f"{counts['hit'] / compiled:.0%}" if compiled else "-",
+            "حجم الذاكرة": f"{size} / {capacity}",
+        })
+    if rows:
+        st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+
+    st.markdown("**🔥 العبارات المبنية مسبقاً**")
+    with compile_cache.lock:
+        by_sql = {sql: dict(counts) for sql, counts in compile_cache.by_sql.items()}
+    hot_rows = []
+    for name, stmt in hot_statements.named().items():
+        counts = by_sql.get(str(stmt.compile(dialect=engine.dialect)), {"hit": 0, "miss": 0})
+        hot_rows.append({"العبارة": name, "إصابة": counts["hit"], "ترجمة جديدة": counts["miss"]})
+    st.dataframe(pd.DataFrame(hot_rows), use_container_width=True, hide_index=True)
+
+    st.markdown("**🔁 أكثر النصوص ترجمةً من جديد**")
+    misses = sorted(((c["miss"], c["hit"], sql) for sql, c in by_sql.items() if c["miss"] > 1), reverse=True)[:10]
+    if misses:
+        st.dataframe(pd.DataFrame([
+            {"ترجمة جديدة": miss, "إصابة": hit, "SQL": " ".join(sql.split())[:160]} for miss, hit, sql in misses
+        ]), use_container_width=True, hide_index=True)
+    else:
+        st.caption("لا توجد نصوص تُترجم أكثر من مرة")
+    st.caption("الاستعلامات المبنية داخل الصفحات تُترجم من جديد في كل إعادة تشغيل لأن النماذج يُعاد تعريفها؛ "
+               "المسارات الساخنة تستخدم عبارات مبنية مرة واحدة لكل عملية")
+
+
+def pool_panel():
+    """لوحة تجميع الاتصالات: النمط والتزامن المقاس وتوصية الحجم"""
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("نمط التجميع", pool_mode)
+    col2.metric("المستخدمة الآن / الذروة", f"{pool_monitor.checked_out} / {pool_monitor.peak}")
+    col3.metric("عمليات checkout", pool_monitor.checkouts)
+    col4.metric("فحوص الحيوية (فشل)", f"{pool_monitor.pings} ({pool_monitor.ping_failures})")
+
+    st.caption(f"{type(engine.pool).__name__}: {engine.pool.status()}"
+               + (f" — فحص الحيوية بعد {pool_monitor.idle_seconds} ثانية خمول" if pool_monitor.liveness else ""))
+
+    if pool_monitor.concurrency:
+        st.markdown("**توزيع التزامن لحظة كل checkout**")
+        st.bar_chart(pd.DataFrame(
+            {"عدد المرات": list(pool_monitor.concurrency.values())},
+            index=pd.Index(list(pool_monitor.concurrency.keys()), name="اتصالات مستخدمة"),
+        ).sort_index())
+
+    st.info(f"💡 {pool_monitor.sizing_guidance(engine.pool)['text']}")
+
+    st.markdown("**📖 توجيه القراءة**")
+    replica, replica_monitor = get_replica_engine()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("قراءات من النسخة المتماثلة", read_router.routed["replica"])
+    col2.metric("قراءات من الأساسية", read_router.routed["primary"])
+    col3.metric("read-your-own-writes", read_router.routed["pinned"])
+    if replica is None:
+        st.caption("لا توجد نسخة متماثلة ([connections.postgresql_replica] غير معرّف) — كل القراءات من الأساسية")
+    else:
+        st.caption(f"النسخة المتماثلة ({replica.dialect.name}): {replica.pool.status()} — "
+                   f"الذروة {replica_monitor.peak} — مستخدمون محميون الآن: {len(read_router.pins)}")
+
+
+def concurrency_panel():
+    """لوحة الاستعلامات المتوازية: أين تُستخدم وأين تُقاس"""
+    st.caption(f"لوحة المؤشرات تنفّذ المؤشرات والعقود المنتهية والتنبيهات والاتجاه واللقطة المرجعية "
+               f"معاً عبر run_concurrently (حتى {QUERY_CONCURRENCY} خيوط فوق نفس الـ pool)، "
+               f"فزمن اللوحة الباردة ≈ أبطأ استعلام بدلاً من مجموع الرحلات")
+    st.code("python -m benchmarks.concurrent_queries --delay-ms 50", language="bash")
+
+
+def cache_panel():
+    """لوحة الذاكرة المؤقتة: الجداول والإصدارات ونسب الإصابة لكل دالة"""
+    rows = []
+    for name, loader in CACHED_LOADERS.items():
+        stats = shared_cache.stats.get(loader.loader, {"memory": 0, "disk": 0, "miss": 0, "coalesced": 0, "stale": 0})
+        total = stats["memory"] + stats["disk"] + stats["miss"] + stats["coalesced"]
+        rows.append({
+            "الدالة": name, "الجداول": "، ".join(loader.tables),
+            "الإصدارات": str(table_versions.key(loader.tables)),
+            "إصابة (ذاكرة)": stats["memory"], "إصابة (ملف مشترك)": stats["disk"],
+            "إخفاق (حساب)": stats["miss"], "انتظر حساباً جارياً": stats["coalesced"], "قيمة قديمة": stats["stale"],
+            "نسبة الإصابة": f"{(stats['memory'] + stats['disk']) / total:.0%}" if total else "-",
+        })
+    st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+
+    disk_entries, disk_bytes = shared_cache.disk_usage()
+    col1, col2 = st.columns(2)
+    col1.metric("الذاكرة المحلية", f"{shared_cache.memory_used / 1024 / 1024:.1f} / "
+                                   f"{shared_cache.memory_bytes / 1024 / 1024:.0f} MB ({len(shared_cache.memory)} مدخل)")
+    col2.metric("الملف المشترك", f"{disk_bytes / 1024 / 1024:.1f} / "
+                                 f"{shared_cache.disk_bytes / 1024 / 1024:.0f} MB ({disk_entries} مدخل)")
+    st.caption(f"📁 {shared_cache.path}")
+    st.caption("أي commit يكتب على أحد هذه الجداول يرفع إصداره فتُعاد قراءة الدوال المعتمدة عليه فقط")
+
+    snapshot = reference_snapshot()
+    st.markdown(f"**📇 اللقطة المرجعية (مشتركة بلا نسخ):** {len(snapshot.assets)} أصل، {len(snapshot.units)} وحدة، "
+                f"{len(snapshot.tenants)} مستأجر، {len(snapshot.contracts)} عقد نشط — "
+                f"الإصدارات {snapshot.versions} — زمن البناء {snapshot.built_ms:.0f} ms")
+
+    sync_mode = "LISTEN/NOTIFY" if table_versions.mode == "listen" else f"قراءة دورية كل {CACHE_POLL_SECONDS} ثانية"
+    last_sync = table_versions.last_sync.strftime('%H:%M:%S') if table_versions.last_sync else "-"
+    st.markdown(f"**🔄 المزامنة بين العمليات:** {sync_mode} — آخر مزامنة: {last_sync}"
+                f" — إشعارات مستلمة: {table_versions.notifications}")
+    if table_versions.error:
+        st.warning(f"⚠️ خطأ المزامنة: {table_versions.error}")
+
+    if st.button("🧹 مسح الذاكرة المؤقتة", key='clear_cached_loaders'):
+        for loader in CACHED_LOADERS.values():
+            loader.clear()
+        _build_reference_snapshot.clear()
+        st.success("✅ تم المسح")
+
+
+def health_panel():
+    """لوحة صحة النظام: تقرير بدء التشغيل + كلفة إعادة التشغيل قبل عرض الصفحة + كلفة كل تفاعل"""
+    st.markdown(f"**بدء التشغيل:** {startup_report['started_at'].strftime('%Y-%m-%d %H:%M:%S')}"
+                f" — **قاعدة البيانات:** {startup_report['db_type']}"
+                f" — **إصدار المخطط:** {migration_status['current']}")
+    st.dataframe(pd.DataFrame(startup_report["steps"]), use_container_width=True, hide_index=True)
+    st.caption(f"إجمالي مرحلة البدء: {startup_report['total_ms']} ms (تُنفَّذ مرة واحدة لكل عملية)")
+
+    st.markdown("**🔁 كلفة إعادة التشغيل (قبل تشغيل دالة الصفحة)**")
+    samples = list(rerun_metrics.samples)
+    if not samples:
+        st.info("لا توجد عينات بعد")
+        return
+
+    df = pd.DataFrame(samples)
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("عدد العينات", len(df))
+    col2.metric("متوسط الزمن", f"{df['الزمن (ms)'].mean():.1f} ms")
+    col3.metric("P95", f"{df['الزمن (ms)'].quantile(0.95):.1f} ms")
+    col4.metric("متوسط الاستعلامات", f"{df['الاستعلامات'].mean():.2f}")
+
+    if (df["الاستعلامات"] > 0).any():
+        st.warning("⚠️ بعض عمليات إعادة التشغيل نفذت استعلامات قبل عرض الصفحة")
+    else:
+        st.success("✅ لا توجد استعلامات قبل عرض الصفحة")
+
+    st.dataframe(df.iloc[::-1].head(20), use_container_width=True, hide_index=True)
+    st.caption(f"حالة مجمّع الاتصالات: {engine.pool.status()}")
+
+    st.markdown("**⚡ كلفة التفاعل: تشغيل الصفحة كاملة مقابل إعادة التشغيل الجزئية (fragment)**")
+    interactions = list(rerun_metrics.interactions)
+    if interactions:
+        costs = pd.DataFrame(interactions).groupby(["القسم", "النوع"]).agg(
+            **{
+                "العدد": ("الزمن (ms)", "size"),
+                "متوسط الزمن (ms)": ("الزمن (ms)", "mean"),
+                "متوسط الاستعلامات": ("الاستعلامات", "mean"),
+            }
+        ).round(2).reset_index()
+        st.dataframe(costs, use_container_width=True, hide_index=True)
+        st.caption("الكامل: من بداية السكربت حتى نهاية دالة الصفحة؛ الجزئي: القسم وحده عند التفاعل معه")
+    else:
+        st.info("لا توجد تفاعلات مسجلة بعد")
+
+    if st.button("🧹 مسح العينات", key='clear_rerun_samples'):
+        rerun_metrics.samples.clear()
+        rerun_metrics.interactions.clear()
+        st.rerun()
+
+
+def performance_page(session):
+    """صفحة الأداء والتشخيص (للمدير فقط)"""
+    st.header("⚡ الأداء والتشخيص")
+
+    if st.session_state.get('user_role') != 'Admin':
+        st.error("⚠️ هذه الصفحة متاحة للمدير فقط")
+        return
+
+    with st.expander("🩺 صحة النظام", expanded=True):
+        health_panel()
+
+    with st.expander("🧊 بدء التشغيل البارد"):
+        cold_start_panel()
+
+    with st.expander("🧩 الذاكرة المؤقتة"):
+        cache_panel()
+
+    with st.expander("📊 ملخص المؤشرات (kpi_summary)"):
+        kpi_panel()
+
+    with st.expander("📈 التجميع اليومي للتحصيل (collections_daily)"):
+        rollup_panel()
+
+    with st.expander("📅 أعمار الذمم"):
+        aging_panel()
+
+    with st.expander("📐 نموذج القراءة مقابل ORM"):
+        read_model_panel()
+
+    with st.expander("🧾 ذاكرة ترجمة SQL"):
+        compile_cache_panel()
+
+    with st.expander("🔌 تجميع الاتصالات"):
+        pool_panel()
+
+    with st.expander("⚡ الاستعلامات المتوازية"):
+        concurrency_panel()
+
+    with st.expander("🗄️ إعدادات SQLite والصيانة"):
+        sqlite_profile_panel()
+
+    with st.expander("🧭 مستشار الفهارس"):
+        index_advisor_panel()
+
+    with st.expander("🗂️ هجرات قاعدة البيانات"):
+        migrations_panel()
+
+
 # ============================================================
 # 6️⃣ إضافة الصفحة للقائمة الرئيسية
 # ============================================================
 
+# صفحات لا تكتب في قاعدة البيانات
+READ_ONLY_PAGES = (dashboard, reports_page)
+
 def main():
     if 'logged_in' not in st.session_state:
         st.session_state['logged_in'] = False
@@ -3351,6 +6481,7 @@ def main():
                     "إدارة الدفعات": manage_payments,
                     "التقارير": reports_page,
                     "💾 النسخ الاحتياطي": backup_page,
+                    "⚡ الأداء والتشخيص": performance_page,
                     "الإعدادات": settings_page
                 }
             else: # Employee role
@@ -3371,11 +6502,19 @@ def main():
                 st.session_state['username'] = None
                 st.rerun()
 
-        # عرض الصفحة المختارة
-        pages[selection]()
+        # عرض الصفحة المختارة بجلسة خاصة بهذا التشغيل تُغلق في نهايته
+        # (صفحات القراءة فقط تُوجَّه إلى النسخة المتماثلة إن وُجدت)
+        rerun_metrics.record(selection, _RERUN_STARTED_AT)
+        page = pages[selection]
+        with (read_session() if page in READ_ONLY_PAGES else unit_of_work()) as session:
+            page(session)
+        rerun_metrics.record_interaction(selection, "كامل", _RERUN_STARTED_AT)
+        mark_first_render(selection, _RERUN_STARTED_AT)
         
     else:
+        rerun_metrics.record("تسجيل الدخول", _RERUN_STARTED_AT)
         login_page()
+        mark_first_render("تسجيل الدخول", _RERUN_STARTED_AT)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,60 @@
+"""
+قياسات الأداء خارج التطبيق (لا تُشغَّل من صفحة الأداء)
+
+كل وحدة قابلة للتشغيل من جذر المستودع:
+    python -m benchmarks.sqlite_concurrency
+    python -m benchmarks.hydration --rows 50000
+    python -m benchmarks.concurrent_queries --delay-ms 50
+    python -m benchmarks.aging --rows 1000000
+"""
+import atexit
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@contextmanager
+def temp_sqlite_engine(name="bench", **engine_kwargs):
+    """محرك SQLite على ملف في مجلد مؤقت يُحذف مع المحرك عند الخروج"""
+    tmp_dir = tempfile.mkdtemp(prefix=f"{name}_")
+    engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, name + '.db')}", **engine_kwargs)
+    try:
+        yield engine
+    finally:
+        engine.dispose()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def load_app(directory=None):
+    """
+    استيراد A.py كوحدة (Streamlit في الوضع المجرد) من نسخة في directory:
+    قاعدة SQLite الاحتياطية وذاكرتها المشتركة تُنشآن بجوار النسخة، فلا يُلمس المستودع.
+    بدون directory: مجلد مؤقت يُحذف عند خروج العملية
+    """
+    if "A" in sys.modules:
+        return sys.modules["A"]
+    if directory is None:
+        app_dir = tempfile.TemporaryDirectory(prefix="app_")
+        atexit.register(app_dir.cleanup)
+        directory = app_dir.name
+    path = shutil.copy(os.path.join(ROOT, "A.py"), directory)
+    spec = importlib.util.spec_from_file_location("A", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["A"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def print_rows(rows):
+    """طباعة نتائج القياس (قائمة قواميس) كجدول"""
+    import pandas as pd
+
+    with pd.option_context("display.max_colwidth", 200, "display.width", 200):
+        print(pd.DataFrame(rows).to_string(index=False))
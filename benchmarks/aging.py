@@ -0,0 +1,89 @@
+"""
+مصفوفة أعمار الذمم على عدد كبير من الدفعات: بدون الفهرس الجزئي ix_payments_aging ثم معه
+
+    python -m benchmarks.aging --rows 1000000
+"""
+import argparse
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import insert
+
+from benchmarks import load_app, print_rows, temp_sqlite_engine
+
+AGING_BENCH_PAYMENTS = 1_000_000
+
+
+def benchmark_aging(rows=AGING_BENCH_PAYMENTS, repeat=2):
+    """
+    قاعدة SQLite مؤقتة بـ rows دفعة (ربعها متأخر غير مسدد، والمستقبلية كلها متبقية):
+    زمن مصفوفة الأعمار بدون الفهرس الجزئي ix_payments_aging ثم معه، والتحقق من تطابق النتيجتين
+    """
+    app = load_app()
+    payments = app.Payment.__table__
+    aging_index = next(index for index in payments.indexes if index.name == "ix_payments_aging")
+    with temp_sqlite_engine("aging_bench") as bench_engine:
+        for table in (app.Tenant.__table__, app.Contract.__table__, app.Unit.__table__, app.contract_units, payments):
+            table.create(bench_engine)
+        today = date.today()
+        n_contracts = max(1, rows // 24)
+        with bench_engine.begin() as conn:
+            conn.execute(insert(app.Tenant.__table__), [{"id": i + 1, "name": f"T-{i + 1}"} for i in range(n_contracts // 2 + 1)])
+            conn.execute(insert(app.Contract.__table__), [
+                {"id": i + 1, "contract_number": f"B-{i + 1}", "tenant_id": i // 2 + 1,
+                 "status": "ملغي" if i % 10 == 0 else "نشط"} for i in range(n_contracts)
+            ])
+            conn.execute(insert(app.Unit.__table__), [
+                {"id": i + 1, "asset_id": i % 20 + 1, "unit_number": str(i)} for i in range(n_contracts)
+            ])
+            conn.execute(insert(app.contract_units), [{"contract_id": i + 1, "unit_id": i + 1} for i in range(n_contracts)])
+            for start in range(0, rows, 100_000):
+                batch = []
+                for i in range(start, min(rows, start + 100_000)):
+                    due = today + timedelta(days=i % 730 - 540)
+                    unpaid = due >= today or i % 4 == 0
+                    batch.append({
+                        "contract_id": i % n_contracts + 1, "payment_number": i // n_contracts + 1, "due_date": due,
+                        "total": 1150.0, "remaining_amount": 1150.0 if unpaid else 0.0,
+                        "status": "مستحق" if unpaid else "مدفوع",
+                    })
+                conn.execute(insert(payments), batch)
+
+        statement = app.aging_matrix_statement()
+        params = app.aging_boundaries(today)
+
+        def measure(conn):
+            timings = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                result = conn.execute(statement, params).all()
+                timings.append(time.perf_counter() - t0)
+            sql = str(statement.params(**params).compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+            plan = " | ".join(row[3] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql))
+            return [tuple(row) for row in result], min(timings) * 1000, plan
+
+        with bench_engine.begin() as conn:
+            aging_index.drop(conn)
+            conn.exec_driver_sql("ANALYZE")
+        with bench_engine.connect() as conn:
+            without_rows, without_ms, without_plan = measure(conn)
+        with bench_engine.begin() as conn:
+            aging_index.create(conn)
+            conn.exec_driver_sql("ANALYZE")
+        with bench_engine.connect() as conn:
+            with_rows, with_ms, with_plan = measure(conn)
+
+        outstanding = sum(row[-1] for row in with_rows)
+        return [
+            {"القياس": "بدون ix_payments_aging", "الزمن (ms)": round(without_ms, 1), "الخطة": without_plan},
+            {"القياس": "مع ix_payments_aging", "الزمن (ms)": round(with_ms, 1), "الخطة": with_plan},
+        ], without_rows == with_rows, f"{rows:,} دفعة → {len(with_rows):,} صف (مستأجر × أصل) من {outstanding:,} دفعة متبقية"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=AGING_BENCH_PAYMENTS)
+    results, same, summary = benchmark_aging(parser.parse_args().rows)
+    print_rows(results)
+    print(summary)
+    print("نفس النتيجة بالفهرس وبدونه ✅" if same else "النتيجة تختلف بين الخطتين ❌")
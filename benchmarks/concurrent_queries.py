@@ -0,0 +1,77 @@
+"""
+استعلامات لوحة باردة بتأخير شبكة مصطنع: التنفيذ المتتالي مقابل run_concurrently
+
+    python -m benchmarks.concurrent_queries --delay-ms 50 --queries 6
+"""
+import argparse
+import time
+from datetime import date
+
+from sqlalchemy import event, func, insert, select
+
+from benchmarks import load_app, print_rows, temp_sqlite_engine
+
+
+def benchmark_concurrent_queries(delay_ms=50, queries=6, repeat=3):
+    """
+    قاعدة SQLite مؤقتة بتأخير شبكة مصطنع (sleep قبل كل استعلام) وبعدد استعلامات لوحة باردة:
+    التنفيذ المتتالي مقابل run_concurrently، مع التحقق من تطابق النتائج
+    """
+    app = load_app()
+    Payment = app.Payment
+    with temp_sqlite_engine("concurrency_bench", connect_args={'check_same_thread': False},
+                            pool_size=queries) as bench_engine:
+        Payment.__table__.create(bench_engine)
+        with bench_engine.begin() as conn:
+            conn.execute(insert(Payment.__table__), [{
+                "contract_id": i // 12 + 1, "payment_number": i % 12 + 1, "due_date": date(2024, i % 12 + 1, 1),
+                "amount": 1000.0, "vat": 150.0, "total": 1150.0, "paid_amount": float(i % 3) * 500,
+                "remaining_amount": 1150.0 - float(i % 3) * 500, "status": "مستحق", "payment_method": "تحويل",
+            } for i in range(1200)])
+        event.listen(bench_engine, "before_cursor_execute", lambda *args: time.sleep(delay_ms / 1000))
+
+        def query(number):
+            # استعلامات مختلفة ومستقلة بحجم استعلامات اللوحة (صف واحد أو بضعة صفوف)
+            def run():
+                with bench_engine.connect() as conn:
+                    return conn.execute(
+                        select(Payment.status, func.count(), func.sum(Payment.remaining_amount))
+                        .where(Payment.payment_number == number).group_by(Payment.status)
+                    ).all()
+            return run
+
+        calls = [query(number) for number in range(1, queries + 1)]
+        serial_expected = [call() for call in calls]
+        app.run_concurrently(*calls)  # فتح اتصالات الـ pool مسبقاً كما في التشغيل الفعلي
+
+        timings = {"متتالي": [], "run_concurrently": []}
+        same = True
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            [call() for call in calls]
+            timings["متتالي"].append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            results = app.run_concurrently(*calls)
+            timings["run_concurrently"].append(time.perf_counter() - t0)
+            same = same and results == serial_expected
+
+        serial_ms = min(timings["متتالي"]) * 1000
+        rows = []
+        for label, values in timings.items():
+            elapsed = min(values) * 1000
+            rows.append({
+                "الطريقة": label, "الاستعلامات": queries, "تأخير الشبكة (ms)": delay_ms,
+                "الزمن (ms)": round(elapsed, 1), "رحلات متتالية فعلية": round(elapsed / delay_ms, 1),
+                "أسرع من المتتالي": f"{serial_ms / elapsed:.1f}x",
+            })
+        return rows, same
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--delay-ms", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=6)
+    args = parser.parse_args()
+    rows, same = benchmark_concurrent_queries(args.delay_ms, args.queries)
+    print_rows(rows)
+    print("النتائج متطابقة ✅" if same else "النتائج غير متطابقة ❌")
@@ -0,0 +1,76 @@
+"""
+تحميل الدفعات: كائنات ORM مقابل صفوف نموذج القراءة (tuples / __slots__ / DataFrame)
+
+    python -m benchmarks.hydration --rows 50000
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from datetime import date
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session as SQLSession
+
+from benchmarks import load_app, print_rows, temp_sqlite_engine
+
+HYDRATION_BENCH_ROWS = 50_000
+
+
+def benchmark_hydration(rows=HYDRATION_BENCH_ROWS, repeat=3):
+    """مقارنة تحميل الدفعات على قاعدة SQLite مؤقتة: كائنات ORM مقابل صفوف نموذج القراءة"""
+    app = load_app()
+    with temp_sqlite_engine("hydration_bench") as bench_engine:
+        app.Payment.__table__.create(bench_engine)
+        with bench_engine.begin() as conn:
+            conn.execute(insert(app.Payment.__table__), [{
+                "contract_id": i // 24 + 1, "payment_number": i % 24 + 1, "due_date": date(2024, i % 12 + 1, 1),
+                "amount": 1000.0, "vat": 150.0, "total": 1150.0, "paid_amount": float(i % 3) * 500,
+                "remaining_amount": 1150.0 - float(i % 3) * 500, "status": "مستحق", "payment_method": "تحويل",
+            } for i in range(rows)])
+
+        def orm():
+            with SQLSession(bench_engine) as session:
+                return session.query(app.Payment).all()
+
+        def tuples():
+            with bench_engine.connect() as conn:
+                return conn.execute(select(*app.PAYMENT_ROW_COLUMNS)).all()
+
+        def slotted():
+            with bench_engine.connect() as conn:
+                return [app.PaymentRow(*row) for row in conn.execute(select(*app.PAYMENT_ROW_COLUMNS))]
+
+        def frame():
+            with SQLSession(bench_engine) as session:
+                return app.read_frame(session, select(*app.PAYMENT_ROW_COLUMNS))
+
+        results = []
+        for label, load in (("كائنات ORM (Payment)", orm), ("صفوف Core (tuples)", tuples),
+                            ("صفوف __slots__", slotted), ("DataFrame مباشرة", frame)):
+            timings = []
+            for _ in range(repeat):
+                gc.collect()
+                t0 = time.perf_counter()
+                load()
+                timings.append(time.perf_counter() - t0)
+            # الذاكرة في تمريرة منفصلة: tracemalloc يبطئ التنفيذ فلا يُخلط بالتوقيت
+            gc.collect()
+            tracemalloc.start()
+            loaded = load()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            del loaded
+            results.append({"الطريقة": label, "الزمن (ms)": round(min(timings) * 1000, 1),
+                            "ذروة الذاكرة (MB)": round(peak / 1024 / 1024, 1)})
+
+        baseline = results[0]["الزمن (ms)"]
+        for row in results:
+            row["أسرع من ORM"] = f"{baseline / row['الزمن (ms)']:.1f}x" if row["الزمن (ms)"] else "-"
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=HYDRATION_BENCH_ROWS)
+    print_rows(benchmark_hydration(parser.parse_args().rows))
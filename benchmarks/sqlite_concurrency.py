@@ -0,0 +1,93 @@
+"""
+تزامن القراءة/الكتابة على SQLite: إعدادات المحرك الافتراضية مقابل SQLITE_PRAGMAS (WAL...)
+
+    python -m benchmarks.sqlite_concurrency --seconds 3 --readers 4 --writers 2
+"""
+import argparse
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from benchmarks import load_app, print_rows, temp_sqlite_engine
+
+SQLITE_BENCH_ROWS = 20000
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000, 2)
+
+
+def benchmark_sqlite_concurrency(tuned, seconds=3.0, readers=4, writers=2):
+    """
+    قياس تزامن القراءة/الكتابة على قاعدة SQLite مؤقتة
+    tuned=False: إعدادات المحرك السابقة كما هي | tuned=True: مع SQLITE_PRAGMAS
+    """
+    app = load_app()
+    with temp_sqlite_engine("sqlite_bench", connect_args={'check_same_thread': False},
+                            pool_pre_ping=True, pool_size=readers + writers) as bench_engine:
+        if tuned:
+            app.apply_sqlite_profile(bench_engine)
+
+        with bench_engine.begin() as conn:
+            conn.exec_driver_sql("CREATE TABLE bench (id INTEGER PRIMARY KEY, asset_id INTEGER, amount REAL, status TEXT)")
+            conn.exec_driver_sql("CREATE INDEX ix_bench_asset_id ON bench (asset_id)")
+            conn.execute(
+                text("INSERT INTO bench (asset_id, amount, status) VALUES (:asset_id, :amount, :status)"),
+                [{"asset_id": i % 50, "amount": float(i % 997), "status": "مستحق"} for i in range(SQLITE_BENCH_ROWS)],
+            )
+
+        stats = {"read": [], "write": [], "locked": 0, "errors": 0}
+        stats_lock = threading.Lock()
+        deadline = time.perf_counter() + seconds
+
+        def run(kind, op):
+            while time.perf_counter() < deadline:
+                t0 = time.perf_counter()
+                try:
+                    op()
+                except OperationalError as e:
+                    with stats_lock:
+                        stats["locked" if "locked" in str(e) else "errors"] += 1
+                    continue
+                with stats_lock:
+                    stats[kind].append(time.perf_counter() - t0)
+
+        def read():
+            with bench_engine.connect() as conn:
+                conn.exec_driver_sql("SELECT asset_id, SUM(amount), COUNT(*) FROM bench GROUP BY asset_id").all()
+
+        def write():
+            with bench_engine.begin() as conn:
+                conn.exec_driver_sql("INSERT INTO bench (asset_id, amount, status) VALUES (1, 100.0, 'مدفوع')")
+                conn.exec_driver_sql("UPDATE bench SET amount = amount + 1 WHERE asset_id = 7")
+
+        threads = [threading.Thread(target=run, args=("read", read)) for _ in range(readers)]
+        threads += [threading.Thread(target=run, args=("write", write)) for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return {
+            "الإعدادات": "محسّنة (WAL)" if tuned else "الافتراضية",
+            "قراءة/ث": round(len(stats["read"]) / seconds, 1),
+            "كتابة/ث": round(len(stats["write"]) / seconds, 1),
+            "P95 قراءة (ms)": _percentile(stats["read"], 0.95),
+            "P95 كتابة (ms)": _percentile(stats["write"], 0.95),
+            "database is locked": stats["locked"],
+            "أخطاء أخرى": stats["errors"],
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=2)
+    args = parser.parse_args()
+    print_rows([benchmark_sqlite_concurrency(tuned, args.seconds, args.readers, args.writers) for tuned in (False, True)])
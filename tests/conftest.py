@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import load_app, temp_sqlite_engine
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    """A.py مستورداً من نسخة في مجلد pytest المؤقت: قاعدته وذاكرته المشتركة هناك لا بجوار المستودع"""
+    return load_app(str(tmp_path_factory.mktemp("app")))
+
+
+@pytest.fixture
+def sqlite_engine():
+    with temp_sqlite_engine("test", connect_args={'check_same_thread': False}, pool_size=32) as engine:
+        yield engine
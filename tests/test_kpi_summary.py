@@ -0,0 +1,82 @@
+"""مشغّلات kpi_summary: الصف المُحدَّث تدريجياً يطابق الحساب الكامل بعد كل نوع من الكتابات"""
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import insert, select
+
+CONTRACTS = 40
+PAYMENTS = 24 * CONTRACTS
+
+
+@pytest.fixture
+def conn(app, sqlite_engine):
+    """قاعدة SQLite صغيرة بالمشغّلات، وصف الملخص يبدأ متأخراً 30 يوماً ليُختبر الترحيل أيضاً"""
+    app.Base.metadata.create_all(sqlite_engine)
+    today = date.today()
+    with sqlite_engine.begin() as conn:
+        app.install_kpi_triggers(conn)
+        app.write_kpi_summary(conn, app.compute_kpis(conn, today - timedelta(days=30)))
+        conn.execute(insert(app.Contract.__table__), [
+            {"id": i + 1, "contract_number": f"T-{i + 1}", "status": "نشط"} for i in range(CONTRACTS)
+        ])
+        conn.execute(insert(app.Unit.__table__), [
+            {"unit_number": str(i), "status": "مؤجر" if i % 3 else "فاضي"} for i in range(CONTRACTS)
+        ])
+        conn.execute(insert(app.Payment.__table__), [{
+            "contract_id": i % CONTRACTS + 1, "payment_number": i // CONTRACTS + 1,
+            "due_date": today + timedelta(days=i % 730 - 365), "total": 1150.0,
+            "status": "مدفوع" if i % 3 == 0 else "مستحق",
+        } for i in range(PAYMENTS)])
+    with sqlite_engine.begin() as conn:
+        yield conn
+
+
+def drift(app, conn, today=None):
+    today = today or date.today()
+    conn.execute(app.kpi_roll_forward_statement(), {"today": today})
+    stored = conn.execute(select(app.kpi_summary).where(app.kpi_summary.c.id == 1)).one()._mapping
+    assert stored["overdue_as_of"] == today
+    return app.kpi_drift(stored, app.compute_kpis(conn, today))
+
+
+def test_inserts_and_roll_forward(app, conn):
+    assert drift(app, conn) == ""
+
+
+def test_updates_deletes_and_cancellations(app, conn):
+    payments, contracts, units = app.Payment.__table__, app.Contract.__table__, app.Unit.__table__
+    conn.execute(payments.update().where(payments.c.id % 7 == 0).values(status="مدفوع"))
+    conn.execute(payments.update().where(payments.c.id % 13 == 0).values(status="مستحق", total=900.0))
+    conn.execute(payments.update().where(payments.c.id % 17 == 0).values(due_date=date.today() - timedelta(days=3)))
+    conn.execute(payments.update().where(payments.c.id % 19 == 0).values(contract_id=1))
+    conn.execute(payments.delete().where(payments.c.id % 11 == 0))
+    conn.execute(contracts.update().where(contracts.c.id % 10 == 0).values(status="ملغي"))
+    conn.execute(contracts.update().where(contracts.c.id == 20).values(status="نشط"))
+    conn.execute(contracts.delete().where(contracts.c.id == 5))
+    conn.execute(units.update().where(units.c.id % 5 == 0).values(status="فاضي"))
+    conn.execute(units.delete().where(units.c.id == 2))
+    assert drift(app, conn) == ""
+
+
+def test_contract_inserted_after_its_payments(app, conn):
+    conn.execute(insert(app.Payment.__table__), [{
+        "contract_id": CONTRACTS + 1, "payment_number": i + 1,
+        "due_date": date.today() - timedelta(days=40 - 10 * i), "total": 500.0,
+        "status": "مدفوع" if i == 0 else "مستحق",
+    } for i in range(6)])
+    conn.execute(insert(app.Contract.__table__).values(id=CONTRACTS + 1, contract_number="late", status="نشط"))
+    assert drift(app, conn) == ""
+
+
+def test_roll_forward_in_steps(app, conn):
+    today = date.today()
+    for days_back in (20, 10, 1, 0):
+        assert drift(app, conn, today - timedelta(days=days_back)) == ""
+
+
+def test_read_includes_overdue_since_last_roll_forward(app, conn):
+    today = date.today()
+    row = conn.execute(app.kpi_current_statement(), {"today": today}).one()._mapping
+    assert app.kpi_drift(row, app.compute_kpis(conn, today)) == ""
+    stored = conn.execute(select(app.kpi_summary.c.overdue_as_of)).scalar()
+    assert stored == today - timedelta(days=30)  # القراءة لا ترحّل
@@ -0,0 +1,75 @@
+"""TwoTierCache.call: single-flight للطلبات المتزامنة و stale-while-revalidate بعد ttl"""
+import threading
+import time
+
+import pytest
+from sqlalchemy import event
+
+CALLERS = 20
+DELAY = 0.2
+
+
+@pytest.fixture
+def cache(app, tmp_path):
+    return app.TwoTierCache(str(tmp_path), 16 * 1024 * 1024, 16 * 1024 * 1024)
+
+
+@pytest.fixture
+def query(sqlite_engine):
+    """استعلام بطيء على SQLite؛ executed يسجل كل تنفيذ فعلي له"""
+    executed = []
+    event.listen(sqlite_engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: executed.append(statement) if "42" in statement else None)
+
+    def run():
+        with sqlite_engine.connect() as conn:
+            time.sleep(DELAY)
+            return conn.exec_driver_sql("SELECT 42").scalar()
+
+    run.executed = executed
+    return run
+
+
+def call_concurrently(cache, compute, n=CALLERS, **kwargs):
+    barrier = threading.Barrier(n)
+    results = []
+
+    def caller():
+        barrier.wait()
+        results.append(cache.call("single_flight", ("key",), compute, **kwargs))
+
+    threads = [threading.Thread(target=caller) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_misses_run_the_query_once(cache, query):
+    results = call_concurrently(cache, query, ttl=60)
+
+    assert results == [42] * CALLERS
+    assert len(query.executed) == 1
+    stats = cache.stats["single_flight"]
+    assert stats["miss"] == 1
+    assert stats["coalesced"] == CALLERS - 1
+
+
+def test_stale_value_is_served_while_one_refresh_runs(cache, query):
+    assert call_concurrently(cache, query, n=1, ttl=0.3, stale_ttl=60) == [42]
+    time.sleep(0.4)  # انتهاء ttl
+
+    t0 = time.perf_counter()
+    results = call_concurrently(cache, query, ttl=0.3, stale_ttl=60)
+    elapsed = time.perf_counter() - t0
+
+    assert results == [42] * CALLERS
+    assert elapsed < DELAY  # لا أحد ينتظر الاستعلام
+    assert cache.stats["single_flight"]["stale"] == CALLERS
+
+    deadline = time.time() + 5
+    while len(query.executed) < 2 and time.time() < deadline:
+        time.sleep(0.02)
+    time.sleep(DELAY * 2)  # مهلة لأي تحديث إضافي (خاطئ) كي يظهر
+    assert len(query.executed) == 2  # الحساب الأول + تحديث واحد في الخلفية